@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark Client against a local FakeServer.
+
+Measures cold start (login and device fetch) as the number of devices grows,
+command round-trip latency and pipelined command throughput:
+
+> python benchmarks/bench_client.py --latency 0.02 --output results.json
+"""
+
+from common import argument_parser, main_report, summarize, timed
+
+import greendo
+from greendo.fake import FakeServer
+
+def bench_cold_start(device_counts, latency, repeat):
+    results = {}
+    for n in device_counts:
+        with FakeServer(devices=n, latency=latency) as server:
+            samples = []
+            for _ in range(repeat):
+                # A fresh pool, so every start pays for its handshakes.
+                client, elapsed = timed(greendo.Client, server.username, server.password,
+                                        transport=greendo.ConnectionPool(), **server.client_args())
+                client.close()
+                samples.append(elapsed)
+        results["devices_{}".format(n)] = summarize(samples)
+    return results
+
+def bench_commands(commands, latency, ws_latency):
+    with FakeServer(devices=1, latency=latency, ws_latency=ws_latency) as server:
+        client = greendo.Client(server.username, server.password, **server.client_args())
+        device = client.devices[0]
+        # Connect the socket before timing anything.
+        client.send_command(device.cmd_light(False), timeout=10)
+
+        samples = []
+        for i in range(commands):
+            _, elapsed = timed(client.send_command, device.cmd_fan(i % 100), timeout=10)
+            samples.append(elapsed)
+
+        def pipelined():
+            futures = [client.submit_command(device.cmd_fan(i % 100)) for i in range(commands)]
+            for f in futures:
+                f.result(30)
+        _, elapsed = timed(pipelined)
+        client.close()
+
+    return {
+        "round_trip": summarize(samples),
+        "sequential_per_s": commands / sum(samples),
+        "pipelined_per_s": commands / elapsed,
+    }
+
+def main():
+    ap = argument_parser(__doc__)
+    ap.add_argument("--latency", type=float, default=0.005, help="Seconds the fake server takes per HTTP request.")
+    ap.add_argument("--ws-latency", type=float, default=0.0, help="Seconds the fake server takes per command.")
+    ap.add_argument("--devices", type=int, nargs="+", default=[1, 10, 50, 100, 500],
+                    help="Device counts to measure cold start with.")
+    ap.add_argument("--repeat", type=int, default=3, help="Cold starts per device count.")
+    ap.add_argument("--commands", type=int, default=500, help="Commands to send for latency and throughput.")
+    args = ap.parse_args()
+
+    results = {
+        "cold_start": bench_cold_start(args.devices, args.latency, args.repeat),
+        "commands": bench_commands(args.commands, args.latency, args.ws_latency),
+    }
+    main_report("client", results, args)
+
+if __name__ == '__main__':
+    main()
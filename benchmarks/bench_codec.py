@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark the per-command CPU cost of building, encoding and decoding.
+
+For each installed JSON codec, measures (in microseconds per command):
+
+- command: building a command with a Device command function,
+- encode_plain: encoding it with its id in full,
+- encode_template: encoding it with _encode_command, which reuses the encoded
+  params of earlier commands to the same module,
+- decode_reply: decoding a command reply,
+- decode_details: decoding a device details response.
+
+> python benchmarks/bench_codec.py --iterations 100000
+"""
+
+import json
+import time
+
+from common import argument_parser, main_report
+
+import greendo
+from greendo.fake import fake_device
+
+def per_call_us(fn, iterations):
+    started = time.time()
+    for i in range(iterations):
+        fn(i)
+    return 1e6 * (time.time() - started) / iterations
+
+def bench_codec(name, iterations):
+    greendo.set_codec(name)
+    codec = greendo.get_codec()
+    meta, details = fake_device(0)
+    device = greendo.Device(meta, details)
+    client = greendo._ClientBase("user@example.com", None, None, 1, None, None, None, None)
+    cmd = device.cmd_fan(50)
+    msg = dict(cmd, id=12345)
+    reply = json.dumps({"jsonrpc": "2.0", "id": 12345, "result": {"msgType": 16, "topic": device.id}})
+    body = json.dumps({"result": [details]}).encode("utf8")
+    return {
+        "command_us": per_call_us(lambda i: device.cmd_fan(i % 100), iterations),
+        "encode_plain_us": per_call_us(lambda i: codec.dumps(msg), iterations),
+        "encode_template_us": per_call_us(lambda i: client._encode_command(msg), iterations),
+        "decode_reply_us": per_call_us(lambda i: codec.loads(reply), iterations),
+        "decode_details_us": per_call_us(lambda i: codec.loads(body), iterations // 10),
+    }
+
+def main():
+    ap = argument_parser(__doc__)
+    ap.add_argument("--iterations", type=int, default=50000, help="Calls to time for each measurement.")
+    args = ap.parse_args()
+
+    results = {}
+    for name in ("json", "ujson", "orjson"):
+        try:
+            results[name] = bench_codec(name, args.iterations)
+        except ImportError:
+            pass
+    main_report("codec", results, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the history Recorder and History queries.
+
+Appends --samples samples spread over --devices devices, one second apart,
+then measures:
+
+- write_per_s: samples appended (and flushed) per second,
+- query_hour_ms: reading one hour of samples into arrays,
+- query_all_ms: reading every sample into arrays,
+- bytes_per_sample: the size of the log and its index, per sample.
+
+> python benchmarks/bench_history.py --samples 2000000
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from common import argument_parser, main_report, timed
+
+from greendo.history import History, Recorder
+
+def main():
+    ap = argument_parser(__doc__)
+    ap.add_argument("--samples", type=int, default=1000000, help="Samples to write.")
+    ap.add_argument("--devices", type=int, default=1000, help="Devices to spread them over.")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "history.log")
+        ids = ["device{}".format(i) for i in range(args.devices)]
+        started = time.time()
+        with Recorder(path) as recorder:
+            append = recorder.append
+            for i in range(args.samples):
+                append(ids[i % args.devices], door=i & 1, position=i % 100, charge=i % 101, light=0, fan=50,
+                       t=float(i))
+            recorder.flush()
+        results = {"write_per_s": args.samples / (time.time() - started)}
+
+        with History(path) as h:
+            middle = args.samples // 2
+            _, results["query_hour_s"] = timed(h.query, middle, middle + 3600)
+            _, results["query_all_s"] = timed(h.query)
+        results["query_hour_ms"] = 1000 * results.pop("query_hour_s")
+        results["query_all_ms"] = 1000 * results.pop("query_all_s")
+        size = os.path.getsize(path) + os.path.getsize(path + ".idx")
+        results["bytes_per_sample"] = float(size) / args.samples
+    finally:
+        shutil.rmtree(tmp)
+    main_report("history", results, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the diff engine, and the MQTT bridge against a local broker.
+
+Always measures:
+
+- diff_unchanged_us: diffing a device that didn't change,
+- diff_changed_us: diffing a device with one changed field.
+
+With --broker (and paho-mqtt installed), also bridges a FakeServer with
+--devices devices to the broker, pushes --updates position updates to
+them, and measures:
+
+- updates_per_s: pushed updates applied and diffed per second,
+- published_per_s: messages published per second, after batching.
+
+> mosquitto -p 1883 &
+> python benchmarks/bench_mqtt.py --broker localhost --devices 100 --updates 20000
+"""
+
+import time
+
+from common import argument_parser, main_report
+
+import greendo
+from greendo.diff import DiffEngine
+from greendo.fake import FakeServer, fake_device
+
+def bench_diff(iterations):
+    engine = DiffEngine()
+    device = greendo.Device(*fake_device(0))
+    key = device.door.key + ".doorPosition"
+    engine.update(device)
+    started = time.time()
+    for _ in range(iterations):
+        engine.update(device)
+    unchanged = time.time() - started
+    started = time.time()
+    for i in range(iterations):
+        device.apply_update({key: {"value": i}})
+        engine.update(device)
+    changed = time.time() - started
+    return {"diff_unchanged_us": 1e6 * unchanged / iterations, "diff_changed_us": 1e6 * changed / iterations}
+
+def bench_bridge(broker, port, devices, updates, batch_interval):
+    from greendo.mqtt import MQTTBridge
+    with FakeServer(devices=devices) as server:
+        client = greendo.Client(server.username, server.password, **server.client_args())
+        bridge = MQTTBridge(client, broker=broker, port=port, batch_interval=batch_interval)
+        bridge.start()
+        published = bridge.published
+        ids = [d.id for d in client.devices]
+        key = client.devices[0].door.key + ".doorPosition"
+        last = client.devices[(updates - 1) % devices]
+        started = time.time()
+        for i in range(updates):
+            server.push(ids[i % devices], {key: i + 1})
+        client.wait_for_position(last, updates, timeout=60)
+        applied = time.time() - started
+        bridge.stop()
+        elapsed = time.time() - started
+        client.close()
+    return {"updates_per_s": updates / applied, "published_per_s": (bridge.published - published) / elapsed}
+
+def main():
+    ap = argument_parser(__doc__)
+    ap.add_argument("--iterations", type=int, default=100000, help="Diffs to time.")
+    ap.add_argument("--broker", type=str, help="Host of an MQTT broker to bridge to.")
+    ap.add_argument("--port", type=int, default=1883, help="Port of the broker.")
+    ap.add_argument("--devices", type=int, default=100, help="Devices on the fake server.")
+    ap.add_argument("--updates", type=int, default=20000, help="Updates to push.")
+    ap.add_argument("--batch-interval", type=float, default=0.1, help="Seconds the bridge batches changes for.")
+    args = ap.parse_args()
+
+    results = bench_diff(args.iterations)
+    if args.broker:
+        results.update(bench_bridge(args.broker, args.port, args.devices, args.updates, args.batch_interval))
+    main_report("mqtt", results, args)
+
+if __name__ == '__main__':
+    main()
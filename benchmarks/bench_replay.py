@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the client against a replayed capture, offline.
+
+Serves --copies copies of every device in a capture (made with a Client
+given a greendo.replay.TrafficRecorder, or with greendo.py --record), as
+fast as possible, and measures:
+
+- connect_s: logging in and fetching every device's details,
+- device_build_us: constructing a Device from captured details,
+- commands_per_s: pipelined command throughput,
+- pushes_per_s: replayed updates applied to devices per second.
+
+Without --capture, a capture is made against a FakeServer first.
+
+> python benchmarks/bench_replay.py --capture capture.jsonl --copies 200
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from common import argument_parser, main_report, timed
+
+import greendo
+from greendo.fake import FakeServer
+from greendo.replay import ReplayServer, TrafficRecorder
+
+def make_capture(path, pushes):
+    """Capture a short session against a FakeServer."""
+    with FakeServer(devices=2) as server, TrafficRecorder(path) as recorder:
+        client = greendo.Client(server.username, server.password, record=recorder, **server.client_args())
+        device = client.devices[0]
+        client.send_command(device.cmd_light(True), timeout=5)
+        client.subscribe(lambda update: None)
+        for i in range(pushes):
+            server.push(device.id, {device.door.key + ".doorPosition": i + 1})
+        client.wait_for_position(device, pushes, timeout=10)
+        client.close()
+
+def main():
+    ap = argument_parser(__doc__)
+    ap.add_argument("--capture", type=str, help="The capture to replay.")
+    ap.add_argument("--copies", type=int, default=100, help="Copies of each captured device to serve.")
+    ap.add_argument("--commands", type=int, default=2000, help="Commands to send.")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = args.capture
+        if path is None:
+            path = os.path.join(tmp, "capture.jsonl")
+            make_capture(path, pushes=20)
+        results = {}
+        with ReplayServer(path, speed=None, copies=args.copies) as server:
+            client, results["connect_s"] = timed(greendo.Client, server.username, server.password,
+                                                 max_workers=8, **server.client_args())
+            meta, details = server.devices[0]
+            _, build = timed(lambda: [greendo.Device(meta, details) for _ in range(1000)])
+            results["device_build_us"] = 1000.0 * build
+
+            devices = client.devices
+            started = time.time()
+            futures = [client.submit_command(devices[i % len(devices)].cmd_fan(i % 100))
+                       for i in range(args.commands)]
+            for future in futures:
+                future.result(30)
+            results["commands_per_s"] = args.commands / (time.time() - started)
+
+            expected = len(server.updates()) * args.copies
+            applied = []
+            done = threading.Event()
+
+            def on_update(update):
+                applied.append(update)
+                if len(applied) >= expected:
+                    done.set()
+            client.subscribe(on_update)
+            started = time.time()
+            server.play()
+            done.wait(60)
+            results["pushes_per_s"] = len(applied) / (time.time() - started)
+            client.close()
+    finally:
+        shutil.rmtree(tmp)
+    main_report("replay", results, args)
+
+if __name__ == '__main__':
+    main()
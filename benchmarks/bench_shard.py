@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark ShardedPoller throughput as worker processes are added.
+
+The fake server runs in a process of its own, so it doesn't compete with the
+workers for the GIL (it can still be the bottleneck on a machine with few
+cores). Polling runs flat out (interval 0), and the result is how many
+device statuses are polled per second:
+
+> python benchmarks/bench_shard.py --accounts 40 --devices 25 --processes 1 2 4
+"""
+
+import multiprocessing
+import time
+
+from common import argument_parser, main_report
+
+from greendo.fake import FakeServer
+from greendo.shard import ShardedPoller
+
+def serve(accounts, devices, latency, conn):
+    """Run a FakeServer with accounts of devices each, until told to stop over conn."""
+    with FakeServer(devices=devices, latency=latency) as server:
+        for i in range(1, accounts):
+            server.add_account("user{}@example.com".format(i), devices=devices)
+        conn.send((server.client_args(), [(u, p) for u, (p, _) in server.accounts.items()]))
+        conn.recv()
+
+def bench_processes(client_args, accounts, devices, processes, duration):
+    poller = ShardedPoller(accounts, processes=processes, interval=0, **client_args)
+    poller.start()
+    try:
+        # Wait for every worker to log in and poll each device once.
+        deadline = time.time() + 60
+        while len(poller.status) < devices and time.time() < deadline:
+            poller.read(0.1)
+        polled = poller.polled
+        started = time.time()
+        poller.read(duration)
+        return {"polled_per_s": (poller.polled - polled) / (time.time() - started)}
+    finally:
+        poller.stop()
+
+def main():
+    ap = argument_parser(__doc__)
+    ap.add_argument("--accounts", type=int, default=40, help="Accounts on the fake server.")
+    ap.add_argument("--devices", type=int, default=25, help="Devices per account.")
+    ap.add_argument("--latency", type=float, default=0.0, help="Seconds the fake server takes per HTTP request.")
+    ap.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4],
+                    help="Worker process counts to measure.")
+    ap.add_argument("--duration", type=float, default=5.0, help="Seconds to poll for at each process count.")
+    args = ap.parse_args()
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(args.accounts, args.devices, args.latency, child))
+    server.daemon = True
+    server.start()
+    client_args, accounts = parent.recv()
+    try:
+        results = {}
+        for n in args.processes:
+            results["processes_{}".format(n)] = bench_processes(client_args, accounts, args.accounts * args.devices,
+                                                                n, args.duration)
+    finally:
+        parent.send("stop")
+        server.join()
+    main_report("shard", results, args)
+
+if __name__ == '__main__':
+    main()
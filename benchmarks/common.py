@@ -0,0 +1,99 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers shared by the benchmark scripts.
+
+Every script collects a flat dict of named numbers and hands it to main_report,
+which prints it, optionally saves it as JSON and compares it with a saved run:
+
+> python benchmarks/bench_client.py --output before.json
+> python benchmarks/bench_client.py --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+def timed(fn, *args, **kwargs):
+    """Call fn, returning its result and how many seconds it took."""
+    start = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - start
+
+def percentile(samples, pct):
+    """Return the pct percentile (0 to 100) of samples."""
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    i = int(round((len(ordered) - 1) * pct / 100.0))
+    return ordered[i]
+
+def summarize(samples):
+    """Return the mean, p50, p95 and max of samples, in milliseconds."""
+    return {
+        "mean_ms": 1000.0 * sum(samples) / len(samples),
+        "p50_ms": 1000.0 * percentile(samples, 50),
+        "p95_ms": 1000.0 * percentile(samples, 95),
+        "max_ms": 1000.0 * max(samples),
+    }
+
+def flatten(results, prefix=""):
+    """Flatten nested result dicts into "a.b.c" keys."""
+    flat = {}
+    for key, value in results.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        else:
+            flat[name] = value
+    return flat
+
+def argument_parser(description):
+    """Return an argument parser with the options every benchmark has."""
+    ap = argparse.ArgumentParser(description=description)
+    ap.add_argument("--output", "-o", type=str, help="Save the results as JSON to this file.")
+    ap.add_argument("--compare", "-c", type=str, help="Compare with results saved by an earlier run.")
+    return ap
+
+def main_report(name, results, args):
+    """Print results, saving and comparing them as args ask."""
+    flat = flatten(results)
+    report = {
+        "benchmark": name,
+        "python": platform.python_version(),
+        "time": time.time(),
+        "results": flat,
+    }
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    width = max(len(k) for k in flat)
+    for key in sorted(flat):
+        value = flat[key]
+        line = "{:<{}}  {:>14.3f}".format(key, width, value)
+        old = baseline.get(key)
+        if old:
+            line += "  {:>14.3f}  {:+7.1f}%".format(old, 100.0 * (value - old) / old)
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
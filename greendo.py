@@ -22,22 +22,68 @@ Can be used on the command line by specifying a command and optional values for
 > python greendo.py light off
 > python greendo.py status door
 
+To avoid logging in on every run, start a daemon that keeps a client logged in:
+
+> python greendo.py serve &
+
+Later runs find it through its Unix socket and have it do the work, falling back to
+logging in themselves when it isn't running, or is logged in with another --email.
+
 See help for more details.
 """
 
+from __future__ import print_function
+
 import greendo
 import json
 import argparse
+import os
+import socket
+import stat
+import sys
+import time
 
 from getpass import getpass
 from contextlib import closing
 
-def main():
+if sys.version_info[0] > 2:
+    from io import StringIO
+    from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+else:
+    from StringIO import StringIO
+    from SocketServer import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+    class ThreadingUnixStreamServer(ThreadingMixIn, UnixStreamServer):
+        pass
+
+# Options that only matter to the process that logs in, so they aren't sent to a daemon.
+_LOCAL_OPTIONS = ("email", "pwd", "session", "cache", "record", "socket", "direct")
+
+# Seconds to wait on the daemon before running a command directly instead.
+FORWARD_TIMEOUT = 30
+
+def default_socket_path():
+    """Return where the daemon listens by default."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "greendo.sock")
+    return os.path.expanduser("~/.greendo.sock")
+
+def parser():
     ap = argparse.ArgumentParser(prog="greendo")
     ap.add_argument("--email", "-u", type=str, help="Email address registered with the GDO app. Default: request from stdin.")
     ap.add_argument("--pwd", "-p", type=str, help="Password for the registered email. Default: request from stdin.")
     ap.add_argument("--dry", "-n", action="store_true", help="Dry run - don't execute commands, just display them")
+    ap.add_argument("--session", "-s", type=str,
+                    help="File to keep the login session in, so later runs can skip logging in.")
+    ap.add_argument("--cache", type=str,
+                    help="File to cache device details in, so later runs can skip fetching them.")
+    ap.add_argument("--record", type=str,
+                    help="File to capture all traffic with the API to, for greendo.replay.ReplayServer.")
     ap.add_argument("--dev", "-d", type=int, default=0, help="Door opener device index, if you have more than one.")
+    ap.add_argument("--socket", type=str, default=default_socket_path(),
+                    help="Unix socket of the daemon started with 'serve'. Default: %(default)s")
+    ap.add_argument("--direct", action="store_true", help="Don't use a running daemon, even if there is one.")
     sub_ap = ap.add_subparsers(dest="target", help="Commands")
 
     ap_status = sub_ap.add_parser("status", help="Output status for a given subsystem.")
@@ -65,84 +111,242 @@ def main():
     ap_preset_pos = sub_ap.add_parser("preset", help="Set the preset position in integer inches.")
     ap_preset_pos.add_argument("inches", type=int)
 
-    args = ap.parse_args()
+    sub_ap.add_parser("serve", help="Stay logged in and run commands for other invocations, over --socket.")
 
-    email = args.email
-    pwd = args.pwd
-    if args.email is None:
-        email = input("email: ").strip()
-    if args.pwd is None:
-        pwd = getpass("password: ").strip()
+    ap_mqtt = sub_ap.add_parser("mqtt", help="Stay logged in and bridge every device to an MQTT broker.")
+    ap_mqtt.add_argument("--broker", type=str, default="localhost", help="Host of the broker. Default: %(default)s")
+    ap_mqtt.add_argument("--port", type=int, default=1883, help="Port of the broker. Default: %(default)s")
+    ap_mqtt.add_argument("--prefix", type=str, default="greendo", help="First level of every topic. Default: %(default)s")
+    return ap
+
+def run(args, client, out):
+    """Run the command in args with client, writing what it prints to out."""
+    device = client.devices[max(0, min(args.dev, len(client.devices) - 1))]
+    cmd = None
+    if args.target == "status":
+        thing = args.thing
+        if thing == "config":
+            print("Session:\n", json.dumps(client.session.data, indent=2), file=out)
+            print("Devices:\n", json.dumps([{"meta": d.meta, "data": d.data} for d in client.devices], indent=2), file=out)
+        elif thing == "charger":
+            print(json.dumps({
+                "level": device.charger.level()
+            }, indent=2), file=out)
+        elif thing == "door":
+            door = device.door
+            print(json.dumps({
+                "status": door.door_status(),
+                "error": door.door_error(),
+                "pos": door.door_pos(),
+                "max": door.door_max(),
+                "preset": door.preset_pos(),
+                "motion": door.motion(),
+                "alarm": door.alarm(),
+                "motor": door.motor(),
+                "sensor": door.sensor(),
+                "vacation": door.vacation(),
+            }, indent=2), file=out)
+        elif thing == "light":
+            light = device.light
+            print(json.dumps({
+                "light": light.on(),
+                "timer": light.timer(),
+            }, indent=2), file=out)
+        elif thing == "fan":
+            print(json.dumps({
+                "speed": device.fan.speed(),
+            }, indent=2), file=out)
+        return
+
+    if args.target == "door":
+        if args.cmd == "open":
+            cmd = device.cmd_open()
+        elif args.cmd == "close":
+            cmd = device.cmd_close()
+        else:
+            cmd = device.cmd_preset()
+    elif args.target == "motion":
+        cmd = device.cmd_motion(args.set == "on")
+    elif args.target == "light":
+        cmd = device.cmd_light(args.set == "on")
+    elif args.target == "lighttimer":
+        cmd = device.cmd_light_timer(max(0, args.minutes))
+    elif args.target == "fan":
+        cmd = device.cmd_fan(max(0, min(100, args.speed)))
+    elif args.target == "vacation":
+        cmd = device.cmd_vacation(args.set == "on")
+    elif args.target == "preset":
+        cmd = device.cmd_preset_pos(max(0, args.inches))
+
+    if args.dry:
+        print("Dry Run:", file=out)
+        print(json.dumps(cmd, indent=2), file=out)
+        return
 
-    with closing(greendo.Client(email, pwd)) as client:
-        device = client.devices[max(0, min(args.dev, len(client.devices)))]
-        cmd = None
-        if args.target == "status":
-            thing = args.thing
-            if thing == "config":
-                print("Session:\n", json.dumps(client.session.data, indent=2))
-                print("Devices:\n", json.dumps([{"meta": d.meta, "data": d.data} for d in client.devices], indent=2))
-            elif thing == "charger":
-                print(json.dumps({
-                    "level": device.charger.level()
-                }, indent=2))
-            elif thing == "door":
-                door = device.door
-                print(json.dumps({
-                    "status": door.door_status(),
-                    "error": door.door_error(),
-                    "pos": door.door_pos(),
-                    "max": door.door_max(),
-                    "preset": door.preset_pos(),
-                    "motion": door.motion(),
-                    "alarm": door.alarm(),
-                    "motor": door.motor(),
-                    "sensor": door.sensor(),
-                    "vacation": door.vacation(),
-                }, indent=2))
-            elif thing == "light":
-                light = device.light
-                print(json.dumps({
-                    "light": light.on(),
-                    "timer": light.timer(),
-                }, indent=2))
-            elif thing == "fan":
-                print(json.dumps({
-                    "speed": device.fan.speed(),
-                }, indent=2))
+    print("Request to {}:".format(client.API_URL_SOCKET), file=out)
+    print(json.dumps(cmd, indent=2), file=out)
+
+    result = client.send_command(cmd)
+    print("Response:", file=out)
+    print(json.dumps(result, indent=2), file=out)
+
+class _DaemonHandler(StreamRequestHandler):
+    """Runs one forwarded command per connection.
+
+    The daemon first sends a JSON line with the username it is logged in
+    as, then reads a JSON line with the command and answers with another.
+    """
+
+    def handle(self):
+        self.wfile.write((json.dumps({"username": self.server.client.username}) + "\n").encode("utf8"))
+        self.wfile.flush()
+        line = self.rfile.readline()
+        if not line:
+            # Not our account; the other end runs the command itself.
             return
+        out = StringIO()
+        error = None
+        try:
+            request = json.loads(line.decode("utf8"))
+            run(argparse.Namespace(**request), self.server.client, out)
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        reply = {"output": out.getvalue(), "error": error}
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf8"))
+
+def serve(client, path):
+    """Run commands sent to the Unix socket at path with client, until interrupted."""
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise ValueError("{} exists and is not a socket".format(path))
+        conn = _connect(path, FORWARD_TIMEOUT)
+        if conn is not None:
+            conn.close()
+            raise ValueError("a daemon is already listening on {}".format(path))
+        os.unlink(path)
+    # Keep device status current without fetching it again.
+    client.subscribe(lambda update: None)
+    # Only the owner may connect, from the moment the socket exists.
+    umask = os.umask(0o177)
+    try:
+        server = ThreadingUnixStreamServer(path, _DaemonHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.client = client
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def bridge_mqtt(client, args):
+    """Bridge client to the MQTT broker in args until interrupted."""
+    from greendo.mqtt import MQTTBridge
+    with MQTTBridge(client, broker=args.broker, port=args.port, prefix=args.prefix):
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+def _connect(path, timeout):
+    """Connect to the daemon at path, or return None if none is listening."""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        conn.connect(path)
+    except socket.error:
+        # A socket left behind by a daemon that is gone.
+        conn.close()
+        return None
+    return conn
+
+def forward(args, timeout=FORWARD_TIMEOUT):
+    """Have the daemon listening on args.socket run args.
+
+    Args:
+        args: The parsed command line.
+        timeout: Seconds to wait for the daemon at each step.
 
-        if args.target == "door":
-            if args.cmd == "open":
-                cmd = device.cmd_open()
-            elif args.cmd == "close":
-                cmd = device.cmd_close()
-            else:
-                cmd = device.cmd_preset()
-        elif args.target == "motion":
-            cmd = device.cmd_motion(args.set == "on")
-        elif args.target == "light":
-            cmd = device.cmd_light(args.set == "on")
-        elif args.target == "lighttimer":
-            cmd = device.cmd_lighttimer(max(0, args.minutes))
-        elif args.target == "fan":
-            cmd = device.cmd_fan(max(0, min(100, args.speed)))
-        elif args.target == "vacation":
-            cmd = device.cmd_vacation(args.set == "on")
-        elif args.target == "preset":
-            cmd = device.cmd_preset(max(0, args.inches))
-
-        if args.dry:
-            print("Dry Run:")
-            print(json.dumps(cmd, indent=2))
+    Returns:
+        The daemon's reply, or None if no daemon is listening, it is logged
+        in as someone other than args.email, or it doesn't answer in time.
+    """
+    if args.direct or not os.path.exists(args.socket):
+        return None
+    request = dict((k, v) for k, v in vars(args).items() if k not in _LOCAL_OPTIONS)
+    conn = _connect(args.socket, timeout)
+    if conn is None:
+        return None
+    with closing(conn):
+        with closing(conn.makefile("rb")) as f:
+            try:
+                line = f.readline()
+                if not line:
+                    return None
+                hello = json.loads(line.decode("utf8"))
+                if args.email is not None and args.email.lower() != hello["username"].lower():
+                    return None
+                conn.sendall((json.dumps(request) + "\n").encode("utf8"))
+                line = f.readline()
+            except socket.error:
+                # Stuck or gone; the caller runs the command itself.
+                return None
+            if not line:
+                return None
+            return json.loads(line.decode("utf8"))
+
+def main():
+    args = parser().parse_args()
+
+    if args.target not in ("serve", "mqtt"):
+        reply = forward(args)
+        if reply is not None:
+            sys.stdout.write(reply["output"])
+            if reply["error"]:
+                sys.exit(reply["error"])
             return
 
-        print("Request to {}:".format(client.API_URL_SOCKET))
-        print(json.dumps(cmd, indent=2))
+    email = args.email
+    pwd = args.pwd
+    store = None
+    if args.session:
+        store = greendo.SessionStore(args.session)
+    if args.email is None:
+        email = input("email: ").strip()
+    if args.pwd is None and (store is None or not store.has(email)):
+        pwd = getpass("password: ").strip()
 
-        result = client.send_command(cmd)
-        print("Response:")
-        print(json.dumps(result, indent=2))
+    # A daemon (or bridge) serves every device, and outlives socket drops; a
+    # single run only needs the device it targets.
+    # Clamped as run() clamps it, so the device it loads is the one run() uses.
+    device, reconnect = max(0, args.dev), None
+    if args.target in ("serve", "mqtt"):
+        device, reconnect = None, greendo.Reconnect()
+    cache = greendo.ResponseCache(path=args.cache) if args.cache else None
+    recorder = None
+    if args.record:
+        from greendo.replay import TrafficRecorder
+        recorder = TrafficRecorder(args.record)
+    try:
+        with closing(greendo.Client(email, pwd, session_store=store, device=device, reconnect=reconnect,
+                                    cache=cache, record=recorder)) as client:
+            if args.target == "serve":
+                try:
+                    serve(client, args.socket)
+                except KeyboardInterrupt:
+                    pass
+                except ValueError as e:
+                    sys.exit(str(e))
+                return
+            if args.target == "mqtt":
+                bridge_mqtt(client, args)
+                return
+            run(args, client, sys.stdout)
+    finally:
+        if recorder is not None:
+            recorder.close()
 
 if __name__ == '__main__':
     main()
@@ -15,20 +15,195 @@
 # limitations under the License.
 
 
+import itertools
 import json
+import logging
+import os
+import random
+import select
+import socket
 import sys
-import websocket
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 if sys.version_info[0] > 2:
-    from http.cookiejar import CookieJar
-    from urllib.request import build_opener, Request, HTTPCookieProcessor
+    import queue
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+    from http.cookiejar import Cookie, CookieJar
+    from urllib.parse import urlsplit
+    from urllib.request import Request
 else:
-    from cookielib import CookieJar
-    from urllib2 import build_opener, Request, HTTPCookieProcessor
+    import Queue as queue
+    from cookielib import Cookie, CookieJar
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib2 import Request
+    from urlparse import urlsplit
 
 # TODO: is pprint used?
 from pprint import pprint, pformat
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+
+_log = logging.getLogger(__name__)
+
+class Codec(namedtuple("Codec", "name loads dumps")):
+    """A JSON implementation, used for everything sent to and from the server.
+
+    Attributes:
+        name: Its name, e.g., "json" or "orjson".
+        loads: Decodes a str or bytes.
+        dumps: Encodes an object compactly, returning a str.
+    """
+
+def _load_codec(name):
+    """Return the Codec called name.
+
+    Raises:
+        ImportError: The library isn't installed.
+        ValueError: There is no such codec.
+    """
+    if name == "orjson":
+        import orjson
+        return Codec(name, orjson.loads, lambda obj: orjson.dumps(obj).decode("utf8"))
+    if name == "ujson":
+        import ujson
+        return Codec(name, ujson.loads, ujson.dumps)
+    if name == "json":
+        # json.dumps makes a new encoder per call when given options.
+        return Codec(name, json.loads, json.JSONEncoder(separators=(",", ":")).encode)
+    raise ValueError("unknown JSON codec {!r}".format(name))
+
+def _default_codec():
+    """Return the fastest Codec installed."""
+    for name in ("orjson", "ujson"):
+        try:
+            return _load_codec(name)
+        except ImportError:
+            pass
+    return _load_codec("json")
+
+_codec = _default_codec()
+
+def set_codec(codec):
+    """Choose the JSON implementation. By default it's the fastest installed.
+
+    Args:
+        codec: A Codec, or the name of one: "json", "orjson" or "ujson".
+    """
+    global _codec
+    if not isinstance(codec, Codec):
+        codec = _load_codec(codec)
+    _codec = codec
+
+def get_codec():
+    """Return the Codec in use."""
+    return _codec
+
+def _endpoint(path):
+    """Return the API endpoint of path, with any device id replaced by "{id}"."""
+    if path.startswith("/devices/"):
+        return "/devices/{id}"
+    return path
+
+def _command_name(cmd):
+    """Name the kind of a web socket command, e.g., "gdoModuleCommand:lightState"."""
+    name = cmd.get("method") or "unknown"
+    msg = (cmd.get("params") or {}).get("moduleMsg")
+    if isinstance(msg, dict):
+        name += ":" + ",".join(sorted(msg))
+    return name
+
+# Module command fields that make the unit do something, rather than set a value.
+_ACTION_FIELDS = frozenset(["doorCommand"])
+
+def _coalesce(cmds):
+    """Drop the commands that a later command in cmds overwrites.
+
+    Module commands setting the same fields of the same module overwrite each
+    other, so only the last is kept, in its place. Actions (door commands) are
+    all kept, in order, and nothing is merged across an action on the same
+    module, so values set before it are still in effect when it runs.
+
+    Returns:
+        The commands to send, and for each command in cmds, the index of the
+        one sent in its place.
+    """
+    generations = {}
+    keys = []
+    for cmd in cmds:
+        params = cmd.get("params") or {}
+        msg = params.get("moduleMsg")
+        key = None
+        if cmd.get("method") == "gdoModuleCommand" and isinstance(msg, dict):
+            module = (params.get("topic"), params.get("moduleType"), params.get("portId"))
+            if _ACTION_FIELDS.intersection(msg):
+                generations[module] = generations.get(module, 0) + 1
+            else:
+                key = (module, generations.get(module, 0), tuple(sorted(msg)))
+        keys.append(key)
+
+    last = dict((key, i) for i, key in enumerate(keys) if key is not None)
+    sent = []
+    slots = {}
+    for i, key in enumerate(keys):
+        if key is None or last[key] == i:
+            slots[i] = len(sent)
+            sent.append(cmds[i])
+    return sent, [slots[i if key is None else last[key]] for i, key in enumerate(keys)]
+
+def _bounded_map(fn, items, max_workers):
+    """Call fn on each item using at most max_workers threads.
+
+    Args:
+        fn: The function to call with each item.
+        items: The items to call fn with.
+        max_workers: The maximum number of concurrent calls.
+
+    Returns:
+        A list of results, in the same order as items.
+
+    Raises:
+        The exception raised by the first item (in order) whose call failed.
+    """
+    items = list(items)
+    workers = max(1, min(max_workers, len(items)))
+    if workers == 1:
+        return [fn(item) for item in items]
+
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    lock = threading.Lock()
+    pending = iter(range(len(items)))
+    failed = []
+
+    def work():
+        while True:
+            with lock:
+                i = None if failed else next(pending, None)
+            if i is None:
+                return
+            try:
+                results[i] = fn(items[i])
+            except Exception:
+                errors[i] = sys.exc_info()
+                failed.append(i)
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    for exc_info in errors:
+        if exc_info is not None:
+            raise exc_info[1]
+    return results
 
 class _Response(namedtuple("_Response", "code error data raw")):
     """Holds useful data from web responses, making it easier to detect errors, etc.
@@ -41,11 +216,17 @@ class _Response(namedtuple("_Response", "code error data raw")):
     """
     @classmethod
     def from_url_resp(cls, resp):
-        raw = resp.read()
+        return cls.from_body(resp.getcode(), resp.read())
+
+    @classmethod
+    def from_body(cls, code, raw):
         data = {}
         if raw:
-            data = json.loads(raw)
-        code = resp.getcode()
+            try:
+                data = _codec.loads(raw)
+            except ValueError:
+                # Error pages are not always JSON.
+                pass
         if code != 200:
             return cls(code=code, error=code, data=data, raw=raw)
         if data.get("err") is not None:
@@ -55,6 +236,156 @@ class _Response(namedtuple("_Response", "code error data raw")):
             return cls(code=code, error="No result", data=data, raw=raw)
         return cls(code=code, error=None, data=data, raw=raw)
 
+class _HTTPResponse(object):
+    """A response read in full from a pooled connection.
+
+    It looks enough like a urllib response for _Response and CookieJar.
+
+    Attributes:
+        cached: Whether it came from a ResponseCache without a request.
+    """
+
+    def __init__(self, code, headers, raw, cached=False):
+        self._code = code
+        self._headers = headers
+        self._raw = raw
+        self.cached = cached
+
+    def getcode(self):
+        return self._code
+
+    def info(self):
+        return self._headers
+
+    def read(self):
+        return self._raw
+
+class ConnectionPool(object):
+    """Keeps HTTP(S) connections alive between requests.
+
+    Requests to a host reuse an idle connection to it when there is one, so
+    they skip the TCP and TLS handshakes. The pool is thread-safe and can be
+    shared by any number of clients; each client passes its own cookie jar.
+
+    Attributes:
+        max_per_host: The maximum number of connections to a host at once.
+            Requests beyond that wait for a connection to be returned.
+        timeout: The socket timeout in seconds.
+    """
+
+    # The default number of connections per host. It matches Client.MAX_WORKERS.
+    MAX_PER_HOST = 8
+
+    # Methods that are safe to send again if a reused connection fails. Others,
+    # like the login POST, may already have been acted on.
+    IDEMPOTENT = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, max_per_host=MAX_PER_HOST, timeout=60):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    @classmethod
+    def default(cls):
+        """Return the pool shared by every client that isn't given one."""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def _host(self, scheme, netloc):
+        """Return the idle connection list and connection slots for a host."""
+        key = (scheme, netloc)
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = []
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._idle[key], self._slots[key]
+
+    @staticmethod
+    def _dropped(conn):
+        """Whether the server has closed an idle connection.
+
+        An idle connection has nothing to read, so one that reads as ready
+        has been closed, or is in a state no request should be sent in.
+        """
+        if conn.sock is None:
+            return True
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (ValueError, socket.error):
+            return True
+
+    def open(self, req, cookie_jar):
+        """Send req and read the response, handling cookies with cookie_jar.
+
+        Unlike urllib, HTTP error statuses are returned rather than raised.
+
+        Args:
+            req: A urllib Request.
+            cookie_jar: The CookieJar that supplies and receives cookies.
+
+        Returns:
+            A response with read(), getcode() and info().
+        """
+        cookie_jar.add_cookie_header(req)
+        parts = urlsplit(req.get_full_url())
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(req.header_items())
+        method = req.get_method()
+        idle, slots = self._host(parts.scheme, parts.netloc)
+
+        slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    conn = idle.pop() if idle else None
+                if conn is not None and self._dropped(conn):
+                    conn.close()
+                    continue
+                reused = conn is not None
+                if conn is None:
+                    factory = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+                    conn = factory(parts.netloc, timeout=self.timeout)
+                try:
+                    conn.request(method, path, body=req.data, headers=headers)
+                    resp = conn.getresponse()
+                    raw = resp.read()
+                except (HTTPException, socket.error):
+                    conn.close()
+                    if reused and method in self.IDEMPOTENT:
+                        # The server closed the idle connection; use another.
+                        continue
+                    raise
+                break
+            if resp.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    idle.append(conn)
+        finally:
+            slots.release()
+
+        result = _HTTPResponse(resp.status, resp.msg, raw)
+        cookie_jar.extract_cookies(result, req)
+        return result
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            for conns in self._idle.values():
+                del conns[:]
+        for conn in idle:
+            conn.close()
+
 class Session(namedtuple("Session", "api_key data")):
     """Session information, notably the api key needed for web socket work.
 
@@ -63,6 +394,295 @@ class Session(namedtuple("Session", "api_key data")):
         data: The deserialized JSON response.
     """
 
+def _write_private(path, data):
+    """Write data as JSON to path, readable only by its owner.
+
+    It goes to a temporary file of its own first, which then replaces path,
+    so readers never see half a file and writers don't trip over each other.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                               dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.rename(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+class _FileLock(object):
+    """A lock between threads, and between processes where fcntl is available.
+
+    The processes lock the file at path, which is made if need be.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is None:
+            return self
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600)
+            self._file = os.fdopen(fd, "w")
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            # Closing it releases the lock.
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+class SessionStore(object):
+    """Keeps session cookies and api keys on disk, so clients can skip logging in.
+
+    The file holds one entry per username and is only readable by its owner,
+    since the cookie and api key are as good as a password for as long as
+    the server honors them.
+
+    Attributes:
+        path: The file the sessions are stored in.
+    """
+
+    _COOKIE_FIELDS = (
+        "version", "name", "value", "port", "port_specified", "domain",
+        "domain_specified", "domain_initial_dot", "path", "path_specified",
+        "secure", "expires", "discard", "comment", "comment_url", "rfc2109",
+    )
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = _FileLock(self.path + ".lock")
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+
+    def has(self, username):
+        """Indicate whether a session is stored for username."""
+        return username in self._read()
+
+    def load(self, username, cookie_jar):
+        """Load the stored session for username, putting its cookies in cookie_jar.
+
+        Returns:
+            A Session, or None if nothing is stored for username.
+        """
+        entry = self._read().get(username)
+        if not entry:
+            return None
+        for c in entry.get("cookies", []):
+            kwargs = dict((k, c.get(k)) for k in self._COOKIE_FIELDS)
+            kwargs["rest"] = c.get("rest") or {}
+            cookie_jar.set_cookie(Cookie(**kwargs))
+        cookie_jar.clear_expired_cookies()
+        return Session(api_key=entry["api_key"], data=entry.get("data"))
+
+    def save(self, username, session, cookie_jar):
+        """Store session and the cookies in cookie_jar for username."""
+        cookies = []
+        for c in cookie_jar:
+            cookie = dict((k, getattr(c, k)) for k in self._COOKIE_FIELDS)
+            cookie["rest"] = c._rest
+            cookies.append(cookie)
+        # Read again under the lock, so others' sessions saved meanwhile are kept.
+        with self._lock:
+            entries = self._read()
+            entries[username] = {
+                "api_key": session.api_key,
+                "data": session.data,
+                "cookies": cookies,
+            }
+            _write_private(self.path, entries)
+
+    def clear(self, username):
+        """Forget the stored session for username, if any."""
+        with self._lock:
+            entries = self._read()
+            if entries.pop(username, None) is not None:
+                _write_private(self.path, entries)
+
+class _CacheEntry(namedtuple("_CacheEntry", "raw etag last_modified stored")):
+    """A cached response body, its validators and when it was fetched or revalidated."""
+
+class ResponseCache(object):
+    """Caches API responses, revalidating them with conditional requests.
+
+    A response younger than the TTL of its endpoint is used without a
+    request. An older one is revalidated: the request carries its ETag or
+    Last-Modified date, and if the server answers 304 Not Modified, the
+    cached body is used and its age starts over. Responses are cached per
+    username, and the least recently used are dropped beyond max_bytes.
+
+    It is thread-safe, so one cache can be shared by many clients.
+
+    Attributes:
+        ttls: A dict from endpoint (as for Hooks.on_http) to seconds. Other
+            endpoints aren't cached.
+        max_bytes: The most response bytes to keep.
+        path: The file the cache is kept in between runs, or None.
+        hits: Responses used without a request.
+        revalidated: Responses used after a 304 Not Modified.
+        misses: Responses fetched in full.
+    """
+
+    TTLS = {
+        "/devices": 300,
+        "/devices/{id}": 30,
+    }
+
+    def __init__(self, ttls=None, max_bytes=8 << 20, path=None):
+        self.ttls = dict(self.TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        if self.path is not None:
+            self._load()
+
+    def stats(self):
+        """Return the counters, with the number and size of the entries."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        for key, e in entries:
+            self._put(key, _CacheEntry(e["raw"].encode("utf8"), e.get("etag"), e.get("last_modified"),
+                                       e["stored"]))
+
+    def save(self):
+        """Write the cache to path, readable only by its owner."""
+        if self.path is None:
+            return
+        with self._lock:
+            entries = []
+            for key, e in self._entries.items():
+                try:
+                    raw = e.raw.decode("utf8")
+                except UnicodeDecodeError:
+                    continue
+                entries.append((key, {"raw": raw, "etag": e.etag, "last_modified": e.last_modified,
+                                      "stored": e.stored}))
+            # Still under the lock, so concurrent saves don't interleave.
+            _write_private(self.path, entries)
+
+    def _put(self, key, entry):
+        """Store entry, dropping the least recently used beyond max_bytes. Needs the lock."""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old.raw)
+        if len(entry.raw) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += len(entry.raw)
+        while self._bytes > self.max_bytes:
+            _, dropped = self._entries.popitem(last=False)
+            self._bytes -= len(dropped.raw)
+
+    def discard(self, username, path):
+        """Forget the response for path, e.g., because it was an error."""
+        with self._lock:
+            old = self._entries.pop(username + " " + path, None)
+            if old is not None:
+                self._bytes -= len(old.raw)
+
+    def fetch(self, username, path, send, max_age=None):
+        """Return the response for path, from the cache if it can be.
+
+        Args:
+            username: Whose response it is.
+            path: The API path.
+            send: Sends the request, given a dict of extra headers, and
+                returns the response.
+            max_age: The oldest cached response to use without a request,
+                if lower than the endpoint's TTL; 0 always revalidates.
+
+        Returns:
+            A response with read(), getcode() and info().
+        """
+        ttl = self.ttls.get(_endpoint(path))
+        if ttl is None:
+            return send({})
+        if max_age is not None:
+            ttl = min(ttl, max_age)
+        key = username + " " + path
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = self._entries.pop(key)
+                if time.time() - entry.stored < ttl:
+                    self.hits += 1
+                    return _HTTPResponse(200, None, entry.raw, cached=True)
+
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        resp = send(headers)
+        code = resp.getcode()
+        with self._lock:
+            if code == 304 and entry is not None:
+                self.revalidated += 1
+                self._put(key, entry._replace(stored=time.time()))
+                return _HTTPResponse(200, resp.info(), entry.raw)
+            self.misses += 1
+            if code == 200:
+                info = resp.info()
+                self._put(key, _CacheEntry(resp.read(), info.get("ETag"), info.get("Last-Modified"), time.time()))
+        return resp
+
+class Change(namedtuple("Change", "module field old new")):
+    """A single pushed change to a device attribute.
+
+    Attributes:
+        module: The attribute key of the module, e.g., "garageDoor_8".
+        field: The field that changed, e.g., "doorState".
+        old: The value before the change.
+        new: The value after the change.
+    """
+
+class Update(namedtuple("Update", "device changes")):
+    """Changes pushed for a device. They have already been applied to it.
+
+    Attributes:
+        device: The Device that changed.
+        changes: A list of Change.
+    """
+
 class _Attr(object):
     """An attribute item, taken from device details.
 
@@ -99,22 +719,109 @@ class _Attr(object):
         """Indicate whether this object has any data."""
         return self.data is not None
 
+class ChargerStatus(namedtuple("ChargerStatus", "module_id port_id level")):
+    """A snapshot of a charger module's values; see _Charger for what they mean."""
+    __slots__ = ()
+
+class DoorStatus(namedtuple("DoorStatus", "module_id port_id state position max_position preset_position "
+                                          "alarm motor motion sensor vacation op_mode")):
+    """A snapshot of a door module's values, as the server sends them.
+
+    The _Door accessors interpret them, e.g., door_status() turns state into
+    _Door.OPEN or _Door.CLOSED.
+    """
+    __slots__ = ()
+
+class FanStatus(namedtuple("FanStatus", "module_id port_id speed")):
+    """A snapshot of a fan module's values; see _Fan for what they mean."""
+    __slots__ = ()
+
+class LightStatus(namedtuple("LightStatus", "module_id port_id on timer")):
+    """A snapshot of a light module's values; see _Light for what they mean."""
+    __slots__ = ()
+
+class DeviceStatus(namedtuple("DeviceStatus", "id name door light fan charger")):
+    """A snapshot of a device: its id and name, and the status of each module (or None)."""
+    __slots__ = ()
+
 class _Module(_Attr):
-    """A GDO module, like the light, fan, etc."""
+    """A GDO module, like the light, fan, etc.
+
+    Modules with a STATUS type decode their values into a snapshot of it once,
+    and the accessors read that. The snapshot is decoded again after the
+    values change.
+    """
+
+    # The snapshot type, the attribute field each of its fields is read from,
+    # and the index of each of those fields.
+    STATUS = None
+    FIELDS = ()
+    _INDEX = {}
+
+    def __init__(self, key, data):
+        super(_Module, self).__init__(key, data)
+        self._status = None
+
+    @property
+    def status(self):
+        """The snapshot of the module's values, or None for modules without a STATUS type."""
+        status = self._status
+        if status is None and self.STATUS is not None:
+            status = self._status = self.STATUS._make(_Attr.maybe(self, f, "value") for f in self.FIELDS)
+        return status
+
+    def maybe(self, *path):
+        if len(path) == 2 and path[1] == "value" and path[0] in self._INDEX:
+            return self.status[self._INDEX[path[0]]]
+        if self.data is None:
+            # Compacted, so only the snapshot's fields are left.
+            return None
+        return super(_Module, self).maybe(*path)
+
+    def valid(self):
+        return self.data is not None or self._status is not None
+
+    def _compact(self):
+        """Keep only the snapshot, dropping the raw data."""
+        if self.STATUS is not None and self.data is not None:
+            self.status
+            self.data = None
+
+    def _update_status(self, field, value):
+        """Set field in the snapshot of a module without raw data.
+
+        Returns:
+            The Change, or None if nothing changed.
+        """
+        i = self._INDEX.get(field)
+        status = self._status
+        if i is None or status[i] == value:
+            return None
+        self._status = status._replace(**{status._fields[i]: value})
+        return Change(module=self.key, field=field, old=status[i], new=value)
 
     def port(self):
         """Return the port ID for use with web socket commands."""
+        if self.STATUS is not None:
+            return self.status.port_id
         return self.maybe("portId", "value")
 
     def module(self):
         """Return the module ID for use with web socket commands."""
+        if self.STATUS is not None:
+            return self.status.module_id
         return self.maybe("moduleId", "value")
 
 class _Charger(_Module):
     """A charger module, used for getting battery level."""
+
+    STATUS = ChargerStatus
+    FIELDS = ("moduleId", "portId", "chargeLevel")
+    _INDEX = dict(zip(FIELDS, range(len(FIELDS))))
+
     def level(self):
         """Returns the charge level as an integer from 0 to 100."""
-        return self.maybe("chargeLevel", "value")
+        return self.status.level
 
 class _Door(_Module):
     """A door module, used to get status about position, state, etc."""
@@ -127,37 +834,42 @@ class _Door(_Module):
     ERROR = "error"
     LOCKED = "locked"
 
+    STATUS = DoorStatus
+    FIELDS = ("moduleId", "portId", "doorState", "doorPosition", "maxDoorPosition", "presetPosition",
+              "alarmState", "motorStatus", "motionSensor", "sensorFlag", "vacationMode", "opMode")
+    _INDEX = dict(zip(FIELDS, range(len(FIELDS))))
+
     def max_pos(self):
         """Returns the maximum door position in some units (inches?)."""
-        return self.maybe("maxDoorPosition", "value")
+        return self.status.max_position
 
     def preset_pos(self):
         """Returns the current position in some units (inches?)."""
-        return self.maybe("presetPosition", "value")
+        return self.status.preset_position
 
     def alarm(self):
         """Returns the alarm state of the door."""
-        return self.maybe("alarmState", "value")
+        return self.status.alarm
 
     def motor(self):
         """Returns the motor status of the door."""
-        return self.maybe("motorStatus", "value")
+        return self.status.motor
 
     def motion(self):
         """Returns the state of the motion sensor (on or off)."""
-        return self.maybe("motionSensor", "value")
+        return self.status.motion
 
     def sensor(self):
         """Returns the state of the safety sensors."""
-        return self.maybe("sensorFlag", "value")
+        return self.status.sensor
 
     def vacation(self):
         """Indicates whether vacation mode is on."""
-        return self.maybe("vacationMode", "value")
+        return self.status.vacation
 
     def door_status(self):
         """Returns the status of the door (opening, closing, open, closed)."""
-        state = self.maybe("doorState", "value")
+        state = self.status.state
         if state == 0:
             return self.CLOSED
         elif state == 1:
@@ -169,7 +881,7 @@ class _Door(_Module):
 
     def door_error(self):
         """Returns the type of error last encountered, if any."""
-        mode = self.maybe("opMode", "value")
+        mode = self.status.op_mode
         if mode == 0:
             return None
         elif mode == 1:
@@ -179,30 +891,37 @@ class _Door(_Module):
 
     def door_max(self):
         """Returns the maximum position of the door in some units (inches?)."""
-        return self.maybe("maxDoorPosition", "value")
+        return self.status.max_position
 
     def door_pos(self):
         """Returns the position of the door in some units (inches?)."""
-        m = self.door_max()
-        return self.maybe("doorPosition", "value")
+        return self.status.position
 
 class _Fan(_Module):
     """A fan module, used for getting the speed."""
 
+    STATUS = FanStatus
+    FIELDS = ("moduleId", "portId", "speed")
+    _INDEX = dict(zip(FIELDS, range(len(FIELDS))))
+
     def speed(self):
         """Return the speed in an integer from 0 to 100."""
-        return self.maybe("speed", "value")
+        return self.status.speed
 
 class _Light(_Module):
     """A light module, used for getting state and timing."""
 
+    STATUS = LightStatus
+    FIELDS = ("moduleId", "portId", "lightState", "lightTimer")
+    _INDEX = dict(zip(FIELDS, range(len(FIELDS))))
+
     def on(self):
         """Indicates whether the light is on."""
-        return self.maybe("lightState", "value")
+        return self.status.on
 
     def timer(self):
         """Returns the auto-off delay in minutes."""
-        return self.maybe("lightTimer", "value")
+        return self.status.timer
 
 class Device(object):
     """A device, meaning the complete garage door opener unit with all its stuff.
@@ -216,11 +935,27 @@ class Device(object):
         fan: The fan module, if any. Note, it only supports one - that might need to change.
         wifi: The wifi module.
         light: The light module.
+        loaded: Whether the details have been fetched; see Client's device
+            selector.
     """
 
-    def __init__(self, meta, data):
+    loaded = True
+
+    def __init__(self, meta, data, keep_raw=True):
+        """Make the device from its details.
+
+        Args:
+            meta: The device's entry in the device list.
+            data: The device details.
+            keep_raw: Whether to keep the raw details of the door, light, fan
+                and charger, rather than just their status snapshots; see
+                compact().
+        """
         self.meta = meta
         self.data = data
+        # The params of commands to each module, by module key.
+        self._cmd_params = {}
+        self._modules = {}
 
         self.charger = None
         self.door = None
@@ -245,19 +980,106 @@ class Device(object):
             else:
                 # Not fatal, just something we haven't encountered.
                 print("Unknown module key {!r}".format(k))
+        for module in (self.charger, self.door, self.fan, self.wifi, self.light):
+            if module is not None:
+                self._modules[module.key] = module
+        if not keep_raw:
+            self.compact()
+
+    @property
+    def status(self):
+        """A DeviceStatus snapshot of the device."""
+        return DeviceStatus(
+            id=self.id,
+            name=self.name,
+            door=self.door.status if self.door is not None else None,
+            light=self.light.status if self.light is not None else None,
+            fan=self.fan.status if self.fan is not None else None,
+            charger=self.charger.status if self.charger is not None else None,
+        )
+
+    def compact(self):
+        """Drop the raw details of the modules that have status snapshots.
+
+        The door, light, fan and charger then only keep their snapshots,
+        which is all their accessors need, and updates are applied to those.
+        Other values of theirs are no longer available.
+        """
+        attrs = self.data["attributes"]
+        for key, module in self._modules.items():
+            if module.STATUS is not None:
+                module._compact()
+                attrs.pop(key, None)
+
+    def apply_update(self, params):
+        """Apply pushed attribute changes to data, in place.
+
+        The module objects share their data with this device, so they see the
+        changes too.
+
+        Args:
+            params: The notification params. Changes are keyed by module and
+                field, e.g., "garageDoor_8.doorState".
+
+        Returns:
+            A list of Change, one for each value that changed.
+        """
+        attrs = self.data["attributes"]
+        changes = []
+        for key, val in params.items():
+            module, sep, field = key.partition(".")
+            if not sep or not isinstance(val, dict):
+                continue
+            obj = self._modules.get(module)
+            if obj is not None and obj.data is None:
+                # Compacted, so only the snapshot is left to update.
+                change = obj._update_status(field, val["value"]) if "value" in val else None
+            else:
+                current = attrs.setdefault(module, {}).setdefault(field, {})
+                old = current.get("value")
+                current.update(val)
+                new = current.get("value")
+                change = Change(module=module, field=field, old=old, new=new) if old != new else None
+                if change is not None and obj is not None:
+                    obj._status = None
+            if change is not None:
+                changes.append(change)
+                if field in ("moduleId", "portId"):
+                    self._cmd_params.pop(module, None)
+        return changes
+
+    def refresh(self, data):
+        """Update attribute values, in place, from newly fetched device details.
+
+        Args:
+            data: Device details, as fetched from the server.
+
+        Returns:
+            A list of Change, one for each value that changed.
+        """
+        params = {}
+        for module, fields in data["attributes"].items():
+            for field, val in fields.items():
+                params[module + "." + field] = val
+        return self.apply_update(params)
 
     def _module_cmd_payload(self, module, msg):
         """Generate a command payload for sending mutation commands to the web socket."""
-        return {
-            "jsonrpc": "2.0",
-            "method": "gdoModuleCommand",
-            "params": {
+        params = self._cmd_params.get(module.key)
+        if params is None:
+            # The same for every command to the module, so only looked up once.
+            params = self._cmd_params[module.key] = {
                 "msgType": 16,
                 "moduleType": module.module(),
                 "portId": module.port(),
                 "topic": self.id,
-                "moduleMsg": msg,
             }
+        params = dict(params)
+        params["moduleMsg"] = msg
+        return {
+            "jsonrpc": "2.0",
+            "method": "gdoModuleCommand",
+            "params": params,
         }
 
     @property
@@ -300,7 +1122,7 @@ class Device(object):
         })
 
     def cmd_vacation(self, on):
-        return self._module_cmd_payload(self.vacation, {
+        return self._module_cmd_payload(self.door, {
             "vacationMode": bool(on),
         })
 
@@ -314,6 +1136,36 @@ class Device(object):
             "speed": min(100, max(0, int(speed))),
         })
 
+class _LazyDevice(Device):
+    """A Device whose details are only fetched when something needs them.
+
+    Only meta (and so id and name) is there from the start. Touching any
+    other attribute fetches the details and makes this a complete Device.
+    """
+
+    loaded = False
+
+    def __init__(self, meta, fetch, keep_raw=True):
+        self.meta = meta
+        self._fetch = fetch
+        self._keep_raw = keep_raw
+        self._load_lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        """Fetch the details, if that hasn't happened yet."""
+        with self._load_lock:
+            if not self.loaded:
+                Device.__init__(self, self.meta, self._fetch(self.meta["varName"]), self._keep_raw)
+                self.loaded = True
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, which before loading
+        # means any of the Device attributes.
+        if name.startswith("__") or self.__dict__.get("loaded", False):
+            raise AttributeError(name)
+        self._ensure_loaded()
+        return getattr(self, name)
+
 class ResponseError(Exception):
     """Raised when there is a response error."""
 
@@ -322,66 +1174,170 @@ class ResponseError(Exception):
         self.data = data
         super(ResponseError, self).__init__("{}: {!r}".format(reason, data))
 
-class Client(object):
-    """A client for talking to the GDO.
+class CommandTimeout(Exception):
+    """Raised when a command is not answered in time."""
+
+class SocketClosed(Exception):
+    """Raised for commands whose web socket closed before they were answered."""
+
+class CommandFuture(object):
+    """The pending reply to a command sent with Client.submit_command.
+
+    Attributes:
+        id: The JSON-RPC id the command was sent with.
+    """
+
+    def __init__(self, id, discard):
+        self.id = id
+        # Called with id to stop waiting for the reply.
+        self._discard = discard
+        self._event = threading.Event()
+        self._reply = None
+        self._error = None
+
+    def _set_reply(self, reply):
+        self._reply = reply
+        self._event.set()
+
+    def _set_error(self, error):
+        self._error = error
+        self._event.set()
+
+    def done(self):
+        """Indicate whether the reply (or an error) has arrived."""
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the reply and return it.
+
+        Args:
+            timeout: The number of seconds to wait, or None to wait forever.
+
+        Raises:
+            CommandTimeout: No reply arrived within timeout. The command is
+                forgotten, so a late reply is ignored.
+            SocketClosed: The socket closed before the reply arrived.
+        """
+        if not self._event.wait(timeout):
+            self._discard(self.id, "timeout")
+            if not self._event.is_set():
+                raise CommandTimeout("no reply to command {} after {}s".format(self.id, timeout))
+        if self._error is not None:
+            raise self._error
+        return self._reply
+
+class Reconnect(object):
+    """How a Client gets its web socket back after it drops.
+
+    Reconnection attempts are spaced out with jittered exponential backoff.
+    Commands submitted while the socket is down are queued, and sent once it
+    is back.
+
+    Attributes:
+        initial: Seconds to wait before the first attempt.
+        maximum: The most seconds to wait between attempts.
+        factor: How much the wait grows after each failed attempt.
+        jitter: The fraction of each wait that is randomized, 0 to 1.
+        attempts: How many attempts to make before giving up, or None to
+            keep trying until the client is closed.
+        max_queued: The most commands to queue while reconnecting.
+        queue_timeout: The most seconds a command waits in the queue.
+    """
+
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0, jitter=0.5, attempts=None,
+                 max_queued=100, queue_timeout=30.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = attempts
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+    def delays(self):
+        """Yield the number of seconds to wait before each attempt."""
+        delay = self.initial
+        for _ in (itertools.count() if self.attempts is None else range(self.attempts)):
+            yield delay * (1 - self.jitter * random.random())
+            delay = min(self.maximum, delay * self.factor)
+
+class _ClientBase(object):
+    """The GDO protocol, shared by Client and AsyncClient.
+
+    Everything here is independent of how bytes are moved. Subclasses do the
+    I/O: they send the requests and messages built here, and hand what comes
+    back to the _parse_* methods and _on_message.
 
     Attributes:
         username: The email addressed used for authentication.
         session: Session information, including api_key.
         devices: A list of all Device objects known to the server.
+        master: The masterUnit attribute of the first device that has one.
+        max_workers: The maximum number of device detail requests made at once.
+        command_timeout: The default number of seconds send_command waits
+            for a reply, or None to wait forever.
     """
 
     API_URL_PREFIX = "https://tti.tiwiconnect.com/api"
     API_URL_SOCKET = "wss://tti.tiwiconnect.com/api/wsrpc"
 
-    def __init__(self, username, password):
+    # The default number of device detail requests made at the same time.
+    MAX_WORKERS = 8
+
+    # The web socket method used to push attribute changes.
+    UPDATE_METHOD = "wskAttributeUpdateNtfy"
+
+    # Seconds to wait for the server to acknowledge a subscription.
+    SUBSCRIBE_TIMEOUT = 5
+
+    # Seconds to wait for the web socket to connect, and for its auth reply.
+    CONNECT_TIMEOUT = 10
+
+    def __init__(self, username, password, session_store, max_workers, command_timeout,
+                 api_url, socket_url, hooks, keep_raw=True):
+        if api_url is not None:
+            self.API_URL_PREFIX = api_url
+        if socket_url is not None:
+            self.API_URL_SOCKET = socket_url
         self._cookie_jar = CookieJar()
-        self._opener = build_opener(HTTPCookieProcessor(self._cookie_jar))
+        self._hooks = hooks
+        self._keep_raw = keep_raw
+        self._password = password
+        self._session_store = session_store
+        self._session_reused = False
+        self.max_workers = max_workers
+        self.command_timeout = command_timeout
+        self._ws = None
+        # Guards the socket, sending on it and the table of pending commands.
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._pending = OrderedDict()
+        # The encoded start of module commands; see _encode_command.
+        self._templates = {}
+        self._listeners = []
+        self._subscribed = False
+        # Notified whenever a device changes.
+        self._changed = threading.Condition()
 
         self.username = username
-        self.session = self._login(username, password)
-        self.devices = self._devices()
-
+        self.session = None
+        self.devices = None
         self.master = None
-        for d in self.devices:
-            if d.master is not None:
-                self.master = d.master
-                break
+        if session_store is not None:
+            self.session = session_store.load(username, self._cookie_jar)
 
-        if not self.master:
-            raise ValueError("couldn't find master unit")
+    def _encode_request(self, path, data=None):
+        """Build an API request.
 
-        self.ws = websocket.create_connection(self.API_URL_SOCKET)
-        self.ws.send(json.dumps({
-            "jsonrpc": "2.0",
-            "id": 3,
-            "method": "srvWebSocketAuth",
-            "params": {
-                "varName": username,
-                "apiKey": self.session.api_key,
-            },
-        }))
-        try:
-            ws_auth = json.loads(self.ws.recv())
-            if not ws_auth:
-                raise ValueError("no socket auth returned")
-            params = ws_auth.get("params")
-            if not params:
-                raise ValueError("no socket auth params received")
-            authorized = params.get("authorized")
-            if not authorized:
-                raise ValueError("socket not authorized: {}".format(pformat(ws_auth)))
-        except:
-            self.close()
-            raise
-
-    def _send_request(self, path, data=None):
+        Returns:
+            The URL, the encoded body (or None) and the headers.
+        """
         if not path.startswith("/"):
             path = "/" + path
 
         data_str = None
         if data:
-            data_str = json.dumps(data).encode('utf8')
+            data_str = _codec.dumps(data).encode('utf8')
 
         headers = {
             "x-tc-transform": "tti-app",
@@ -392,50 +1348,292 @@ class Client(object):
         else:
             headers["x-tc-transformversion"] = "0.2"
 
-        req = Request(self.API_URL_PREFIX + path, data=data_str, headers=headers)
-        return _Response.from_url_resp(self._opener.open(req))
+        return self.API_URL_PREFIX + path, data_str, headers
 
-    def _login(self, username, password):
-        resp = self._send_request("/login", data={
-            "username": username,
-            "password": password,
-        })
+    def _login_data(self):
+        """Return the body of a login request, clearing any old session first."""
+        if self._password is None:
+            raise ValueError("no usable stored session for {} and no password".format(self.username))
+        self._cookie_jar.clear()
+        return {
+            "username": self.username,
+            "password": self._password,
+        }
+
+    def _parse_login(self, resp):
+        """Take the session from a login response, saving it if there is a store."""
         if resp.error:
             raise ResponseError("login failed", resp)
         data = resp.data["result"]
-        return Session(api_key=data["auth"]["apiKey"], data=data)
-
-    def close(self):
-        """Close both the HTTPS and WSS connections."""
-        self.ws.close()
-        resp = self._send_request("/logout")
+        self.session = Session(api_key=data["auth"]["apiKey"], data=data)
+        self._session_reused = False
+        if self._session_store is not None:
+            self._session_store.save(self.username, self.session, self._cookie_jar)
+        return self.session
+
+    def _parse_device_list(self, resp):
+        """Return the device metadata from a /devices response."""
         if resp.error:
-            raise ResponseError("logout failed", resp)
-        return True
+            raise ResponseError("devices request failed", resp)
+        return resp.data["result"]
 
-    def _devices(self):
-        resp = self._send_request("/devices")
+    def _parse_device_details(self, name, resp):
+        """Return the device details from a /devices/<name> response."""
         if resp.error:
-            raise ResponseError("devices request failed", resp)
-        meta = resp.data["result"]
-
-        devices = []
-        for device in meta:
-            name = device["varName"]
-            dresp = self._send_request("/devices/" + name)
-            if dresp.error:
-                raise ResponseError("device request failed for {}".format(name), resp)
-            # TODO: can there ever be more than one?
-            devices.append(Device(meta=device, data=dresp.data["result"][0]))
-        return devices
+            raise ResponseError("device request failed for {}".format(name), resp)
+        # TODO: can there ever be more than one?
+        return resp.data["result"][0]
 
-    def send_command(self, cmd):
-        """Send a comand to the unit for a particular device.
+    def _select(self, meta, selector):
+        """Return the index of the device in meta that selector picks.
 
-        Use the Device command functions to generate appropriate commands.
+        Args:
+            meta: The device list.
+            selector: A device index, or a varName or name. An index past the
+                end picks the last device.
         """
-        self.ws.send(json.dumps(cmd))
-        return json.loads(self.ws.recv())
+        if isinstance(selector, int):
+            if -len(meta) <= selector < len(meta):
+                return selector % len(meta)
+            if selector >= len(meta) > 0:
+                return len(meta) - 1
+        else:
+            for i, m in enumerate(meta):
+                if selector in (m.get("varName"), m.get("name")):
+                    return i
+        raise ValueError("no device matches {!r}".format(selector))
+
+    def _set_devices(self, devices):
+        """Keep devices, finding the master unit among them."""
+        self.devices = devices
+        self.master = None
+        # Look at loaded devices first, so stubs are only loaded if need be.
+        for d in sorted(self.devices, key=lambda d: not d.loaded):
+            if d.master is not None:
+                self.master = d.master
+                break
+
+        if not self.master:
+            raise ValueError("couldn't find master unit")
+
+    def _can_retry_auth(self, reconnecting=False):
+        """Indicate whether a rejected socket auth is worth a fresh login.
+
+        Args:
+            reconnecting: Whether the api key was accepted before, so that
+                a rejection means the session has since expired.
+        """
+        return self._password is not None and (self._session_reused or reconnecting)
+
+    def _auth_message(self):
+        """Return the message that authenticates the web socket."""
+        return _codec.dumps({
+            "jsonrpc": "2.0",
+            "id": 3,
+            "method": "srvWebSocketAuth",
+            "params": {
+                "varName": self.username,
+                "apiKey": self.session.api_key,
+            },
+        })
+
+    def _check_auth(self, raw):
+        """Raise ValueError unless raw is a successful socket auth reply."""
+        ws_auth = _codec.loads(raw)
+        if not ws_auth:
+            raise ValueError("no socket auth returned")
+        params = ws_auth.get("params")
+        if not params:
+            raise ValueError("no socket auth params received")
+        authorized = params.get("authorized")
+        if not authorized:
+            raise ValueError("socket not authorized: {}".format(pformat(ws_auth)))
+
+    def _subscription_commands(self):
+        """Return the commands that ask for every device's changes to be pushed."""
+        return [{
+            "jsonrpc": "2.0",
+            "method": "wskSubscribe",
+            "params": {
+                "topic": "{}.{}".format(d.id, self.UPDATE_METHOD),
+            },
+        } for d in self.devices]
+
+    def _prepare_command(self, cmd, make_future):
+        """Give cmd a fresh id and register a future for its reply.
+
+        Must be called with the lock held.
+
+        Args:
+            cmd: The command to send. It is not changed.
+            make_future: A function taking an id and returning a future.
+
+        Returns:
+            The future and the message to send.
+        """
+        msg = dict(cmd)
+        msg["id"] = next(self._ids)
+        future = make_future(msg["id"])
+        self._pending[future.id] = future
+        data = self._encode_command(msg)
+        if self._hooks is not None:
+            future._sent = (_command_name(cmd), time.time(), len(data))
+        return future, data
+
+    def _encode_command(self, msg):
+        """Serialize msg, a command with its id.
+
+        Module commands only differ from earlier ones to the same module in
+        moduleMsg and id, so with the stdlib codec the rest is encoded once
+        and kept. Faster codecs encode the whole command quicker than that.
+        """
+        codec = _codec
+        params = msg.get("params")
+        if codec.name != "json" or len(msg) != 4 or type(params) is not dict or len(params) != 5 or \
+                type(msg.get("id")) is not int or msg.get("method") != "gdoModuleCommand":
+            return codec.dumps(msg)
+        try:
+            key = (params["topic"], params["portId"], params["moduleType"], params["msgType"], msg["jsonrpc"])
+            prefix = self._templates.get(key)
+            module_msg = params["moduleMsg"]
+        except (KeyError, TypeError):
+            return codec.dumps(msg)
+        if prefix is None:
+            # Everything up to the moduleMsg value, in a fixed key order, so
+            # that it doesn't depend on the order of the first command's keys.
+            topic, port_id, module_type, msg_type, jsonrpc = key
+            prefix = '{{"jsonrpc":{},"method":"gdoModuleCommand","params":{{"msgType":{},"moduleType":{},' \
+                '"portId":{},"topic":{},"moduleMsg":'.format(codec.dumps(jsonrpc), codec.dumps(msg_type),
+                                                            codec.dumps(module_type), codec.dumps(port_id),
+                                                            codec.dumps(topic))
+            self._templates[key] = prefix
+        return prefix + codec.dumps(module_msg) + '},"id":' + str(msg["id"]) + '}'
+
+    def _on_message(self, raw):
+        """Handle a message received on the web socket."""
+        try:
+            msg = _codec.loads(raw)
+        except ValueError:
+            return
+        if not isinstance(msg, dict):
+            return
+        if "method" not in msg and ("result" in msg or "error" in msg):
+            self._resolve(msg, len(raw))
+        else:
+            if self._hooks is not None:
+                self._hooks.on_ws(msg.get("method") or "unknown", 0.0, 0, len(raw), "ok")
+            self._handle_notification(msg)
+
+    def _resolve(self, reply, size=0):
+        """Hand reply (of size bytes) to the command it answers."""
+        with self._lock:
+            future = self._pending.pop(reply.get("id"), None)
+            if future is None and reply.get("id") is None and self._pending:
+                # Replies without an id answer the oldest command.
+                _, future = self._pending.popitem(last=False)
+        if future is not None:
+            if self._hooks is not None:
+                self._record_command(future, size, "error" if "error" in reply else "ok")
+            future._set_reply(reply)
+
+    def _record_command(self, future, received, outcome):
+        """Tell the hooks how the command for future went."""
+        sent = getattr(future, "_sent", None)
+        if sent is not None:
+            name, started, size = sent
+            self._hooks.on_ws(name, time.time() - started, size, received, outcome)
+
+    def _record_http(self, path, started, sent, resp=None, error=None):
+        """Tell the hooks how a request to path went."""
+        if resp is not None:
+            received = len(resp.raw or b"")
+            outcome = "error" if resp.error else "ok"
+        else:
+            received = 0
+            outcome = type(error).__name__
+        self._hooks.on_http(_endpoint(path), time.time() - started, sent, received, outcome)
+
+    def _handle_notification(self, msg):
+        """Apply a pushed update to its device and tell the listeners."""
+        if msg.get("method") != self.UPDATE_METHOD:
+            return
+        params = msg.get("params") or {}
+        device_id = params.get("varName") or params.get("topic", "").split(".")[0]
+        device = None
+        for d in self.devices:
+            if d.id == device_id:
+                device = d
+                break
+        if device is None or not device.loaded:
+            # Unloaded devices get current details when they are loaded.
+            return
+        self._publish(device, device.apply_update(params))
+
+    def _publish(self, device, changes):
+        """Tell waiters and listeners about changes already applied to device."""
+        if not changes:
+            return
+        with self._changed:
+            self._changed.notify_all()
+        update = Update(device=device, changes=changes)
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(update)
+            except Exception:
+                _log.exception("update listener failed")
+
+    def _add_listener(self, callback):
+        """Add callback to the update listeners.
+
+        Returns:
+            A function that removes it again.
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._listeners:
+                    self._listeners.remove(callback)
+        return unsubscribe
+
+    def _disconnected(self, ws, error):
+        """Fail every command still waiting on ws, which has closed."""
+        with self._lock:
+            if self._ws is ws:
+                self._ws = None
+            pending = list(self._pending.values())
+            self._pending.clear()
+        reason = "web socket closed"
+        if error is not None:
+            reason = "web socket closed: {}".format(error)
+        for future in pending:
+            if self._hooks is not None:
+                self._record_command(future, 0, "closed")
+            future._set_error(SocketClosed(reason))
+
+    def _discard(self, id, outcome=None):
+        """Stop waiting for a reply to the command with id.
+
+        Args:
+            id: The id of the command.
+            outcome: Why, for the hooks; e.g., "timeout". If None, the
+                command isn't reported.
+        """
+        with self._lock:
+            future = self._pending.pop(id, None)
+        if future is not None and outcome is not None and self._hooks is not None:
+            self._record_command(future, 0, outcome)
+
+    def _should_logout(self, logout):
+        """Decide whether close should end the server session, forgetting it if so."""
+        if logout is None:
+            logout = self._session_store is None
+        if logout and self._session_store is not None:
+            self._session_store.clear(self.username)
+        return logout
 
     @property
     def api_key(self):
@@ -444,3 +1642,698 @@ class Client(object):
     @property
     def tz_offset(self):
         return self.master.maybe("timeZoneOffset", "value")
+
+class Client(_ClientBase):
+    """A client for talking to the GDO.
+
+    Attributes:
+        username: The email addressed used for authentication.
+        session: Session information, including api_key.
+        devices: A list of all Device objects known to the server.
+        max_workers: The maximum number of device detail requests made at once.
+        command_timeout: The default number of seconds send_command waits
+            for a reply, or None to wait forever.
+    """
+
+    def __init__(self, username, password=None, session_store=None, max_workers=_ClientBase.MAX_WORKERS,
+                 command_timeout=None, transport=None, api_url=None, socket_url=None, hooks=None,
+                 device=None, reconnect=None, keep_raw=True, cache=None, limiter=None, record=None):
+        """Log in (or reuse a stored session) and fetch the devices.
+
+        The web socket is only connected when it is first needed, so clients
+        that only read device status never open it.
+
+        Args:
+            username: The email address registered with the GDO app.
+            password: The password for username. It may be omitted if
+                session_store holds a session that the server still accepts.
+            session_store: An optional SessionStore. A stored session is
+                reused when the server accepts it, and fresh sessions are
+                saved to it.
+            max_workers: The maximum number of device detail requests to
+                make at the same time.
+            command_timeout: The default number of seconds send_command waits
+                for a reply, or None to wait forever.
+            transport: The ConnectionPool to send HTTPS requests with.
+                Defaults to the one shared by all clients in the process.
+            api_url: The URL prefix of the HTTPS API, instead of
+                API_URL_PREFIX; e.g., a greendo.fake.FakeServer.
+            socket_url: The URL of the web socket, instead of API_URL_SOCKET.
+            hooks: An optional observer, such as greendo.metrics.Metrics, told
+                about every HTTP request and web socket message.
+            device: An optional selector (an index into the device list, or a
+                varName or name). If given, only that device's details are
+                fetched now; the other devices are fetched when first used.
+                An index past the end selects the last device.
+            reconnect: A Reconnect policy, to connect the web socket again
+                (logging in again only if the api key is rejected) whenever it
+                drops. Commands submitted in the meantime are queued. Without
+                one, commands fail with SocketClosed and the next command
+                connects again.
+            keep_raw: Whether devices keep the raw details of their modules
+                as well as the status snapshots; see Device.compact.
+            cache: An optional ResponseCache for the device list and details.
+                refresh() always revalidates what it holds.
+            limiter: An optional greendo.limit.RateLimiter, usually shared by
+                many clients, that paces HTTP requests and commands and adapts
+                to how they go.
+            record: An optional greendo.replay.TrafficRecorder to capture
+                every HTTP exchange and web socket frame to.
+        """
+        if limiter is not None:
+            hooks = limiter.observe(username, hooks)
+        super(Client, self).__init__(username, password, session_store, max_workers, command_timeout,
+                                     api_url, socket_url, hooks, keep_raw)
+        self._limiter = limiter
+        self._transport = transport if transport is not None else ConnectionPool.default()
+        if record is not None:
+            self._transport = record.transport(self._transport)
+        self._record = record
+        self._selector = device
+        self._cache = cache
+        self._reconnect = reconnect
+        # While reconnecting, the (future, message, deadline) of queued commands.
+        self._queued = None
+        self._closed = threading.Event()
+
+        devices = None
+        if self.session is not None:
+            try:
+                # Ask the server, not the cache, whether it still honors the session.
+                devices = self._devices(max_age=0)
+                self._session_reused = True
+            except ResponseError:
+                # The server no longer honors the stored cookie.
+                self.session = None
+        if self.session is None:
+            self._login()
+            devices = self._devices()
+        self._set_devices(devices)
+
+    @property
+    def ws(self):
+        """The authenticated web socket, connected on first use."""
+        with self._lock:
+            if self._ws is None:
+                self._connect()
+            return self._ws
+
+    def _connect(self, reconnecting=False):
+        """Connect and authenticate the web socket, then start reading from it.
+
+        Must be called with the lock held, so a login it needs isn't paced.
+        """
+        self._install(self._open_socket(reconnecting, paced=False))
+
+    def _open_socket(self, reconnecting=False, paced=True):
+        """Return a newly connected and authenticated web socket.
+
+        It needs no lock, so that waiting on the server doesn't hold up others.
+
+        Args:
+            reconnecting: Whether the socket was connected before.
+            paced: Whether a login it needs waits for a limiter token.
+        """
+        # Imported here so that status-only use doesn't pay for it.
+        import websocket
+        ws = websocket.create_connection(self.API_URL_SOCKET, timeout=self.CONNECT_TIMEOUT)
+        if self._record is not None:
+            ws = self._record.socket(ws)
+        try:
+            try:
+                self._ws_auth(ws)
+            except ValueError:
+                if not self._can_retry_auth(reconnecting):
+                    raise
+                # The stored api key was rejected, so get a new one.
+                self._login(paced)
+                self._ws_auth(ws)
+            # The reader waits for as long as it takes.
+            ws.settimeout(None)
+        except:
+            ws.close()
+            raise
+        return ws
+
+    def _install(self, ws):
+        """Start using ws: start reading from it, and send what was queued meanwhile.
+
+        Must be called with the lock held.
+        """
+        self._ws = ws
+        reader = threading.Thread(target=self._read_loop, args=(ws,), name="greendo-reader")
+        reader.daemon = True
+        reader.start()
+        self._expire_queued()
+        queued, self._queued = self._queued or [], None
+        if self._subscribed:
+            for future in self._send_subscriptions():
+                # Nobody waits for the acknowledgement.
+                self._discard(future.id)
+        for future, msg, _ in queued:
+            # Skip commands whose callers stopped waiting.
+            if future.id in self._pending:
+                ws.send(msg)
+
+    def _ws_auth(self, ws):
+        """Authenticate ws with the session api key."""
+        msg = self._auth_message()
+        if self._hooks is None:
+            ws.send(msg)
+            self._check_auth(ws.recv())
+            return
+        started = time.time()
+        raw = ""
+        outcome = "ok"
+        try:
+            ws.send(msg)
+            raw = ws.recv()
+            self._check_auth(raw)
+        except ValueError:
+            outcome = "error"
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self._hooks.on_ws("srvWebSocketAuth", time.time() - started, len(msg), len(raw), outcome)
+
+    def _read_loop(self, ws):
+        """Read messages from ws until it closes, resolving replies as they arrive.
+
+        If ws drops while it is still in use, and there is a Reconnect policy,
+        the thread goes on to reconnect.
+        """
+        while True:
+            error = None
+            try:
+                raw = ws.recv()
+            except Exception as e:
+                raw = None
+                error = e
+            if raw:
+                self._on_message(raw)
+                continue
+            with self._lock:
+                # close() forgets the socket before closing it.
+                reconnect = self._reconnect is not None and self._ws is ws and not self._closed.is_set()
+                if reconnect:
+                    self._ws = None
+                    # Unanswered commands are sent again. The server may have
+                    # acted on them already, but commands set absolute states.
+                    deadline = time.time() + self._reconnect.queue_timeout
+                    self._queued = [(f, f._msg, deadline) for f in self._pending.values()]
+                else:
+                    self._disconnected(ws, error)
+            if reconnect:
+                _log.info("web socket dropped (%s), reconnecting", error)
+                self._reconnect_loop()
+            return
+
+    def _reconnect_loop(self):
+        """Connect again with backoff, then send the commands queued meanwhile."""
+        error = None
+        for delay in self._reconnect.delays():
+            self._expire_queued()
+            if self._closed.wait(delay):
+                return
+            with self._lock:
+                if self._closed.is_set() or self._ws is not None:
+                    # Closed, or another thread connected (and sent the queue).
+                    return
+            # Outside the lock, so commands are queued meanwhile rather than
+            # waiting on the server.
+            try:
+                ws = self._open_socket(reconnecting=True)
+            except Exception as e:
+                error = e
+                _log.info("reconnecting failed: %s", e)
+                continue
+            with self._lock:
+                if self._closed.is_set() or self._ws is not None:
+                    ws.close()
+                    return
+                try:
+                    self._install(ws)
+                except Exception as e:
+                    # The new socket's reader reconnects if it dropped again.
+                    _log.info("sending the queued commands failed: %s", e)
+                return
+        with self._lock:
+            queued, self._queued = self._queued or [], None
+        for future, _, _ in queued:
+            self._discard(future.id, "closed")
+            future._set_error(SocketClosed("couldn't reconnect the web socket: {}".format(error)))
+
+    def _expire_queued(self):
+        """Fail the queued commands that have waited longer than queue_timeout."""
+        now = time.time()
+        with self._lock:
+            expired = [f for f, _, deadline in self._queued or () if now > deadline]
+            if expired:
+                self._queued = [q for q in self._queued if q[2] >= now]
+        for future in expired:
+            self._discard(future.id, "timeout")
+            future._set_error(CommandTimeout("command {} queued too long".format(future.id)))
+
+    def _send_subscriptions(self):
+        """Ask for attribute changes to be pushed for every device.
+
+        They don't wait for limiter tokens, since this is called with the
+        lock held.
+
+        Returns:
+            The futures for the acknowledgements.
+        """
+        return [self._submit(cmd, paced=False) for cmd in self._subscription_commands()]
+
+    def subscribe(self, callback):
+        """Call callback with every Update pushed by the server.
+
+        Each update is applied to its Device (and the device's modules) before
+        callback sees it. Callbacks run on the socket reader thread, so they
+        should be quick. The first subscription waits (up to SUBSCRIBE_TIMEOUT
+        seconds) for the server to acknowledge it, so that changes made after
+        this returns are pushed.
+
+        Args:
+            callback: A function taking an Update.
+
+        Returns:
+            A function that cancels the subscription.
+        """
+        acks = []
+        with self._lock:
+            unsubscribe = self._add_listener(callback)
+            if not self._subscribed:
+                self.ws
+                self._subscribed = True
+                acks = self._send_subscriptions()
+        # The reader thread needs the lock to resolve these.
+        for future in acks:
+            try:
+                future.result(self.SUBSCRIBE_TIMEOUT)
+            except (CommandTimeout, SocketClosed):
+                pass
+        return unsubscribe
+
+    def updates(self, timeout=None):
+        """Iterate over pushed updates as they arrive.
+
+        Args:
+            timeout: Stop after this many seconds without an update, or None
+                to keep going forever.
+
+        Returns:
+            An iterator of Update objects, already applied to their devices.
+        """
+        # Subscribe now, rather than on the first next(), so nothing is missed.
+        pending = queue.Queue()
+        unsubscribe = self.subscribe(pending.put)
+
+        def iterate():
+            try:
+                while True:
+                    try:
+                        yield pending.get(timeout=timeout)
+                    except queue.Empty:
+                        return
+            finally:
+                unsubscribe()
+        return iterate()
+
+    def refresh(self, device):
+        """Fetch the details for device again and apply them in place.
+
+        Listeners are told about any changes, as with pushed updates.
+        """
+        name = device.id
+        data = self._parse_device_details(name, self._send_request("/devices/" + name, max_age=0))
+        self._publish(device, device.refresh(data))
+
+    def _wait_for(self, device, done, timeout, poll_interval):
+        """Wait until done() is true, watching pushed updates for device.
+
+        The device details are only fetched again after poll_interval seconds
+        pass without any change being pushed.
+
+        Returns:
+            Whether done() became true within timeout seconds.
+        """
+        subscribed = self._subscribed
+        unsubscribe = self.subscribe(lambda update: None)
+        try:
+            if not subscribed and not done():
+                # Changes pushed before subscribing were missed.
+                self.refresh(device)
+            now = time.time()
+            deadline = now + timeout
+            next_poll = now + poll_interval
+            while True:
+                with self._changed:
+                    if done():
+                        return True
+                    now = time.time()
+                    if now >= deadline:
+                        return False
+                    if now < next_poll:
+                        self._changed.wait(min(deadline, next_poll) - now)
+                        if done():
+                            return True
+                        if time.time() < next_poll:
+                            # Something changed, so pushes are still arriving.
+                            next_poll = time.time() + poll_interval
+                        continue
+                self.refresh(device)
+                next_poll = time.time() + poll_interval
+        finally:
+            unsubscribe()
+
+    def wait_for_state(self, device, state, timeout=60, poll_interval=10):
+        """Wait for the door of device to reach state, e.g., _Door.CLOSED.
+
+        Args:
+            device: The Device to watch.
+            state: A door state, as returned by door_status().
+            timeout: The maximum number of seconds to wait.
+            poll_interval: How many seconds to go without a pushed change
+                before fetching the device details instead.
+
+        Returns:
+            Whether the door reached state before the timeout.
+        """
+        return self._wait_for(device, lambda: device.door.door_status() == state,
+                              timeout, poll_interval)
+
+    def wait_for_position(self, device, position, tolerance=0, timeout=60, poll_interval=10):
+        """Wait for the door of device to reach position.
+
+        Args:
+            device: The Device to watch.
+            position: The door position, in the units of door_pos().
+            tolerance: How far from position still counts as there.
+            timeout: The maximum number of seconds to wait.
+            poll_interval: How many seconds to go without a pushed change
+                before fetching the device details instead.
+
+        Returns:
+            Whether the door reached position before the timeout.
+        """
+        def done():
+            pos = device.door.door_pos()
+            return pos is not None and abs(pos - position) <= tolerance
+        return self._wait_for(device, done, timeout, poll_interval)
+
+    def _send_request(self, path, data=None, max_age=None, paced=True):
+        url, data_str, headers = self._encode_request(path, data)
+        if self._cache is None or data_str is not None:
+            fetch = lambda: self._open(Request(url, data=data_str, headers=headers), paced)
+        else:
+            fetch = lambda: self._cache.fetch(
+                self.username, path, lambda extra: self._open(Request(url, headers=dict(headers, **extra)), paced),
+                max_age)
+        if self._hooks is None:
+            return self._parse_response(path, fetch())
+        started = time.time()
+        sent = len(data_str or b"")
+        try:
+            http = fetch()
+            resp = self._parse_response(path, http)
+        except Exception as e:
+            self._record_http(path, started, sent, error=e)
+            raise
+        if getattr(http, "cached", False):
+            self._hooks.on_http(_endpoint(path), time.time() - started, 0, 0, "cached")
+        else:
+            self._record_http(path, started, sent, resp=resp)
+        return resp
+
+    def _open(self, request, paced=True):
+        """Send request, pacing it if there is a limiter and paced is set.
+
+        Either way the limiter hears how it went.
+        """
+        if self._limiter is None:
+            return self._transport.open(request, self._cookie_jar)
+        if paced:
+            self._limiter.acquire(self.username)
+        started = time.time()
+        try:
+            http = self._transport.open(request, self._cookie_jar)
+        except Exception:
+            self._limiter.report(self.username, time.time() - started, congested=True)
+            raise
+        # Throttled, or the server is struggling.
+        code = http.getcode()
+        self._limiter.report(self.username, time.time() - started, congested=code == 429 or code >= 500)
+        return http
+
+    def _parse_response(self, path, http):
+        resp = _Response.from_url_resp(http)
+        if resp.error and self._cache is not None:
+            # Don't keep errors around.
+            self._cache.discard(self.username, path)
+        return resp
+
+    def _login(self, paced=True):
+        resp = self._send_request("/login", data=self._login_data(), paced=paced)
+        return self._parse_login(resp)
+
+    def close(self, logout=None):
+        """Close both the HTTPS and WSS connections (if the WSS one was opened).
+
+        Args:
+            logout: Whether to end the server session. By default the session
+                is only ended when there is no session store, so that stored
+                sessions remain usable.
+        """
+        self._closed.set()
+        with self._lock:
+            ws, self._ws = self._ws, None
+            queued, self._queued = self._queued or [], None
+        for future, _, _ in queued:
+            self._discard(future.id)
+            future._set_error(SocketClosed("client closed"))
+        if ws is not None:
+            ws.close()
+            self._disconnected(ws, None)
+        try:
+            if not self._should_logout(logout):
+                return True
+            resp = self._send_request("/logout")
+            if resp.error:
+                raise ResponseError("logout failed", resp)
+            return True
+        finally:
+            # Last, so that failing to save can't skip the logout.
+            if self._cache is not None:
+                self._cache.save()
+
+    def _device_details(self, name):
+        return self._parse_device_details(name, self._send_request("/devices/" + name))
+
+    def _devices(self, max_age=None):
+        meta = self._parse_device_list(self._send_request("/devices", max_age=max_age))
+        if self._selector is None:
+            return _bounded_map(lambda m: Device(m, self._device_details(m["varName"]), self._keep_raw),
+                                meta, self.max_workers)
+
+        devices = [_LazyDevice(m, self._device_details, self._keep_raw) for m in meta]
+        devices[self._select(meta, self._selector)]._ensure_loaded()
+        return devices
+
+    def load(self):
+        """Fetch the details of every device that hasn't been loaded yet, concurrently."""
+        _bounded_map(lambda d: d._ensure_loaded(), [d for d in self.devices if not d.loaded],
+                     self.max_workers)
+
+    def submit_command(self, cmd):
+        """Send a command to the unit without waiting for the reply.
+
+        Any number of commands can be in flight on the socket at once, and
+        from any number of threads. While the client is reconnecting, the
+        command is queued instead, and sent once the socket is back (as are
+        commands that were in flight when it dropped).
+
+        Args:
+            cmd: A command from one of the Device command functions. It is
+                sent with a fresh JSON-RPC id; cmd itself is not changed.
+
+        Returns:
+            A CommandFuture for the reply.
+
+        Raises:
+            SocketClosed: The client is reconnecting and max_queued commands
+                are already queued.
+        """
+        return self._submit(cmd)
+
+    def _submit(self, cmd, paced=True):
+        """Send (or queue) cmd, as submit_command does.
+
+        Args:
+            cmd: The command.
+            paced: Whether to wait for a token from the limiter first. That
+                must not happen with the lock held, or the reader couldn't
+                resolve replies meanwhile.
+        """
+        if paced and self._limiter is not None:
+            self._limiter.acquire(self.username)
+        with self._lock:
+            if self._queued is not None:
+                if len(self._queued) >= self._reconnect.max_queued:
+                    raise SocketClosed("reconnecting, and {} commands are already queued".format(
+                        len(self._queued)))
+                future, msg = self._prepare_command(cmd, lambda id: CommandFuture(id, self._discard))
+                future._msg = msg
+                self._queued.append((future, msg, time.time() + self._reconnect.queue_timeout))
+                return future
+            ws = self.ws
+            future, msg = self._prepare_command(cmd, lambda id: CommandFuture(id, self._discard))
+            future._msg = msg
+            try:
+                ws.send(msg)
+            except Exception:
+                self._discard(future.id)
+                raise
+        return future
+
+    def send_command(self, cmd, timeout=None):
+        """Send a comand to the unit for a particular device and wait for the reply.
+
+        Use the Device command functions to generate appropriate commands.
+
+        Args:
+            cmd: The command to send.
+            timeout: The number of seconds to wait for the reply. Defaults to
+                command_timeout.
+        """
+        if timeout is None:
+            timeout = self.command_timeout
+        return self.submit_command(cmd).result(timeout)
+
+    def send_commands(self, batch, timeout=None):
+        """Send a batch of commands, pipelined, and wait for the replies.
+
+        Commands overwritten by a later one in the batch (the same fields of
+        the same module) aren't sent; they get the reply of the one that was.
+        Door commands are always sent, in order.
+
+        Args:
+            batch: A list of commands.
+            timeout: The number of seconds to wait for all the replies.
+                Defaults to command_timeout.
+
+        Returns:
+            A list with the reply to each command in batch, or the exception
+            (e.g., CommandTimeout) that kept it from getting one.
+        """
+        if timeout is None:
+            timeout = self.command_timeout
+        sent, slots = _coalesce(batch)
+        futures = []
+        for cmd in sent:
+            try:
+                futures.append(self.submit_command(cmd))
+            except Exception as e:
+                futures.append(e)
+        deadline = None if timeout is None else time.time() + timeout
+        results = []
+        for future in futures:
+            if isinstance(future, Exception):
+                results.append(future)
+                continue
+            try:
+                results.append(future.result(None if deadline is None else max(0, deadline - time.time())))
+            except (CommandTimeout, SocketClosed) as e:
+                results.append(e)
+        return [results[slot] for slot in slots]
+
+class _QueuedFuture(object):
+    """The reply to a command submitted to a CommandQueue.
+
+    It waits for the queue to send the command (or the command overwriting
+    it), then for the reply.
+    """
+
+    def __init__(self):
+        self._sent = threading.Event()
+        self._future = None
+        self._error = None
+
+    def _set(self, future=None, error=None):
+        self._future = future
+        self._error = error
+        self._sent.set()
+
+    @property
+    def id(self):
+        """The JSON-RPC id the command was sent with, or None until it is sent."""
+        return self._future.id if self._future is not None else None
+
+    def done(self):
+        """Indicate whether the reply (or an error) has arrived."""
+        return self._sent.is_set() and (self._future is None or self._future.done())
+
+    def result(self, timeout=None):
+        """Wait for the reply and return it, as CommandFuture.result does."""
+        started = time.time()
+        if not self._sent.wait(timeout):
+            raise CommandTimeout("command not sent after {}s".format(timeout))
+        if self._error is not None:
+            raise self._error
+        return self._future.result(None if timeout is None else max(0, timeout - (time.time() - started)))
+
+class CommandQueue(object):
+    """Collects commands for a short window, then sends what's left of them.
+
+    Bursts of commands (say, a fan being dialed up) are coalesced as with
+    Client.send_commands: of commands setting the same fields of the same
+    module, only the last is sent, and the others get its reply. The window
+    starts with the first command submitted after a send.
+
+    Attributes:
+        client: The Client sending the commands.
+        window: Seconds to collect commands for before sending them.
+    """
+
+    def __init__(self, client, window=0.1):
+        self.client = client
+        self.window = window
+        self._lock = threading.Lock()
+        self._queued = []
+        self._timer = None
+
+    def submit(self, cmd):
+        """Queue cmd to be sent at the end of the window.
+
+        Returns:
+            A future for the reply, with the same result() as CommandFuture.
+        """
+        future = _QueuedFuture()
+        with self._lock:
+            self._queued.append((cmd, future))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def flush(self):
+        """Send the queued commands now."""
+        with self._lock:
+            queued, self._queued = self._queued, []
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not queued:
+            return
+        sent, slots = _coalesce([cmd for cmd, _ in queued])
+        submitted = []
+        for cmd in sent:
+            try:
+                submitted.append((self.client.submit_command(cmd), None))
+            except Exception as e:
+                submitted.append((None, e))
+        for (_, future), slot in zip(queued, slots):
+            future._set(*submitted[slot])
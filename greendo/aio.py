@@ -0,0 +1,379 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An asyncio client for the RYOBI GDO, for Python 3 with aiohttp installed.
+
+It speaks the same protocol as greendo.Client (both are built on
+greendo._ClientBase) and hands out the same Device objects, so the Device
+command functions work with either:
+
+    async with AsyncClient(email, pwd) as client:
+        device = client.devices[0]
+        await client.send_command(device.cmd_light(True))
+"""
+
+import asyncio
+import time
+
+from urllib.request import Request
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from greendo import _ClientBase, _Response, CommandTimeout, Device, get_codec, ResponseError, SocketClosed
+
+class _ResponseInfo(object):
+    """Lets CookieJar.extract_cookies read the headers of an aiohttp response."""
+
+    def __init__(self, headers):
+        self._headers = headers
+
+    def info(self):
+        return self
+
+    def get_all(self, name, default=None):
+        return self._headers.getall(name, default)
+
+class _AsyncCommandFuture(asyncio.Future):
+    """The pending reply to a command sent with AsyncClient.submit_command.
+
+    Attributes:
+        id: The JSON-RPC id the command was sent with.
+    """
+
+    def __init__(self, id):
+        super(_AsyncCommandFuture, self).__init__()
+        self.id = id
+
+    def _set_reply(self, reply):
+        if not self.done():
+            self.set_result(reply)
+
+    def _set_error(self, error):
+        if not self.done():
+            self.set_exception(error)
+
+class AsyncClient(_ClientBase):
+    """An asyncio client for talking to the GDO.
+
+    Nothing happens until start() is awaited (or the client is used with
+    async with). As with Client, the web socket is only connected when it is
+    first needed.
+
+    Attributes:
+        username: The email addressed used for authentication.
+        session: Session information, including api_key.
+        devices: A list of all Device objects known to the server.
+        max_workers: The maximum number of device detail requests made at once.
+        command_timeout: The default number of seconds send_command waits
+            for a reply, or None to wait forever.
+    """
+
+    def __init__(self, username, password=None, session_store=None, max_workers=_ClientBase.MAX_WORKERS,
+                 command_timeout=None, http=None, api_url=None, socket_url=None, hooks=None, keep_raw=True):
+        """Set up the client, without doing any I/O.
+
+        Args:
+            username: The email address registered with the GDO app.
+            password: The password for username. It may be omitted if
+                session_store holds a session that the server still accepts.
+            session_store: An optional SessionStore, as for Client.
+            max_workers: The maximum number of device detail requests to
+                make at the same time.
+            command_timeout: The default number of seconds send_command waits
+                for a reply, or None to wait forever.
+            http: An aiohttp.ClientSession to use. By default the client
+                makes its own, and closes it in close().
+            api_url: The URL prefix of the HTTPS API, instead of
+                API_URL_PREFIX.
+            socket_url: The URL of the web socket, instead of API_URL_SOCKET.
+            hooks: An optional observer, as for Client.
+            keep_raw: Whether devices keep their raw details, as for Client.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncClient needs aiohttp")
+        super(AsyncClient, self).__init__(username, password, session_store, max_workers, command_timeout,
+                                          api_url, socket_url, hooks, keep_raw)
+        self._http = http
+        self._own_http = http is None
+        self._connecting = None
+
+    async def __aenter__(self):
+        if self.devices is None:
+            await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """Log in (or reuse a stored session) and fetch the devices."""
+        if self._http is None:
+            # Cookies live in the CookieJar shared with Client and SessionStore.
+            self._http = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar())
+        devices = None
+        if self.session is not None:
+            try:
+                devices = await self._devices()
+                self._session_reused = True
+            except ResponseError:
+                # The server no longer honors the stored cookie.
+                self.session = None
+        if self.session is None:
+            await self._login()
+            devices = await self._devices()
+        self._set_devices(devices)
+
+    async def _send_request(self, path, data=None):
+        if self._hooks is None:
+            return await self._request(path, data)
+        started = time.time()
+        sent = len(get_codec().dumps(data)) if data else 0
+        try:
+            resp = await self._request(path, data)
+        except Exception as e:
+            self._record_http(path, started, sent, error=e)
+            raise
+        self._record_http(path, started, sent, resp=resp)
+        return resp
+
+    async def _request(self, path, data=None):
+        url, data_str, headers = self._encode_request(path, data)
+        req = Request(url, data=data_str, headers=headers)
+        self._cookie_jar.add_cookie_header(req)
+        method = "POST" if data_str else "GET"
+        async with self._http.request(method, url, data=data_str, headers=dict(req.header_items())) as resp:
+            raw = await resp.read()
+            self._cookie_jar.extract_cookies(_ResponseInfo(resp.headers), req)
+        return _Response.from_body(resp.status, raw)
+
+    async def _login(self):
+        resp = await self._send_request("/login", data=self._login_data())
+        return self._parse_login(resp)
+
+    async def _devices(self):
+        meta = self._parse_device_list(await self._send_request("/devices"))
+        limit = asyncio.Semaphore(self.max_workers)
+
+        async def fetch(device):
+            name = device["varName"]
+            async with limit:
+                resp = await self._send_request("/devices/" + name)
+            return Device(device, self._parse_device_details(name, resp), self._keep_raw)
+
+        results = await asyncio.gather(*[fetch(d) for d in meta], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def refresh(self, device):
+        """Fetch the details for device again and apply them in place.
+
+        Listeners are told about any changes, as with pushed updates.
+        """
+        name = device.id
+        data = self._parse_device_details(name, await self._send_request("/devices/" + name))
+        self._publish(device, device.refresh(data))
+
+    async def _socket(self):
+        """Return the authenticated web socket, connecting it on first use."""
+        if self._ws is None:
+            if self._connecting is None:
+                self._connecting = asyncio.Lock()
+            async with self._connecting:
+                if self._ws is None:
+                    await self._connect()
+        return self._ws
+
+    async def _connect(self):
+        """Connect and authenticate the web socket, then start reading from it."""
+        ws = await self._http.ws_connect(self.API_URL_SOCKET)
+        try:
+            try:
+                await self._ws_auth(ws)
+            except ValueError:
+                if not self._can_retry_auth():
+                    raise
+                # The stored api key was rejected, so get a new one.
+                await self._login()
+                await self._ws_auth(ws)
+        except BaseException:
+            await ws.close()
+            raise
+        self._ws = ws
+        asyncio.ensure_future(self._read_loop(ws))
+        if self._subscribed:
+            await self._send_subscriptions(wait=False)
+
+    async def _ws_auth(self, ws):
+        """Authenticate ws with the session api key."""
+        data = self._auth_message()
+        started = time.time()
+        raw = ""
+        outcome = "ok"
+        try:
+            await ws.send_str(data)
+            msg = await ws.receive()
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                raise ValueError("no socket auth returned")
+            raw = msg.data
+            self._check_auth(raw)
+        except ValueError:
+            outcome = "error"
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if self._hooks is not None:
+                self._hooks.on_ws("srvWebSocketAuth", time.time() - started, len(data), len(raw), outcome)
+
+    async def _read_loop(self, ws):
+        """Read messages from ws until it closes, resolving replies as they arrive."""
+        error = None
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self._on_message(msg.data)
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    error = ws.exception()
+                    break
+        finally:
+            self._disconnected(ws, error)
+
+    async def _send_subscriptions(self, wait):
+        """Ask for attribute changes to be pushed for every device.
+
+        Args:
+            wait: Whether to wait (up to SUBSCRIBE_TIMEOUT seconds) for the
+                server to acknowledge the subscriptions.
+        """
+        acks = [await self.submit_command(cmd) for cmd in self._subscription_commands()]
+        for future in acks:
+            if not wait:
+                # Nobody waits for the acknowledgement.
+                self._discard(future.id)
+                continue
+            try:
+                await asyncio.wait_for(future, self.SUBSCRIBE_TIMEOUT)
+            except (asyncio.TimeoutError, SocketClosed):
+                self._discard(future.id)
+
+    async def subscribe(self, callback):
+        """Call callback with every Update pushed by the server.
+
+        Each update is applied to its Device before callback sees it. The
+        first subscription waits for the server to acknowledge it, as with
+        Client.subscribe.
+
+        Args:
+            callback: A function taking an Update. It runs on the event loop.
+
+        Returns:
+            A function that cancels the subscription.
+        """
+        unsubscribe = self._add_listener(callback)
+        if not self._subscribed:
+            await self._socket()
+            self._subscribed = True
+            await self._send_subscriptions(wait=True)
+        return unsubscribe
+
+    async def updates(self, timeout=None):
+        """Iterate over pushed updates as they arrive.
+
+        Args:
+            timeout: Stop after this many seconds without an update, or None
+                to keep going forever.
+
+        Returns:
+            An async iterator of Update objects, already applied to their
+            devices. The subscription starts before this returns.
+        """
+        pending = asyncio.Queue()
+        unsubscribe = await self.subscribe(pending.put_nowait)
+
+        async def iterate():
+            try:
+                while True:
+                    try:
+                        yield await asyncio.wait_for(pending.get(), timeout)
+                    except asyncio.TimeoutError:
+                        return
+            finally:
+                unsubscribe()
+        return iterate()
+
+    async def submit_command(self, cmd):
+        """Send a command to the unit without waiting for the reply.
+
+        Args:
+            cmd: A command from one of the Device command functions. It is
+                sent with a fresh JSON-RPC id; cmd itself is not changed.
+
+        Returns:
+            An asyncio future for the reply.
+        """
+        ws = await self._socket()
+        future, msg = self._prepare_command(cmd, _AsyncCommandFuture)
+        try:
+            await ws.send_str(msg)
+        except BaseException:
+            self._discard(future.id)
+            raise
+        return future
+
+    async def send_command(self, cmd, timeout=None):
+        """Send a comand to the unit for a particular device and wait for the reply.
+
+        Args:
+            cmd: The command to send.
+            timeout: The number of seconds to wait for the reply. Defaults to
+                command_timeout.
+
+        Raises:
+            CommandTimeout: No reply arrived within timeout.
+        """
+        if timeout is None:
+            timeout = self.command_timeout
+        future = await self.submit_command(cmd)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._discard(future.id, "timeout")
+            raise CommandTimeout("no reply to command {} after {}s".format(future.id, timeout))
+
+    async def close(self, logout=None):
+        """Close both the HTTPS and WSS connections (if the WSS one was opened).
+
+        Args:
+            logout: Whether to end the server session, as for Client.close.
+        """
+        ws, self._ws = self._ws, None
+        try:
+            if ws is not None:
+                await ws.close()
+                self._disconnected(ws, None)
+            if self._http is not None and self._should_logout(logout):
+                resp = await self._send_request("/logout")
+                if resp.error:
+                    raise ResponseError("logout failed", resp)
+        finally:
+            if self._own_http and self._http is not None:
+                await self._http.close()
+                self._http = None
+        return True
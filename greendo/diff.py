@@ -0,0 +1,125 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Finds which fields of each device changed between snapshots.
+
+Publishing whole device details on every refresh repeats what consumers
+already know. A DiffEngine remembers a small Snapshot of each device and
+reports only the fields that differ from the last one:
+
+    engine = DiffEngine()
+    for change in engine.update(device):
+        publish(change.device, change.field, change.new)
+
+The first snapshot of a device reports every field it has.
+"""
+
+import threading
+
+from collections import namedtuple
+
+class Snapshot(namedtuple("Snapshot", "door position light fan charge alarm motion")):
+    """The fields of a device that are compared. Missing modules give None.
+
+    Attributes:
+        door: The door state, as the server reports it (see greendo.state).
+        position: The door position.
+        light: Whether the light is on.
+        fan: The fan speed.
+        charge: The backup battery level.
+        alarm: Whether the door alarm is set off.
+        motion: Whether the motion sensor is on.
+    """
+    __slots__ = ()
+
+FIELDS = Snapshot._fields
+
+class FieldChange(namedtuple("FieldChange", "device field old new")):
+    """One field of one device that changed.
+
+    Attributes:
+        device: The device id (varName).
+        field: The name of the field, one of FIELDS.
+        old: The value in the last snapshot, or None for the first.
+        new: The value now.
+    """
+    __slots__ = ()
+
+def snapshot(device):
+    """Return the Snapshot of device's current status."""
+    status = device.status
+    door, light, fan, charger = status.door, status.light, status.fan, status.charger
+    return Snapshot(
+        door.state if door is not None else None,
+        door.position if door is not None else None,
+        light.on if light is not None else None,
+        fan.speed if fan is not None else None,
+        charger.level if charger is not None else None,
+        door.alarm if door is not None else None,
+        door.motion if door is not None else None,
+    )
+
+def diff(id, old, new):
+    """Return the FieldChanges of device id from Snapshot old (or None) to new.
+
+    Fields that are None in new aren't reported.
+    """
+    if old == new:
+        return []
+    if old is None:
+        return [FieldChange(id, field, None, value) for field, value in zip(FIELDS, new) if value is not None]
+    return [FieldChange(id, field, a, b) for field, a, b in zip(FIELDS, old, new) if a != b and b is not None]
+
+class DiffEngine(object):
+    """Remembers the last Snapshot of each device, and reports what changed since.
+
+    It is thread-safe.
+    """
+
+    def __init__(self):
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def update(self, device):
+        """Take a snapshot of device.
+
+        Returns:
+            A list of FieldChange, one for each field that changed since the
+            last snapshot of device (or every field, for its first).
+        """
+        new = snapshot(device)
+        with self._lock:
+            old = self._last.get(device.id)
+            self._last[device.id] = new
+        return diff(device.id, old, new)
+
+    def update_many(self, devices):
+        """Take a snapshot of each loaded device, returning all of their changes."""
+        changes = []
+        for device in devices:
+            if device.loaded:
+                changes.extend(self.update(device))
+        return changes
+
+    def last(self, id):
+        """Return the last Snapshot of device id, or None."""
+        return self._last.get(id)
+
+    def forget(self, id=None):
+        """Forget the snapshot of device id (or of every device), so all its fields are reported again."""
+        with self._lock:
+            if id is None:
+                self._last.clear()
+            else:
+                self._last.pop(id, None)
@@ -0,0 +1,507 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process stand-in for the tiwiconnect API, for tests and benchmarks.
+
+It serves the login, devices, device details and logout HTTP endpoints and
+the wsrpc web socket on one local port, with made up devices:
+
+    with FakeServer(devices=3) as server:
+        client = greendo.Client(server.username, server.password, **server.client_args())
+"""
+
+import base64
+import hashlib
+import itertools
+import json
+import struct
+import sys
+import threading
+import time
+
+from collections import Counter, OrderedDict
+
+if sys.version_info[0] > 2:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from http.cookies import SimpleCookie
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from Cookie import SimpleCookie
+
+# The GUID every web socket handshake uses (RFC 6455).
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_WS_TEXT = 0x1
+_WS_CLOSE = 0x8
+_WS_PING = 0x9
+_WS_PONG = 0xA
+
+def fake_device(index):
+    """Return the metadata and details for a made up device.
+
+    The attribute tree has the same shape as a real opener with a light,
+    fan and backup battery.
+
+    Args:
+        index: Makes the device id, name and port ids unique.
+
+    Returns:
+        A (meta, details) tuple.
+    """
+    var_name = "{:032x}".format(index + 1)
+    port = 7
+    meta = {
+        "varName": var_name,
+        "name": "Garage {}".format(index + 1),
+        "deviceTypeIds": ["gdoMasterUnit"],
+    }
+
+    def values(**kw):
+        return dict((k, {"value": v, "lastSet": 0}) for k, v in kw.items())
+
+    attributes = {
+        "masterUnit": values(timeZoneOffset=-25200, fwVersion=262),
+        "garageDoor_{}".format(port): values(
+            moduleId=7, portId=port, doorState=0, doorPosition=0, maxDoorPosition=3045,
+            presetPosition=0, opMode=0, alarmState=False, motorStatus=0, motionSensor=True,
+            sensorFlag=1, vacationMode=False),
+        "garageLight_{}".format(port): values(moduleId=5, portId=port, lightState=False, lightTimer=0),
+        "backupCharger_8": values(moduleId=6, portId=8, chargeLevel=100 - index % 100),
+        "fan_4": values(moduleId=3, portId=4, speed=0),
+        "wifiModule_1": values(moduleId=1, portId=1, rssi=-50),
+    }
+    return meta, {"varName": var_name, "attributes": attributes}
+
+def _ws_frame(opcode, payload):
+    """Encode an unmasked web socket frame, as sent by servers."""
+    head = bytearray([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        head.append(n)
+    elif n < 65536:
+        head.append(126)
+        head += struct.pack(">H", n)
+    else:
+        head.append(127)
+        head += struct.pack(">Q", n)
+    return bytes(head) + payload
+
+def _ws_read_frame(rfile):
+    """Read a (masked) web socket frame sent by a client.
+
+    Returns:
+        The opcode and payload, or (None, None) if the connection closed.
+    """
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None, None
+    b1, b2 = bytearray(head)
+    n = b2 & 0x7f
+    if n == 126:
+        n = struct.unpack(">H", rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack(">Q", rfile.read(8))[0]
+    mask = bytearray(rfile.read(4)) if b2 & 0x80 else None
+    payload = bytearray(rfile.read(n))
+    if mask:
+        for i in range(n):
+            payload[i] ^= mask[i % 4]
+    return b1 & 0x0f, bytes(payload)
+
+class _WebSocket(object):
+    """The server end of one web socket connection."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.topics = set()
+        self.authorized = False
+        self._lock = threading.Lock()
+
+    def send(self, msg):
+        data = _ws_frame(_WS_TEXT, json.dumps(msg).encode("utf8"))
+        with self._lock:
+            self.handler.wfile.write(data)
+            self.handler.wfile.flush()
+
+    def close(self):
+        with self._lock:
+            try:
+                self.handler.wfile.write(_ws_frame(_WS_CLOSE, b""))
+                self.handler.wfile.flush()
+            except (IOError, OSError):
+                pass
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; don't let them wait on acks.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.fake._count("connection")
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _reply(self, code, body, cookie=None, validate=False):
+        with self.fake._lock:
+            drop = self.fake.drop_replies > 0
+            if drop:
+                self.fake.drop_replies -= 1
+        if drop:
+            self.close_connection = True
+            return
+        data = json.dumps(body).encode("utf8")
+        etag = None
+        if validate:
+            # Conditional requests are answered as the real API would, if it could.
+            etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                self.fake._count("not_modified")
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if cookie is not None:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+        if not self.fake.keep_alive:
+            # Without saying so, as a server dropping idle connections would.
+            self.close_connection = True
+
+    def _session(self):
+        """Return the username logged in with the request's cookie, if any."""
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        sid = cookie.get("sid")
+        session = sid is not None and self.fake._sessions.get(sid.value)
+        return session and session[1]
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.fake._delay()
+        if self.path != "/api/login":
+            return self._reply(404, {"err": "not found"})
+        self.fake._count("login")
+        creds = json.loads(body.decode("utf8"))
+        account = self.fake.accounts.get(creds.get("username"))
+        if account is None or account[0] != creds.get("password"):
+            return self._reply(401, {"err": "bad credentials"})
+        sid, api_key = self.fake._new_session(creds["username"])
+        return self._reply(200, {"result": {"varName": creds["username"], "auth": {"apiKey": api_key}}},
+                           cookie="sid={}; Path=/".format(sid))
+
+    def do_GET(self):
+        if self.path == "/api/wsrpc" and self.headers.get("Upgrade", "").lower() == "websocket":
+            return self._web_socket()
+        self.fake._delay()
+        if self.path == "/api/logout":
+            self.fake._count("logout")
+            cookie = SimpleCookie(self.headers.get("Cookie", ""))
+            if "sid" in cookie:
+                self.fake._sessions.pop(cookie["sid"].value, None)
+            return self._reply(200, {"result": "logged out"})
+        username = self._session()
+        if not username:
+            return self._reply(401, {"err": "not logged in"})
+        if self.path == "/api/devices":
+            self.fake._count("devices")
+            return self._reply(200, {"result": [meta for meta, _ in self.fake.accounts[username][1]]}, validate=True)
+        prefix = "/api/devices/"
+        if self.path.startswith(prefix):
+            self.fake._count("device")
+            details = self.fake._details(self.path[len(prefix):])
+            if details is None:
+                return self._reply(200, {"result": []})
+            return self._reply(200, {"result": [details]}, validate=True)
+        return self._reply(404, {"err": "not found"})
+
+    def _web_socket(self):
+        self.fake._count("ws_connect")
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("ascii")).digest())
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept.decode("ascii"))
+        self.end_headers()
+        self.wfile.flush()
+
+        ws = _WebSocket(self)
+        with self.fake._lock:
+            self.fake._sockets.append(ws)
+        try:
+            while True:
+                try:
+                    opcode, payload = _ws_read_frame(self.rfile)
+                except (IOError, OSError, struct.error):
+                    return
+                if opcode is None or opcode == _WS_CLOSE:
+                    ws.close()
+                    return
+                if opcode == _WS_PING:
+                    with ws._lock:
+                        self.wfile.write(_ws_frame(_WS_PONG, payload))
+                        self.wfile.flush()
+                elif opcode == _WS_TEXT:
+                    self.fake._on_ws_message(ws, json.loads(payload.decode("utf8")))
+        finally:
+            with self.fake._lock:
+                if ws in self.fake._sockets:
+                    self.fake._sockets.remove(ws)
+            self.close_connection = True
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeServer(object):
+    """Serves the tiwiconnect API from a local port on background threads.
+
+    Attributes:
+        username: The username of the first account.
+        password: The password for username.
+        devices: The devices of the first account, a list of (meta, details)
+            tuples; see fake_device.
+        accounts: An OrderedDict from each username that can log in to its
+            password and devices. See add_account.
+        latency: Seconds each HTTP request takes, on top of the real work.
+        ws_latency: Seconds each command takes to be answered.
+        counts: A Counter of requests served, by kind: "login", "devices",
+            "device", "logout", "ws_connect", "ws_auth", "command" and
+            "subscribe"; and of TCP connections accepted, as "connection".
+            "not_modified" counts the 304 responses to conditional requests.
+        keep_alive: Whether HTTP connections stay open between requests. If
+            not, each is closed after one response, though the response
+            doesn't announce it.
+        drop_replies: How many of the next HTTP requests are handled but then
+            have their connection closed instead of a response, as when a
+            connection fails mid-request.
+    """
+
+    def __init__(self, devices=1, latency=0.0, ws_latency=0.0, username="user@example.com",
+                 password="password", port=0):
+        """Create the server; it serves once started.
+
+        Args:
+            devices: The number of made up devices on the account.
+            latency: Seconds each HTTP request takes.
+            ws_latency: Seconds each command takes to be answered.
+            username: The username of the first account.
+            password: The password for username.
+            port: The local port to listen on. By default any free one.
+        """
+        self.username = username
+        self.password = password
+        self.devices = [fake_device(i) for i in range(devices)]
+        self.accounts = OrderedDict([(username, (password, self.devices))])
+        self.latency = latency
+        self.ws_latency = ws_latency
+        self.keep_alive = True
+        self.drop_replies = 0
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._sessions = {}
+        self._api_keys = set()
+        self._sockets = []
+        self._httpd = _HTTPServer(("127.0.0.1", port), _Handler)
+        self._httpd.fake = self
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    @property
+    def api_url(self):
+        """The URL prefix to use instead of Client.API_URL_PREFIX."""
+        return "http://127.0.0.1:{}/api".format(self.port)
+
+    @property
+    def socket_url(self):
+        """The URL to use instead of Client.API_URL_SOCKET."""
+        return "ws://127.0.0.1:{}/api/wsrpc".format(self.port)
+
+    def client_args(self):
+        """Return the keyword arguments that point a Client at this server."""
+        return {"api_url": self.api_url, "socket_url": self.socket_url}
+
+    def add_account(self, username, password="password", devices=1):
+        """Add an account with devices of its own, which no other account sees.
+
+        Returns:
+            The devices of the account, as for the devices attribute.
+        """
+        with self._lock:
+            first = sum(len(d) for _, d in self.accounts.values())
+            account_devices = [fake_device(first + i) for i in range(devices)]
+            self.accounts[username] = (password, account_devices)
+        return account_devices
+
+    def start(self):
+        """Start serving on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, args=(0.05,), name="greendo-fake")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and drop every web socket."""
+        self.drop_sockets()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def expire_sessions(self):
+        """Forget every login, so cookies and api keys are rejected."""
+        with self._lock:
+            self._sessions.clear()
+            self._api_keys.clear()
+
+    def drop_sockets(self):
+        """Close every open web socket from the server end."""
+        with self._lock:
+            sockets = list(self._sockets)
+        for ws in sockets:
+            ws.close()
+            try:
+                ws.handler.connection.shutdown(2)
+            except (IOError, OSError):
+                pass
+
+    def push(self, device_id, changes):
+        """Push attribute changes to the sockets subscribed to device_id.
+
+        The changes are applied to the device details first.
+
+        Args:
+            device_id: The varName of the device.
+            changes: A dict from "module.field" to the new value.
+        """
+        details = self._details(device_id)
+        params = {"topic": "{}.wskAttributeUpdateNtfy".format(device_id), "varName": device_id}
+        with self._lock:
+            for key, value in changes.items():
+                module, field = key.split(".", 1)
+                entry = details["attributes"].setdefault(module, {}).setdefault(field, {})
+                entry["value"] = value
+                params[key] = {"value": value, "lastSet": int(time.time() * 1000)}
+            sockets = [ws for ws in self._sockets if params["topic"] in ws.topics]
+        msg = {"jsonrpc": "2.0", "method": "wskAttributeUpdateNtfy", "params": params}
+        for ws in sockets:
+            try:
+                ws.send(msg)
+            except (IOError, OSError):
+                pass
+
+    def _count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_session(self, username):
+        with self._lock:
+            n = next(self._ids)
+            sid = "sid{}".format(n)
+            api_key = "key{}".format(n)
+            self._sessions[sid] = (api_key, username)
+            self._api_keys.add(api_key)
+        return sid, api_key
+
+    def _details(self, device_id):
+        for _, devices in list(self.accounts.values()):
+            for meta, details in devices:
+                if meta["varName"] == device_id:
+                    return details
+        return None
+
+    def _on_ws_message(self, ws, msg):
+        method = msg.get("method")
+        params = msg.get("params") or {}
+        if method == "srvWebSocketAuth":
+            self._count("ws_auth")
+            with self._lock:
+                ws.authorized = params.get("apiKey") in self._api_keys
+            ws.send({"jsonrpc": "2.0", "method": "authorizedWebSocket",
+                     "params": {"authorized": ws.authorized}})
+            return
+        reply = {"jsonrpc": "2.0"}
+        if "id" in msg:
+            reply["id"] = msg["id"]
+        if not ws.authorized:
+            reply["error"] = {"message": "not authorized"}
+            ws.send(reply)
+            return
+        if method == "wskSubscribe":
+            self._count("subscribe")
+            ws.topics.add(params.get("topic"))
+            reply["result"] = True
+            ws.send(reply)
+            return
+        if method != "gdoModuleCommand":
+            reply["error"] = {"message": "unknown method {}".format(method)}
+            ws.send(reply)
+            return
+
+        self._count("command")
+        if self.ws_latency:
+            time.sleep(self.ws_latency)
+        reply["result"] = {"msgType": params.get("msgType"), "topic": params.get("topic")}
+        ws.send(reply)
+        self._apply_command(params)
+
+    def _apply_command(self, params):
+        """Change the device the way the real unit would, pushing the changes."""
+        details = self._details(params.get("topic"))
+        if details is None:
+            return
+        module = None
+        for key, attr in details["attributes"].items():
+            if attr.get("portId", {}).get("value") == params.get("portId") and \
+                    attr.get("moduleId", {}).get("value") == params.get("moduleType"):
+                module = key
+                break
+        if module is None:
+            return
+        changes = {}
+        for field, value in (params.get("moduleMsg") or {}).items():
+            if field == "doorCommand":
+                opening = str(value) == "1"
+                max_pos = details["attributes"][module]["maxDoorPosition"]["value"]
+                changes[module + ".doorState"] = 1 if opening else 0
+                changes[module + ".doorPosition"] = max_pos if opening else 0
+            else:
+                changes[module + "." + field] = value
+        self.push(params["topic"], changes)
@@ -0,0 +1,218 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Many accounts, one process.
+
+A FleetManager keeps a Client per account, starting them in parallel over
+one shared ConnectionPool, and sends each command down the socket of the
+account that owns its device:
+
+    with FleetManager({"a@example.com": "pw", "b@example.com": "pw"}) as fleet:
+        fleet.broadcast(lambda device: device.cmd_light(False))
+        print(fleet.status())
+"""
+
+import logging
+import time
+
+from collections import namedtuple, OrderedDict
+
+from greendo import _bounded_map, Client, CommandTimeout, ConnectionPool, SocketClosed
+
+_log = logging.getLogger(__name__)
+
+class DeviceSummary(namedtuple("DeviceSummary", "account name door position light")):
+    """The status of one device in a fleet.
+
+    Attributes:
+        account: The username the device belongs to.
+        name: The name of the device.
+        door: The door state, as from door_status().
+        position: The door position, as from door_pos().
+        light: Whether the light is on.
+    """
+
+class FleetManager(object):
+    """Keeps a logged in Client for each of many accounts.
+
+    Accounts that fail to start are left out, with their exceptions kept in
+    errors, so one bad password doesn't stop the rest of the fleet.
+
+    Attributes:
+        clients: An OrderedDict from username to its Client, in the order the
+            accounts were given.
+        errors: A dict from username to the exception that kept its client
+            from starting.
+        max_concurrency: The most logins, connections or requests made at once.
+    """
+
+    def __init__(self, accounts, max_concurrency=16, transport=None, **client_args):
+        """Log in to every account (max_concurrency at a time) and fetch the devices.
+
+        Args:
+            accounts: A dict (or iterable of pairs) from username to password.
+                A password may be None if client_args has a session_store
+                holding a session for the username.
+            max_concurrency: The most logins, connections or requests to make
+                at once, across the whole fleet.
+            transport: The ConnectionPool every client sends requests with.
+                By default a new one allowing max_concurrency connections.
+            client_args: More keyword arguments for each Client, e.g.,
+                session_store, reconnect or hooks.
+        """
+        self.max_concurrency = max_concurrency
+        if transport is None:
+            transport = ConnectionPool(max_per_host=max_concurrency)
+        self._transport = transport
+        self.clients = OrderedDict()
+        self.errors = {}
+        # From device id to the Client it belongs to.
+        self._owners = {}
+        # Each client fetches its device details one at a time, so that
+        # max_concurrency bounds the requests of the whole fleet.
+        client_args.setdefault("max_workers", 1)
+
+        def start(account):
+            username, password = account
+            try:
+                return Client(username, password, transport=transport, **client_args)
+            except Exception as e:
+                return e
+
+        accounts = list(accounts.items() if isinstance(accounts, dict) else accounts)
+        started = _bounded_map(start, accounts, max_concurrency)
+        for (username, _), client in zip(accounts, started):
+            if isinstance(client, Exception):
+                self.errors[username] = client
+                continue
+            self.clients[username] = client
+            for device in client.devices:
+                self._owners[device.id] = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def devices(self):
+        """Every device of every account."""
+        return [d for client in self.clients.values() for d in client.devices]
+
+    def client_for(self, device):
+        """Return the Client that owns device (a Device, or its id).
+
+        Raises:
+            KeyError: No account in the fleet has the device.
+        """
+        return self._owners[getattr(device, "id", device)]
+
+    def submit_command(self, cmd):
+        """Send cmd down the socket of the account owning its device.
+
+        Returns:
+            A CommandFuture for the reply.
+        """
+        return self.client_for(cmd["params"]["topic"]).submit_command(cmd)
+
+    def send_command(self, cmd, timeout=None):
+        """Send cmd to its device's account and wait for the reply."""
+        return self.client_for(cmd["params"]["topic"]).send_command(cmd, timeout)
+
+    def _connect(self, clients):
+        """Connect the web sockets of clients, max_concurrency at a time."""
+        def connect(client):
+            try:
+                client.ws
+            except Exception:
+                # The commands for this client fail on their own.
+                pass
+        _bounded_map(connect, clients, self.max_concurrency)
+
+    def broadcast(self, make_cmd, devices=None, timeout=None):
+        """Send a command to many devices at once, and wait for the replies.
+
+        The commands are all in flight at the same time, pipelined on each
+        account's socket, so no thread is needed per device.
+
+        Args:
+            make_cmd: A function from a Device to the command to send it,
+                e.g., lambda device: device.cmd_close().
+            devices: The devices to send to. Defaults to every device.
+            timeout: The number of seconds to wait for all the replies.
+
+        Returns:
+            An OrderedDict from device id to its reply, or to the exception
+            that kept it from getting one.
+        """
+        if devices is None:
+            devices = self.devices
+        self._connect(set(self.client_for(d) for d in devices))
+        futures = OrderedDict()
+        for device in devices:
+            try:
+                futures[device.id] = self.client_for(device).submit_command(make_cmd(device))
+            except Exception as e:
+                futures[device.id] = e
+
+        deadline = None if timeout is None else time.time() + timeout
+        results = OrderedDict()
+        for id, future in futures.items():
+            if isinstance(future, Exception):
+                results[id] = future
+                continue
+            try:
+                results[id] = future.result(None if deadline is None else max(0, deadline - time.time()))
+            except (CommandTimeout, SocketClosed) as e:
+                results[id] = e
+        return results
+
+    def refresh(self):
+        """Fetch the details of every device again, max_concurrency at a time."""
+        _bounded_map(lambda d: self.client_for(d).refresh(d), self.devices, self.max_concurrency)
+
+    def status(self):
+        """Return the status of every device, from what the clients know.
+
+        Call refresh() first for current values, or subscribe the clients to
+        keep them current.
+
+        Returns:
+            An OrderedDict from device id to DeviceSummary.
+        """
+        status = OrderedDict()
+        for username, client in self.clients.items():
+            for d in client.devices:
+                if not d.loaded:
+                    status[d.id] = DeviceSummary(username, d.name, None, None, None)
+                    continue
+                door = d.door
+                status[d.id] = DeviceSummary(
+                    account=username,
+                    name=d.name,
+                    door=door.door_status() if door is not None else None,
+                    position=door.door_pos() if door is not None else None,
+                    light=d.light.on() if d.light is not None else None,
+                )
+        return status
+
+    def close(self, logout=None):
+        """Close every client, max_concurrency at a time."""
+        def close(client):
+            try:
+                client.close(logout)
+            except Exception:
+                _log.exception("closing the client for %s failed", client.username)
+        _bounded_map(close, list(self.clients.values()), self.max_concurrency)
@@ -0,0 +1,273 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Records device status history in a compact, append-only file.
+
+Every sample is one fixed-width record: the time, the device and its door
+state, door position, battery level, light and fan. Next to the log, an
+index file notes the time of every INDEX_EVERY-th record, and a devices file
+lists the device ids, so that a time range can be found without reading
+the log:
+
+    recorder = Recorder("history.log")
+    unlisten = recorder.listen(client)
+    ...
+    with History("history.log") as history:
+        columns = history.query(start, end)  # numpy arrays, by column
+
+Reading into arrays needs numpy; samples() doesn't.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Little-endian: time, device number, position, door state, battery level,
+# light, fan, then padding to 20 bytes. Missing values are -1.
+_RECORD = struct.Struct("<dIhbbbbxx")
+# The time of a record, and its number.
+_INDEX = struct.Struct("<dQ")
+
+# The index has an entry for every INDEX_EVERY-th record.
+INDEX_EVERY = 4096
+
+if np is not None:
+    _DTYPE = np.dtype([
+        ("time", "<f8"), ("device", "<u4"), ("position", "<i2"), ("door", "i1"),
+        ("charge", "i1"), ("light", "i1"), ("fan", "i1"), ("pad", "V2"),
+    ])
+
+class Sample(namedtuple("Sample", "time device door position charge light fan")):
+    """One recorded status. Missing values are -1.
+
+    Attributes:
+        time: Seconds since the epoch.
+        device: The device id.
+        door: The door state, as the server reports it (0 is closed, 1 open).
+        position: The door position.
+        charge: The battery level, 0 to 100.
+        light: 1 if the light was on, else 0.
+        fan: The fan speed, 0 to 100.
+    """
+
+def _paths(path):
+    return path, path + ".idx", path + ".devices"
+
+def _int(value):
+    return -1 if value is None else int(value)
+
+class Recorder(object):
+    """Appends samples to a history log.
+
+    Times never go backwards in the log: a sample older than the last one is
+    recorded at the last one's time. Writes are buffered until flush() or
+    close().
+    """
+
+    def __init__(self, path):
+        """Open the log at path, creating it (and its index and devices files) if need be."""
+        self.path, index_path, devices_path = _paths(os.path.expanduser(path))
+        self._lock = threading.Lock()
+        self._devices = {}
+        if os.path.exists(devices_path):
+            with open(devices_path) as f:
+                for line in f:
+                    self._devices[line.rstrip("\n")] = len(self._devices)
+
+        self._log = open(self.path, "ab+")
+        size = os.path.getsize(self.path)
+        self._count = size // _RECORD.size
+        if self._count * _RECORD.size != size:
+            # Drop a record cut short by a crash.
+            self._log.truncate(self._count * _RECORD.size)
+        self._last = 0.0
+        if self._count:
+            self._log.seek((self._count - 1) * _RECORD.size)
+            self._last = _RECORD.unpack(self._log.read(_RECORD.size))[0]
+        self._index = open(index_path, "ab")
+        # The index has an entry for every INDEX_EVERY-th record. Drop a torn
+        # entry, or ones for records the log lost.
+        index_size = -(-self._count // INDEX_EVERY) * _INDEX.size
+        if os.path.getsize(index_path) > index_size:
+            self._index.truncate(index_size)
+        self._devices_file = open(devices_path, "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _device(self, id):
+        """Return the number of device id, registering it if it's new. Needs the lock."""
+        n = self._devices.get(id)
+        if n is None:
+            n = self._devices[id] = len(self._devices)
+            self._devices_file.write(id + "\n")
+            self._devices_file.flush()
+        return n
+
+    def append(self, id, door=None, position=None, charge=None, light=None, fan=None, t=None):
+        """Record one sample for device id, at time t (default: now)."""
+        with self._lock:
+            t = max(self._last, time.time() if t is None else t)
+            # Packed first, so a value that doesn't fit leaves nothing behind.
+            record = _RECORD.pack(t, self._device(id), _int(position), _int(door), _int(charge),
+                                  _int(light), _int(fan))
+            if self._count % INDEX_EVERY == 0:
+                self._index.write(_INDEX.pack(t, self._count))
+            self._log.write(record)
+            self._count += 1
+            self._last = t
+
+    def record(self, device, t=None):
+        """Record the current status of device."""
+        status = device.status
+        door, charger, light, fan = status.door, status.charger, status.light, status.fan
+        self.append(
+            status.id,
+            door=door.state if door is not None else None,
+            position=door.position if door is not None else None,
+            charge=charger.level if charger is not None else None,
+            light=light.on if light is not None else None,
+            fan=fan.speed if fan is not None else None,
+            t=t,
+        )
+
+    def listen(self, client):
+        """Record each of client's devices now, and again whenever an update changes it.
+
+        Returns:
+            A function that stops recording.
+        """
+        for device in client.devices:
+            if device.loaded:
+                self.record(device)
+        return client.subscribe(lambda update: self.record(update.device))
+
+    def flush(self):
+        """Write buffered samples to disk."""
+        with self._lock:
+            self._log.flush()
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            for f in (self._log, self._index, self._devices_file):
+                f.close()
+
+class History(object):
+    """Reads a history log written by a Recorder, through a memory map.
+
+    It sees the samples that were flushed when it was opened.
+
+    Attributes:
+        devices: The device ids, in the order they were first recorded.
+    """
+
+    def __init__(self, path):
+        self.path, index_path, devices_path = _paths(os.path.expanduser(path))
+        with open(devices_path) as f:
+            self.devices = [line.rstrip("\n") for line in f]
+        with open(index_path, "rb") as f:
+            raw = f.read()
+        entries = [_INDEX.unpack_from(raw, i) for i in range(0, len(raw) - len(raw) % _INDEX.size, _INDEX.size)]
+        self._index_times = [t for t, _ in entries]
+        self._index_records = [n for _, n in entries]
+        self._file = open(self.path, "rb")
+        size = os.path.getsize(self.path)
+        self._count = size // _RECORD.size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Arrays from query() still use it; it closes when they go.
+                pass
+        self._file.close()
+
+    def _time(self, n):
+        return struct.unpack_from("<d", self._map, n * _RECORD.size)[0]
+
+    def _first_at(self, t):
+        """Return the number of the first record at or after time t."""
+        # The index narrows it down to one block, then bisect within it.
+        i = bisect.bisect_left(self._index_times, t)
+        lo = self._index_records[i - 1] if i > 0 else 0
+        hi = self._index_records[i] if i < len(self._index_records) else self._count
+        hi = min(hi, self._count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, start, end):
+        if self._map is None:
+            return 0, 0
+        first = 0 if start is None else self._first_at(start)
+        last = self._count if end is None else self._first_at(end)
+        return first, max(first, last)
+
+    def samples(self, start=None, end=None):
+        """Iterate over the Samples from time start (inclusive) to end (exclusive)."""
+        first, last = self._range(start, end)
+        for n in range(first, last):
+            t, device, position, door, charge, light, fan = _RECORD.unpack_from(self._map, n * _RECORD.size)
+            yield Sample(t, self.devices[device], door, position, charge, light, fan)
+
+    def query(self, start=None, end=None, device=None):
+        """Return the samples from time start (inclusive) to end (exclusive) as arrays.
+
+        Args:
+            start: The earliest time, or None for the beginning.
+            end: The time to stop at, or None for the end.
+            device: Only return the samples of this device id.
+
+        Returns:
+            A dict from column ("time", "device", "door", "position", "charge",
+            "light", "fan") to a numpy array. Device numbers index devices.
+            The arrays are views of the memory map, not copies.
+        """
+        if np is None:
+            raise ImportError("History.query needs numpy")
+        first, last = self._range(start, end)
+        records = np.frombuffer(self._map, dtype=_DTYPE, count=last - first, offset=first * _RECORD.size) \
+            if last > first else np.zeros(0, dtype=_DTYPE)
+        if device is not None:
+            records = records[records["device"] == self.devices.index(device)]
+        return dict((name, records[name]) for name in _DTYPE.names if name != "pad")
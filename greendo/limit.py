@@ -0,0 +1,243 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client-side pacing of API requests and commands.
+
+Pass one RateLimiter as the limiter of every Client (or to a FleetManager,
+which passes it on) and their HTTP requests and web socket commands wait
+for a token from a global budget and from their account's:
+
+    limiter = RateLimiter(rate=50, per_account=5)
+    fleet = FleetManager(accounts, limiter=limiter)
+    ...
+    print(limiter.stats())
+
+The rates adapt, AIMD style: they creep up while requests go well, and are
+cut (at most once per cooldown) when a request fails, is throttled or takes
+longer than latency_limit.
+"""
+
+import threading
+import time
+
+from greendo.metrics import Hooks
+
+class RateLimited(Exception):
+    """Raised when no token comes up within the timeout."""
+
+class _Bucket(object):
+    """A token bucket whose rate adapts."""
+
+    def __init__(self, rate, burst, min_rate, max_rate):
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.decreased = 0.0
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate * self.burst)
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self):
+        """Return the seconds until there is a token."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def adapt(self, congested, increase, decrease, cooldown, now):
+        if congested:
+            if now - self.decreased >= cooldown:
+                self.rate = max(self.min_rate, self.rate * decrease)
+                self.tokens = min(self.tokens, self.capacity)
+                self.decreased = now
+        else:
+            # About increase more per second, at full rate.
+            self.rate = min(self.max_rate, self.rate + increase / self.rate)
+
+class RateLimiter(object):
+    """Token buckets for a global budget and per-account budgets, with AIMD rates.
+
+    It is thread-safe, and meant to be shared by every client in a process.
+
+    Attributes:
+        increase: How much a rate grows, in requests per second, over a
+            second of successful requests at that rate.
+        decrease: The factor a rate is cut by when a request is congested.
+        latency_limit: Seconds a request may take before it counts as
+            congested.
+        cooldown: The fewest seconds between cuts of a rate, so that one
+            burst of failures only cuts it once.
+        acquired: How many tokens have been handed out.
+        waited: The total seconds spent waiting for them.
+    """
+
+    def __init__(self, rate=20.0, per_account=None, burst=1.0, min_rate=0.5, max_rate=None,
+                 increase=1.0, decrease=0.5, latency_limit=5.0, cooldown=1.0):
+        """Make the limiter.
+
+        Args:
+            rate: The starting global rate, in requests per second, or None
+                for no global budget.
+            per_account: The starting rate of each account, or None for no
+                per-account budgets.
+            burst: How many seconds' worth of tokens a bucket holds.
+            min_rate: The lowest a rate is cut to.
+            max_rate: The highest a rate grows to. Defaults to 10 times its
+                starting rate.
+            increase: See the attributes.
+            decrease: See the attributes.
+            latency_limit: See the attributes.
+            cooldown: See the attributes.
+        """
+        if rate is None and per_account is None:
+            raise ValueError("a RateLimiter needs a global or per-account rate")
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_limit = latency_limit
+        self.cooldown = cooldown
+        self.acquired = 0
+        self.waited = 0.0
+        self._per_account = per_account
+        self._cond = threading.Condition()
+        self._global = self._bucket(rate) if rate is not None else None
+        self._accounts = {}
+        self._waiting = 0
+
+    def _bucket(self, rate):
+        return _Bucket(rate, self.burst, self.min_rate, self.max_rate if self.max_rate is not None else 10.0 * rate)
+
+    def _buckets(self, account):
+        """Return the buckets a request for account draws from. Needs the lock."""
+        buckets = []
+        if self._global is not None:
+            buckets.append(self._global)
+        if self._per_account is not None and account is not None:
+            bucket = self._accounts.get(account)
+            if bucket is None:
+                bucket = self._accounts[account] = self._bucket(self._per_account)
+            buckets.append(bucket)
+        return buckets
+
+    @property
+    def rate(self):
+        """The current global rate, or None if there is no global budget."""
+        return self._global.rate if self._global is not None else None
+
+    @property
+    def queued(self):
+        """How many requests are waiting for a token."""
+        return self._waiting
+
+    def account_rate(self, account):
+        """Return the current rate of account, or None if it has no budget (yet)."""
+        bucket = self._accounts.get(account)
+        return bucket.rate if bucket is not None else None
+
+    def acquire(self, account=None, timeout=None):
+        """Wait for a token for a request from account.
+
+        Args:
+            account: The username making the request, for its budget.
+            timeout: The most seconds to wait, or None to wait as long as it takes.
+
+        Returns:
+            The seconds waited.
+
+        Raises:
+            RateLimited: No token came up within timeout.
+        """
+        started = time.time()
+        deadline = None if timeout is None else started + timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.time()
+                    buckets = self._buckets(account)
+                    for bucket in buckets:
+                        bucket.refill(now)
+                    wait = max(bucket.wait() for bucket in buckets)
+                    if wait <= 0:
+                        for bucket in buckets:
+                            bucket.tokens -= 1
+                        self.acquired += 1
+                        self.waited += now - started
+                        return now - started
+                    if deadline is not None and now + wait > deadline:
+                        raise RateLimited("no token for {} within {}s".format(account, timeout))
+                    self._cond.wait(wait)
+            finally:
+                self._waiting -= 1
+
+    def report(self, account, latency, congested=False):
+        """Adapt the rates to how a request from account went.
+
+        Args:
+            account: The username that made the request.
+            latency: The seconds it took.
+            congested: Whether it failed in a way that suggests the server is
+                overloaded: throttled, timed out or dropped.
+        """
+        congested = congested or latency > self.latency_limit
+        with self._cond:
+            now = time.time()
+            for bucket in self._buckets(account):
+                bucket.adapt(congested, self.increase, self.decrease, self.cooldown, now)
+
+    def observe(self, account, hooks=None):
+        """Return hooks for a client of account that report its commands here.
+
+        Args:
+            account: The username of the client.
+            hooks: The client's own hooks, which are told everything as well.
+        """
+        return _CommandObserver(self, account, hooks)
+
+    def stats(self):
+        """Return the current rates, queue depth and totals as a dict."""
+        with self._cond:
+            return {
+                "rate": self.rate,
+                "queued": self._waiting,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "accounts": dict((account, bucket.rate) for account, bucket in self._accounts.items()),
+            }
+
+class _CommandObserver(Hooks):
+    """Reports how each command went to a RateLimiter, then passes it on."""
+
+    def __init__(self, limiter, account, hooks):
+        self._limiter = limiter
+        self._account = account
+        self._hooks = hooks
+
+    def on_http(self, endpoint, duration, sent, received, outcome):
+        if self._hooks is not None:
+            self._hooks.on_http(endpoint, duration, sent, received, outcome)
+
+    def on_ws(self, name, duration, sent, received, outcome):
+        # Pushes have nothing sent, and aren't paced.
+        if sent:
+            self._limiter.report(self._account, duration, outcome in ("timeout", "closed"))
+        if self._hooks is not None:
+            self._hooks.on_ws(name, duration, sent, received, outcome)
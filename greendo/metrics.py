@@ -0,0 +1,194 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timing instrumentation for clients.
+
+Pass a Metrics object as the hooks of a Client (or AsyncClient) and it records
+the duration, size and outcome of every HTTP request and web socket message:
+
+    metrics = Metrics()
+    client = greendo.Client(email, pwd, hooks=metrics)
+    ...
+    print(metrics.prometheus())
+
+Clients without hooks skip all of this.
+"""
+
+import threading
+
+from collections import Counter
+
+class Hooks(object):
+    """The observer interface clients report to. Every method does nothing.
+
+    Outcomes are "ok", "error" (the server reported an error), "timeout",
+    "closed" (the socket closed first) or the name of the exception raised.
+    """
+
+    def on_http(self, endpoint, duration, sent, received, outcome):
+        """Called after each HTTP request.
+
+        Args:
+            endpoint: The API path, e.g., "/login" or "/devices/{id}".
+            duration: Seconds from sending the request to reading the response.
+            sent: Bytes of request body sent.
+            received: Bytes of response body received.
+            outcome: How the request went.
+        """
+
+    def on_ws(self, name, duration, sent, received, outcome):
+        """Called after each web socket exchange, or pushed message.
+
+        Args:
+            name: The method, with the fields of module commands, e.g.,
+                "srvWebSocketAuth" or "gdoModuleCommand:lightState".
+            duration: Seconds from sending to the reply; 0 for pushes.
+            sent: Bytes sent.
+            received: Bytes received.
+            outcome: How the exchange went.
+        """
+
+class Histogram(object):
+    """A latency histogram with fixed, cumulative buckets, as Prometheus has them.
+
+    Attributes:
+        bounds: The upper bounds of the buckets, in seconds.
+        counts: How many observations fell at or below each bound.
+        count: How many observations there were.
+        sum: The total of the observations.
+    """
+
+    BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(self.bounds, self.counts)),
+        }
+
+class _Series(object):
+    """Everything recorded for one endpoint or message name."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.sent = 0
+        self.received = 0
+        self.outcomes = Counter()
+
+    def record(self, duration, sent, received, outcome):
+        self.latency.observe(duration)
+        self.sent += sent
+        self.received += received
+        self.outcomes[outcome] += 1
+
+    def snapshot(self):
+        return {
+            "latency": self.latency.snapshot(),
+            "sent_bytes": self.sent,
+            "received_bytes": self.received,
+            "outcomes": dict(self.outcomes),
+        }
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class Metrics(Hooks):
+    """Keeps latency histograms, byte counts and outcomes per endpoint and message.
+
+    It is thread-safe, so one Metrics can be shared by many clients.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._http = {}
+        self._ws = {}
+
+    def _record(self, table, key, duration, sent, received, outcome):
+        with self._lock:
+            series = table.get(key)
+            if series is None:
+                series = table[key] = _Series()
+            series.record(duration, sent, received, outcome)
+
+    def on_http(self, endpoint, duration, sent, received, outcome):
+        self._record(self._http, endpoint, duration, sent, received, outcome)
+
+    def on_ws(self, name, duration, sent, received, outcome):
+        self._record(self._ws, name, duration, sent, received, outcome)
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._http.clear()
+            self._ws.clear()
+
+    def snapshot(self):
+        """Return everything recorded so far as a dict.
+
+        Returns:
+            {"http": {endpoint: series}, "ws": {name: series}}, where each
+            series has "latency" (count, sum, buckets), "sent_bytes",
+            "received_bytes" and "outcomes".
+        """
+        with self._lock:
+            return {
+                "http": dict((k, v.snapshot()) for k, v in self._http.items()),
+                "ws": dict((k, v.snapshot()) for k, v in self._ws.items()),
+            }
+
+    def prometheus(self, prefix="greendo"):
+        """Return everything recorded so far in the Prometheus text format."""
+        snap = self.snapshot()
+        lines = []
+        for kind, label, unit in (("http", "endpoint", "request"), ("ws", "method", "message")):
+            series = snap[kind]
+            name = "{}_{}_{}".format(prefix, kind, unit)
+            lines.append("# HELP {}_duration_seconds Time taken by each {}.".format(name, unit))
+            lines.append("# TYPE {}_duration_seconds histogram".format(name))
+            for key in sorted(series):
+                latency = series[key]["latency"]
+                lbl = "{}=\"{}\"".format(label, _escape(key))
+                for bound in sorted(latency["buckets"]):
+                    lines.append("{}_duration_seconds_bucket{{{},le=\"{}\"}} {}".format(
+                        name, lbl, bound, latency["buckets"][bound]))
+                lines.append("{}_duration_seconds_bucket{{{},le=\"+Inf\"}} {}".format(name, lbl, latency["count"]))
+                lines.append("{}_duration_seconds_sum{{{}}} {}".format(name, lbl, latency["sum"]))
+                lines.append("{}_duration_seconds_count{{{}}} {}".format(name, lbl, latency["count"]))
+            lines.append("# HELP {}s_total Each {} by outcome.".format(name, unit))
+            lines.append("# TYPE {}s_total counter".format(name))
+            for key in sorted(series):
+                for outcome, count in sorted(series[key]["outcomes"].items()):
+                    lines.append("{}s_total{{{}=\"{}\",outcome=\"{}\"}} {}".format(
+                        name, label, _escape(key), _escape(outcome), count))
+            for direction in ("sent", "received"):
+                lines.append("# HELP {}_{}_bytes_total Bytes {}.".format(name, direction, direction))
+                lines.append("# TYPE {}_{}_bytes_total counter".format(name, direction))
+                for key in sorted(series):
+                    lines.append("{}_{}_bytes_total{{{}=\"{}\"}} {}".format(
+                        name, direction, label, _escape(key), series[key][direction + "_bytes"]))
+        return "\n".join(lines) + "\n"
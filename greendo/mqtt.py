@@ -0,0 +1,243 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bridges a Client to an MQTT broker, with paho-mqtt installed.
+
+Each field of each device is a retained topic, published only when it
+changes (see greendo.diff), in batches:
+
+    greendo/<varName>/position  ->  1523
+
+Commands published to greendo/<varName>/set/<command> are turned into
+Device commands and sent over the client's socket, e.g., "close" to
+greendo/<varName>/set/door, or "50" to greendo/<varName>/set/fan. See
+COMMANDS for the rest.
+
+    bridge = MQTTBridge(client, broker="localhost")
+    bridge.start()
+"""
+
+import json
+import logging
+import threading
+
+try:
+    import paho.mqtt.client as paho
+except ImportError:
+    paho = None
+
+from greendo import _bounded_map
+from greendo.diff import DiffEngine
+
+_log = logging.getLogger(__name__)
+
+def _on(payload):
+    value = payload.strip().lower()
+    if value in ("on", "true", "1"):
+        return True
+    if value in ("off", "false", "0"):
+        return False
+    raise ValueError("expected on or off, not {!r}".format(payload))
+
+_DOOR = {
+    "open": lambda d: d.cmd_open(),
+    "close": lambda d: d.cmd_close(),
+    "preset": lambda d: d.cmd_preset(),
+}
+
+def _door(device, payload):
+    command = _DOOR.get(payload.strip().lower())
+    if command is None:
+        raise ValueError("expected open, close or preset, not {!r}".format(payload))
+    return command(device)
+
+# Each command topic, and the function from the device and payload to the command.
+COMMANDS = {
+    "door": _door,
+    "light": lambda d, p: d.cmd_light(_on(p)),
+    "light_timer": lambda d, p: d.cmd_light_timer(int(p)),
+    "fan": lambda d, p: d.cmd_fan(int(p)),
+    "vacation": lambda d, p: d.cmd_vacation(_on(p)),
+    "motion": lambda d, p: d.cmd_motion(_on(p)),
+    "preset_position": lambda d, p: d.cmd_preset_pos(int(p)),
+}
+
+class MQTTBridge(object):
+    """Publishes device changes to MQTT, and runs the commands it receives.
+
+    Changes are collected for batch_interval seconds and published together;
+    a field that changes several times in a batch is only published once,
+    with its latest value.
+
+    Attributes:
+        client: The Client being bridged.
+        prefix: The first levels of every topic, such as "greendo" or
+            "home/garage".
+        batch_interval: Seconds to collect changes for before publishing.
+        refresh_interval: Seconds between fetching every device's details
+            again, on top of pushed updates, or None to rely on the pushes.
+        published: How many messages have been published.
+        batches: How many batches they were published in.
+        commands: How many commands have been sent.
+        errors: How many command messages couldn't be sent.
+    """
+
+    def __init__(self, client, broker="localhost", port=1883, prefix="greendo", batch_interval=0.5,
+                 refresh_interval=None, qos=0, mqtt_client=None):
+        """Set up the bridge; start() connects it.
+
+        Args:
+            client: See the attributes.
+            broker: The host of the MQTT broker.
+            port: Its port.
+            prefix: See the attributes.
+            batch_interval: See the attributes.
+            refresh_interval: See the attributes.
+            qos: The MQTT quality of service to publish and subscribe with.
+            mqtt_client: A paho Client to use, e.g., one set up with
+                credentials or TLS. By default a plain one is made.
+        """
+        if mqtt_client is None:
+            if paho is None:
+                raise ImportError("MQTTBridge needs paho-mqtt")
+            if hasattr(paho, "CallbackAPIVersion"):
+                mqtt_client = paho.Client(paho.CallbackAPIVersion.VERSION1)
+            else:
+                mqtt_client = paho.Client()
+        self.client = client
+        self.broker = broker
+        self.port = port
+        self.prefix = prefix
+        self.batch_interval = batch_interval
+        self.refresh_interval = refresh_interval
+        self.qos = qos
+        self.published = 0
+        self.batches = 0
+        self.commands = 0
+        self.errors = 0
+        self._mqtt = mqtt_client
+        self._mqtt.on_message = self._on_message
+        self._mqtt.on_connect = self._on_connect
+        self._engine = DiffEngine()
+        # The latest value of each changed (device, field) not yet published.
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._unsubscribe = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def topic(self, device_id, field):
+        """Return the topic a field of a device is published to."""
+        return "{}/{}/{}".format(self.prefix, device_id, field)
+
+    def start(self):
+        """Connect to the broker, publish every field once, and start bridging."""
+        self._stop.clear()
+        self._mqtt.connect(self.broker, self.port)
+        self._mqtt.loop_start()
+        self._unsubscribe = self.client.subscribe(lambda update: self._queue(self._engine.update(update.device)))
+        self._queue(self._engine.update_many(self.client.devices))
+        self.flush()
+        self._threads = [threading.Thread(target=self._publish_loop, name="greendo-mqtt")]
+        if self.refresh_interval:
+            self._threads.append(threading.Thread(target=self._refresh_loop, name="greendo-mqtt-refresh"))
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        """Publish what is pending, and disconnect."""
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        self.flush()
+        self._mqtt.loop_stop()
+        self._mqtt.disconnect()
+
+    def _on_connect(self, mqtt_client, userdata, flags, rc):
+        # Subscribing here subscribes again after paho reconnects.
+        mqtt_client.subscribe("{}/+/set/+".format(self.prefix), self.qos)
+
+    def _queue(self, changes):
+        if not changes:
+            return
+        with self._lock:
+            for change in changes:
+                self._pending[(change.device, change.field)] = change.new
+
+    def flush(self):
+        """Publish the pending changes now.
+
+        Returns:
+            How many messages were published.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        for (device_id, field), value in pending.items():
+            self._mqtt.publish(self.topic(device_id, field), json.dumps(value), self.qos, retain=True)
+        self.published += len(pending)
+        self.batches += 1
+        return len(pending)
+
+    def _publish_loop(self):
+        while not self._stop.wait(self.batch_interval):
+            try:
+                self.flush()
+            except Exception:
+                _log.exception("publishing to MQTT failed")
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                # Listeners hear about any changes, as for pushes.
+                _bounded_map(self.client.refresh, [d for d in self.client.devices if d.loaded],
+                             self.client.max_workers)
+            except Exception:
+                _log.exception("refreshing devices failed")
+
+    def _on_message(self, mqtt_client, userdata, message):
+        """Send the command in message. It runs on paho's thread, so it doesn't wait for the reply."""
+        # The prefix may have levels of its own, so it's stripped rather than split.
+        prefix = self.prefix + "/"
+        parts = message.topic[len(prefix):].split("/")
+        try:
+            if (not message.topic.startswith(prefix) or len(parts) != 3 or parts[1] != "set" or
+                    parts[2] not in COMMANDS):
+                raise ValueError("unknown command topic")
+            device = None
+            for d in self.client.devices:
+                if d.id == parts[0]:
+                    device = d
+                    break
+            if device is None:
+                raise ValueError("unknown device")
+            payload = message.payload.decode("utf8") if isinstance(message.payload, bytes) else message.payload
+            self.client.submit_command(COMMANDS[parts[2]](device, payload))
+            self.commands += 1
+        except Exception as e:
+            _log.warning("can't run MQTT command %s: %s", message.topic, e)
+            self.errors += 1
@@ -0,0 +1,337 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Captures real API traffic, and serves it back for tests and benchmarks.
+
+A Client given a TrafficRecorder writes every HTTP exchange and web socket
+frame to a capture file, one JSON event per line:
+
+    with TrafficRecorder("capture.jsonl") as recorder:
+        client = greendo.Client(email, pwd, record=recorder)
+        ...
+
+A ReplayServer serves the devices in a capture (with their real attribute
+trees), as many copies of them as wanted, and replays the pushed updates
+on the capture's timeline, sped up or not:
+
+    with ReplayServer("capture.jsonl", speed=10, copies=100) as server:
+        client = greendo.Client(server.username, server.password, **server.client_args())
+        server.play()
+
+Passwords and api keys are redacted from captures, and Set-Cookie headers
+left out. The rest, including device ids and names, is kept as it was.
+"""
+
+import copy
+import json
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+if sys.version_info[0] > 2:
+    from urllib.parse import urlsplit
+else:
+    from urlparse import urlsplit
+
+from greendo.fake import FakeServer
+
+# The keys whose values are kept out of captures.
+_SECRETS = frozenset(["password", "apiKey"])
+
+def _redact(value):
+    if isinstance(value, dict):
+        return dict((k, "<redacted>" if k in _SECRETS else _redact(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+def _redact_text(text):
+    """Return text with any secrets in it redacted, if it is JSON that might have some."""
+    if not text or not any(key in text for key in _SECRETS):
+        return text
+    try:
+        return json.dumps(_redact(json.loads(text)))
+    except ValueError:
+        return text
+
+def _text(data):
+    if data is None or isinstance(data, str):
+        return data
+    return data.decode("utf8", "replace")
+
+class TrafficRecorder(object):
+    """Writes a Client's traffic to a capture file, as JSON lines.
+
+    Each event has "t", the seconds since the recorder was made, and a
+    "type": "http" events have the "method", "path", request "body",
+    "status", response "headers" (without Set-Cookie), "response" body and
+    "duration"; "send" and "recv" events have the web socket frame "data".
+
+    It is thread-safe, so several clients can share one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, event):
+        event["t"] = round(time.time() - self._started, 6)
+        line = json.dumps(event, sort_keys=True)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def http(self, method, path, body, status, headers, response, duration):
+        """Record an HTTP exchange."""
+        self._write({
+            "type": "http",
+            "method": method,
+            "path": path,
+            "body": _redact_text(_text(body)),
+            "status": status,
+            "headers": dict((k, v) for k, v in headers if k.lower() != "set-cookie"),
+            "response": _redact_text(_text(response)),
+            "duration": round(duration, 6),
+        })
+
+    def frame(self, direction, data):
+        """Record a web socket frame; direction is "send" or "recv"."""
+        self._write({"type": direction, "data": _redact_text(_text(data))})
+
+    def transport(self, transport):
+        """Return transport, recording what goes through it."""
+        return _RecordingTransport(transport, self)
+
+    def socket(self, ws):
+        """Return the web socket ws, recording the frames on it."""
+        return _RecordingSocket(ws, self)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class _RecordingTransport(object):
+    def __init__(self, transport, recorder):
+        self._transport = transport
+        self._recorder = recorder
+
+    def open(self, req, cookie_jar):
+        started = time.time()
+        resp = self._transport.open(req, cookie_jar)
+        parts = urlsplit(req.get_full_url())
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        headers = resp.info()
+        self._recorder.http(req.get_method(), path, req.data, resp.getcode(),
+                            headers.items() if headers is not None else (), resp.read(), time.time() - started)
+        return resp
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+class _RecordingSocket(object):
+    def __init__(self, ws, recorder):
+        self._ws = ws
+        self._recorder = recorder
+
+    def send(self, data):
+        self._recorder.frame("send", data)
+        return self._ws.send(data)
+
+    def recv(self):
+        data = self._ws.recv()
+        if data:
+            self._recorder.frame("recv", data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+def read_capture(path):
+    """Return the events in a capture file, as dicts, oldest first."""
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda e: e["t"])
+    return events
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0.0
+
+class ReplayServer(FakeServer):
+    """A FakeServer with the devices, timing and pushed updates of a capture.
+
+    Commands are answered (and change the devices) as FakeServer answers
+    them, after the capture's median command latency.
+
+    Attributes:
+        events: The events of the capture.
+        speed: How many times faster than captured to replay, or None (or 0)
+            for as fast as possible.
+        copies: How many copies of each captured device there are.
+        played: How many pushed updates have been replayed, to each copy.
+    """
+
+    UPDATE_METHOD = "wskAttributeUpdateNtfy"
+
+    def __init__(self, capture, speed=1.0, copies=1, username="user@example.com", password="password", port=0):
+        """Load the capture and set up the server; it serves once started.
+
+        Args:
+            capture: The path to a capture file, or its events.
+            speed: See the attributes.
+            copies: See the attributes. Copies after the first have the
+                device ids and names of the originals with "-<n>" added.
+            username: The username of the account with the devices.
+            password: The password for username.
+            port: The local port to listen on. By default any free one.
+
+        Raises:
+            ValueError: The capture has no device details.
+        """
+        self.events = read_capture(capture) if isinstance(capture, str) else list(capture)
+        self.speed = speed
+        self.copies = copies
+        self.played = 0
+        metas, details, http, commands = self._scan()
+        if not details:
+            raise ValueError("the capture has no device details")
+        scale = (1.0 / speed) if speed else 0.0
+        super(ReplayServer, self).__init__(devices=0, latency=_median(http) * scale,
+                                           ws_latency=_median(commands) * scale,
+                                           username=username, password=password, port=port)
+        # The ids of the copies of each captured device.
+        self._copies = {}
+        # In the order of the device list, as details may be fetched in any order.
+        ids = [id for id in metas if id in details] + sorted(id for id in details if id not in metas)
+        for id in ids:
+            data = details[id]
+            meta = metas.get(id, {"varName": id, "name": id})
+            for n in range(copies):
+                if n == 0:
+                    self.devices.append((meta, data))
+                    self._copies[id] = [id]
+                    continue
+                copy_id = "{}-{}".format(id, n)
+                copy_meta = dict(meta, varName=copy_id, name="{}-{}".format(meta.get("name", id), n))
+                copy_data = copy.deepcopy(data)
+                copy_data["varName"] = copy_id
+                self.devices.append((copy_meta, copy_data))
+                self._copies[id].append(copy_id)
+        self._playing = None
+        self._stop_playing = threading.Event()
+
+    def _scan(self):
+        """Pick the device list, details and timings out of the events.
+
+        Returns:
+            The device metadata and details by id, the durations of the HTTP
+            requests and the times commands took to be answered.
+        """
+        metas, details, http, commands = OrderedDict(), {}, [], []
+        sent = {}
+        for event in self.events:
+            kind = event.get("type")
+            if kind == "http":
+                http.append(event.get("duration", 0.0))
+                path = event.get("path", "").split("?")[0].rstrip("/")
+                if event.get("status") != 200 or "/devices" not in path:
+                    continue
+                try:
+                    result = json.loads(event["response"])["result"]
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if path.endswith("/devices"):
+                    metas.update((meta["varName"], meta) for meta in result)
+                elif result:
+                    details[path.rsplit("/", 1)[1]] = result[0]
+            elif kind in ("send", "recv"):
+                try:
+                    msg = json.loads(event["data"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if kind == "send" and msg.get("method") == "gdoModuleCommand":
+                    sent[msg.get("id")] = event["t"]
+                elif kind == "recv" and msg.get("id") in sent:
+                    commands.append(event["t"] - sent.pop(msg["id"]))
+        return metas, details, http, commands
+
+    def updates(self):
+        """Return the captured pushed updates, as (time, device id, changes) tuples.
+
+        Changes are dicts from "module.field" to the new value, as push() takes.
+        """
+        updates = []
+        for event in self.events:
+            if event.get("type") != "recv" or self.UPDATE_METHOD not in event.get("data", ""):
+                continue
+            params = json.loads(event["data"]).get("params") or {}
+            id = params.get("varName") or params.get("topic", "").split(".")[0]
+            changes = dict((k, v["value"]) for k, v in params.items()
+                           if "." in k and isinstance(v, dict) and "value" in v)
+            if id in self._copies and changes:
+                updates.append((event["t"], id, changes))
+        return updates
+
+    def play(self, loop=False):
+        """Start pushing the captured updates, to every copy, on the capture's timeline.
+
+        Args:
+            loop: Start over when the updates run out, until stopped.
+        """
+        updates = self.updates()
+        self._stop_playing.clear()
+        self._playing = threading.Thread(target=self._play, args=(updates, loop), name="greendo-replay")
+        self._playing.daemon = True
+        self._playing.start()
+
+    def wait(self, timeout=None):
+        """Wait for play() to finish; returns whether it did."""
+        if self._playing is not None:
+            self._playing.join(timeout)
+            return not self._playing.is_alive()
+        return True
+
+    def _play(self, updates, loop):
+        if not updates:
+            return
+        first = updates[0][0]
+        while True:
+            started = time.time()
+            for t, id, changes in updates:
+                if self.speed:
+                    delay = started + (t - first) / self.speed - time.time()
+                    if delay > 0 and self._stop_playing.wait(delay):
+                        return
+                elif self._stop_playing.is_set():
+                    return
+                for copy_id in self._copies[id]:
+                    self.push(copy_id, changes)
+                    self.played += 1
+            if not loop:
+                return
+
+    def stop(self):
+        self._stop_playing.set()
+        self.wait()
+        super(ReplayServer, self).stop()
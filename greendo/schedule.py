@@ -0,0 +1,439 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs device commands on a schedule, inside one long-lived client.
+
+Rather than a cron job per change, each paying for a login and a device
+fetch, a Scheduler sends the commands over the socket of a client that is
+already connected:
+
+    client = greendo.Client(email, pwd, reconnect=greendo.Reconnect())
+    scheduler = Scheduler(client)
+    scheduler.add("0 22 * * *", "garage", greendo.Device.cmd_close, jitter=30)
+    scheduler.add("@daily", "garage", lambda d: d.cmd_light_timer(10))
+    scheduler.start()
+
+Commands for the same device run one at a time, in order. Anything with
+devices and send_command() can run them, such as a FleetManager.
+"""
+
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import sys
+import threading
+import time
+
+from collections import deque
+
+if sys.version_info[0] > 2:
+    import queue
+else:
+    import Queue as queue
+
+from greendo.metrics import Histogram
+
+_log = logging.getLogger(__name__)
+
+# What to do about the runs of a job missed by more than the grace period,
+# e.g., while the machine slept: skip them, run the job once for them all,
+# or run it once for each.
+MISSED_SKIP = "skip"
+MISSED_ONCE = "once"
+MISSED_ALL = "all"
+
+_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+def _field(text, lo, hi):
+    """Parse one cron field into the set of values it allows."""
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError("bad step in cron field {!r}".format(text))
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if not lo <= start <= end <= hi:
+            raise ValueError("cron field {!r} is out of range {}-{}".format(text, lo, hi))
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+class Cron(object):
+    """A cron schedule: "minute hour day-of-month month day-of-week", in local time.
+
+    Fields take "*", numbers, ranges ("1-5"), lists ("1,15") and steps
+    ("*/10"). Days of the week run from 0 (Sunday) to 7 (Sunday again). As
+    with cron, a day matches either day field when both are restricted. The
+    macros @yearly, @monthly, @weekly, @daily (or @midnight) and @hourly work
+    too.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        fields = _MACROS.get(spec, spec).split()
+        if len(fields) != 5:
+            raise ValueError("cron spec {!r} doesn't have 5 fields".format(spec))
+        self.minutes = _field(fields[0], 0, 59)
+        self.hours = _field(fields[1], 0, 23)
+        self.days = _field(fields[2], 1, 31)
+        self.months = _field(fields[3], 1, 12)
+        self.weekdays = frozenset(d % 7 for d in _field(fields[4], 0, 7))
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def __repr__(self):
+        return "Cron({!r})".format(self.spec)
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after):
+        """Return the first time (in seconds since the epoch) it fires after time after."""
+        t = datetime.datetime.fromtimestamp(int(after) // 60 * 60 + 60)
+        limit = t.year + 5
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return time.mktime(t.timetuple())
+        raise ValueError("cron spec {!r} never fires".format(self.spec))
+
+class Every(object):
+    """A schedule firing every so many seconds."""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("interval must be positive, not {}".format(seconds))
+        self.seconds = seconds
+
+    def __repr__(self):
+        return "Every({!r})".format(self.seconds)
+
+    def next(self, after):
+        return after + self.seconds
+
+class Job(object):
+    """A command run on a schedule, and how its runs have gone.
+
+    Attributes:
+        name: The name of the job, for stats and logs.
+        schedule: When it runs: a Cron or an Every.
+        device: The id (varName) of the device the command is for.
+        make_cmd: The function from the Device to the command.
+        jitter: The most seconds each run is randomly delayed by.
+        missed: The missed-run policy: MISSED_SKIP, MISSED_ONCE or MISSED_ALL.
+        next_run: When the job runs next, jitter included.
+        runs: How many times the command was sent.
+        failures: How many of those failed.
+        skipped: How many missed runs were skipped.
+        last_error: The exception of the last failure, or None.
+        lag: A Histogram of seconds from when each run was due to when its
+            command was sent.
+        duration: A Histogram of seconds from sending each command to its reply.
+    """
+
+    def __init__(self, name, schedule, device, make_cmd, jitter, missed):
+        self.name = name
+        self.schedule = schedule
+        self.device = device
+        self.make_cmd = make_cmd
+        self.jitter = jitter
+        self.missed = missed
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_error = None
+        self.lag = Histogram()
+        self.duration = Histogram()
+        # When the job is due next, before jitter; the schedule counts from it.
+        self._due = None
+        self._removed = False
+
+    def __repr__(self):
+        return "Job({!r}, {!r}, {!r})".format(self.name, self.schedule, self.device)
+
+    def _advance(self, after):
+        self._due = self.schedule.next(after)
+        self.next_run = self._due + random.uniform(0, self.jitter)
+
+    def snapshot(self):
+        """Return the job's stats as a dict."""
+        return {
+            "device": self.device,
+            "next_run": self.next_run,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_error": None if self.last_error is None else repr(self.last_error),
+            "lag": self.lag.snapshot(),
+            "duration": self.duration.snapshot(),
+        }
+
+class Scheduler(object):
+    """Runs Jobs over a client's socket, from a heap of due times.
+
+    A dispatcher thread sleeps until the next job is due, then hands the run
+    to its device's lane; a pool of worker threads sends the commands, one
+    lane at a time, so each device sees its commands in order and never two
+    at once.
+
+    Attributes:
+        client: The client (or FleetManager) sending the commands.
+        grace: Seconds a run may be late before it counts as missed.
+        timeout: Seconds to wait for each reply. Defaults to the client's
+            command_timeout.
+        jobs: The jobs, in the order they were added.
+    """
+
+    def __init__(self, client, workers=4, grace=60.0, timeout=None, clock=time.time):
+        """Set up the scheduler; start() starts running jobs.
+
+        Args:
+            client: The client sending the commands.
+            workers: The most commands to have in flight at once.
+            grace: Seconds a run may be late before it counts as missed.
+            timeout: Seconds to wait for each reply.
+            clock: The function returning the current time.
+        """
+        self.client = client
+        self.grace = grace
+        self.timeout = timeout
+        self.jobs = []
+        self._workers = workers
+        self._clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # Runs waiting for each device, and the devices with a run in progress
+        # or waiting for a worker.
+        self._lanes = {}
+        self._busy = set()
+        self._ready = queue.Queue()
+        self._threads = []
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add(self, schedule, device, make_cmd, name=None, jitter=0, missed=MISSED_ONCE):
+        """Schedule a command.
+
+        Args:
+            schedule: A cron spec (see Cron), a number of seconds between
+                runs, or an object with next(after) as Cron has.
+            device: The Device (or its id) to send the command to.
+            make_cmd: A function from the Device to the command, e.g.,
+                greendo.Device.cmd_close. It is called for each run, so the
+                command reflects the device as it is then.
+            name: The name of the job. Defaults to the schedule and device.
+            jitter: Delay each run randomly by up to this many seconds, so
+                that jobs due at once don't all hit the server at once.
+            missed: What to do about missed runs: MISSED_SKIP, MISSED_ONCE or
+                MISSED_ALL.
+
+        Returns:
+            The Job.
+        """
+        if missed not in (MISSED_SKIP, MISSED_ONCE, MISSED_ALL):
+            raise ValueError("unknown missed-run policy {!r}".format(missed))
+        if isinstance(schedule, str):
+            schedule = Cron(schedule)
+        elif isinstance(schedule, (int, float)):
+            schedule = Every(schedule)
+        device = getattr(device, "id", device)
+        if name is None:
+            name = "{} {}".format(getattr(schedule, "spec", schedule), device)
+        job = Job(name, schedule, device, make_cmd, jitter, missed)
+        with self._cond:
+            job._advance(self._clock())
+            self.jobs.append(job)
+            heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+            self._cond.notify()
+        return job
+
+    def remove(self, job):
+        """Unschedule job. A run already under way finishes."""
+        with self._cond:
+            job._removed = True
+            self.jobs.remove(job)
+
+    def start(self):
+        """Start the dispatcher and worker threads."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._threads = [threading.Thread(target=self._dispatch_loop, name="greendo-scheduler")]
+        for i in range(self._workers):
+            self._threads.append(threading.Thread(target=self._work, name="greendo-scheduler-{}".format(i)))
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def stop(self, timeout=None):
+        """Stop running jobs, waiting up to timeout seconds for runs under way."""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+        for _ in range(self._workers):
+            self._ready.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def run_pending(self):
+        """Hand every run that is due to its device's lane.
+
+        The dispatcher thread calls this whenever a job is due.
+
+        Returns:
+            The number of runs handed over.
+        """
+        handed = 0
+        with self._cond:
+            now = self._clock()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, job = heapq.heappop(self._heap)
+                if job._removed:
+                    continue
+                handed += self._due_runs(job, now)
+                heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+            self._cond.notify_all()
+        return handed
+
+    def _due_runs(self, job, now):
+        """Queue the runs of job that are due at now, and advance it. Needs the lock."""
+        runs = [job.next_run]
+        job._advance(job._due)
+        if now - runs[0] > self.grace:
+            # Missed: count the runs that were due meanwhile.
+            while job.next_run <= now:
+                runs.append(job.next_run)
+                job._advance(job._due)
+            if job.missed == MISSED_SKIP:
+                job.skipped += len(runs)
+                _log.warning("skipping %d missed runs of %s", len(runs), job.name)
+                return 0
+            if job.missed == MISSED_ONCE:
+                job.skipped += len(runs) - 1
+                runs = [now]
+        lane = self._lanes.setdefault(job.device, deque())
+        lane.extend((job, at) for at in runs)
+        if job.device not in self._busy:
+            self._busy.add(job.device)
+            self._ready.put(job.device)
+        return len(runs)
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                wait = self._heap[0][0] - self._clock() if self._heap else None
+                if wait is None or wait > 0:
+                    # Wake at least every second, in case the clock jumps.
+                    self._cond.wait(1.0 if wait is None else min(wait, 1.0))
+                    continue
+            self.run_pending()
+
+    def _device(self, id):
+        for device in self.client.devices:
+            if device.id == id:
+                return device
+        raise KeyError("no device {!r}".format(id))
+
+    def _work(self):
+        while True:
+            id = self._ready.get()
+            if id is None:
+                return
+            with self._cond:
+                job, at = self._lanes[id].popleft()
+            if not job._removed:
+                self._run(job, at)
+            with self._cond:
+                if self._lanes[id]:
+                    self._ready.put(id)
+                else:
+                    del self._lanes[id]
+                    self._busy.discard(id)
+                self._cond.notify_all()
+
+    def _run(self, job, at):
+        started = self._clock()
+        job.lag.observe(max(0, started - at))
+        try:
+            cmd = job.make_cmd(self._device(job.device))
+            self.client.send_command(cmd, self.timeout)
+        except Exception as e:
+            _log.warning("job %s failed: %s", job.name, e)
+            job.failures += 1
+            job.last_error = e
+        job.runs += 1
+        job.duration.observe(self._clock() - started)
+
+    def drain(self, timeout=None):
+        """Wait up to timeout seconds for every handed-over run to finish.
+
+        Returns:
+            Whether they all finished.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        """Return a dict from each job's name to its stats, as from Job.snapshot()."""
+        with self._cond:
+            return dict((job.name, job.snapshot()) for job in self.jobs)
@@ -0,0 +1,235 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Polls very large fleets from several worker processes.
+
+Parsing device details is CPU bound, so a single process polling thousands
+of devices is limited by the GIL. A ShardedPoller spreads the accounts over
+worker processes, each with a FleetManager of its own, and the workers send
+back compact Status tuples for the devices that changed:
+
+    with ShardedPoller(accounts, processes=4, interval=30) as poller:
+        for status in poller.updates():
+            print(status.device, status.door)
+"""
+
+import logging
+import multiprocessing
+import sys
+import time
+
+from collections import namedtuple
+
+if sys.version_info[0] > 2:
+    import queue
+else:
+    import Queue as queue
+
+from greendo.fleet import FleetManager
+
+_log = logging.getLogger(__name__)
+
+class Status(namedtuple("Status", "device door position charge light fan")):
+    """The polled status of one device. Missing modules give None.
+
+    Attributes:
+        device: The device id (varName).
+        door: The door state, as from door_status().
+        position: The door position, as from door_pos().
+        charge: The backup battery level, as from level().
+        light: Whether the light is on.
+        fan: The fan speed.
+    """
+
+def _status(device):
+    """Return the Status of device, as a plain tuple so it pickles small."""
+    door, charger, light, fan = device.door, device.charger, device.light, device.fan
+    return (
+        device.id,
+        door.door_status() if door is not None else None,
+        door.door_pos() if door is not None else None,
+        charger.level() if charger is not None else None,
+        light.on() if light is not None else None,
+        fan.speed() if fan is not None else None,
+    )
+
+def _poll(shard, accounts, interval, max_concurrency, client_args, out, stop):
+    """Run in a worker process: poll accounts until stop is set.
+
+    Everything is reported to out as tuples: ("error", username, message),
+    ("status", shard, refreshed, [status, ...]) after each round, and
+    finally ("done", shard).
+    """
+    try:
+        fleet = FleetManager(accounts, max_concurrency=max_concurrency, **client_args)
+    except Exception as e:
+        out.put(("error", None, "{}: {}".format(type(e).__name__, e)))
+        out.put(("done", shard))
+        return
+    for username, e in fleet.errors.items():
+        out.put(("error", username, "{}: {}".format(type(e).__name__, e)))
+    last = {}
+    try:
+        while not stop.is_set():
+            started = time.time()
+            try:
+                fleet.refresh()
+            except Exception as e:
+                out.put(("error", None, "{}: {}".format(type(e).__name__, e)))
+            changed = []
+            for device in fleet.devices:
+                status = _status(device)
+                if last.get(status[0]) != status:
+                    last[status[0]] = status
+                    changed.append(status)
+            out.put(("status", shard, len(last), changed))
+            stop.wait(max(0, interval - (time.time() - started)))
+    finally:
+        fleet.close()
+        out.put(("done", shard))
+
+class ShardedPoller(object):
+    """Polls accounts from a pool of worker processes.
+
+    Attributes:
+        processes: The number of worker processes.
+        status: A dict from device id to its latest Status, as far as
+            updates() or read() have read.
+        errors: A dict from username (or None, for errors not tied to an
+            account) to the last error message a worker reported.
+        polled: How many device statuses the workers have polled, as far as
+            updates() or read() have read.
+    """
+
+    def __init__(self, accounts, processes=None, interval=10, max_concurrency=16, **client_args):
+        """Set up the poller; start() starts the workers.
+
+        Args:
+            accounts: A dict (or iterable of pairs) from username to password.
+            processes: The number of worker processes. Defaults to the number
+                of CPUs.
+            interval: Seconds between the starts of each worker's polls.
+            max_concurrency: The most requests each worker makes at once.
+            client_args: More keyword arguments for each Client. They must
+                pickle.
+        """
+        accounts = list(accounts.items() if isinstance(accounts, dict) else accounts)
+        self.processes = max(1, min(processes or multiprocessing.cpu_count(), len(accounts)))
+        # Deal the accounts out like cards, so the shards are even.
+        self._shards = [accounts[i::self.processes] for i in range(self.processes)]
+        self.interval = interval
+        self.max_concurrency = max_concurrency
+        self._client_args = client_args
+        self._queue = None
+        self._stop = None
+        self._workers = []
+        self._running = 0
+        self.status = {}
+        self.errors = {}
+        self.polled = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Start the worker processes."""
+        self._queue = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        for shard, accounts in enumerate(self._shards):
+            worker = multiprocessing.Process(
+                target=_poll, name="greendo-poller-{}".format(shard),
+                args=(shard, accounts, self.interval, self.max_concurrency, self._client_args,
+                      self._queue, self._stop))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self._running = len(self._workers)
+
+    def _handle(self, msg):
+        """Take in a message from a worker, returning the Statuses in it."""
+        kind = msg[0]
+        if kind == "status":
+            self.polled += msg[2]
+            statuses = [Status._make(s) for s in msg[3]]
+            for status in statuses:
+                self.status[status.device] = status
+            return statuses
+        if kind == "error":
+            _log.warning("polling %s failed: %s", msg[1], msg[2])
+            self.errors[msg[1]] = msg[2]
+        elif kind == "done":
+            self._running -= 1
+        return []
+
+    def updates(self, timeout=None):
+        """Iterate over the Status of each device as it changes.
+
+        The first poll of each device counts as a change.
+
+        Args:
+            timeout: Stop after this many seconds without a message from
+                any worker, or None to keep going until they all stop.
+
+        Returns:
+            An iterator of Status.
+        """
+        while self._running > 0:
+            try:
+                msg = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+            for status in self._handle(msg):
+                yield status
+
+    def read(self, duration):
+        """Read what the workers report for duration seconds.
+
+        Returns:
+            The Statuses that changed meanwhile, oldest first.
+        """
+        changed = []
+        deadline = time.time() + duration
+        while self._running > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                msg = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            changed.extend(self._handle(msg))
+        return changed
+
+    def stop(self, timeout=10):
+        """Stop the workers, waiting up to timeout seconds for them to log out."""
+        if self._stop is None:
+            return
+        self._stop.set()
+        deadline = time.time() + timeout
+        # Workers can't exit while what they queued is unread.
+        while self._running > 0 and time.time() < deadline:
+            try:
+                self._handle(self._queue.get(timeout=max(0, deadline - time.time())))
+            except queue.Empty:
+                break
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.time()))
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self._stop = None
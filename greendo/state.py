@@ -0,0 +1,182 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar fleet status for vectorized queries, with numpy installed.
+
+A FleetState keeps one row per device and one numpy array per value, so
+questions about a whole fleet are array expressions rather than loops:
+
+    state = FleetState(fleet.devices)
+    low = state.select((state.door == DOOR_OPEN) & (state.charge < 20))
+    by_site = state.groupby("position", lambda id: sites[id])
+
+Missing values are -1 in the integer columns and NaN in the others.
+"""
+
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Values of the door column, as the server reports the door state.
+DOOR_CLOSED = 0
+DOOR_OPEN = 1
+DOOR_CLOSING = 2
+DOOR_OPENING = 3
+
+def _column(name):
+    return property(lambda self: self._columns[name][:self._size],
+                    doc="The {} of each device, by row.".format(name.replace("_", " ")))
+
+class FleetState(object):
+    """A table of device status, one row per device.
+
+    Attributes:
+        ids: The device id of each row.
+        door: The door state of each row, one of the DOOR_ constants.
+        position: The door position.
+        max_position: The maximum door position.
+        op_mode: The door operating mode; see _Door.door_error.
+        charge: The backup battery level, 0 to 100.
+        light: 1 if the light is on, else 0.
+        fan: The fan speed, 0 to 100.
+    """
+
+    # Each column and its type. Integer columns use -1 for missing values.
+    COLUMNS = (
+        ("door", "int8"),
+        ("position", "float32"),
+        ("max_position", "float32"),
+        ("op_mode", "int8"),
+        ("charge", "float32"),
+        ("light", "int8"),
+        ("fan", "float32"),
+    )
+
+    door = _column("door")
+    position = _column("position")
+    max_position = _column("max_position")
+    op_mode = _column("op_mode")
+    charge = _column("charge")
+    light = _column("light")
+    fan = _column("fan")
+
+    def __init__(self, devices=(), capacity=64):
+        """Make the table, with a row for each of devices.
+
+        Args:
+            devices: Devices to add rows for.
+            capacity: How many rows to make room for at first. The table
+                grows as needed.
+        """
+        if np is None:
+            raise ImportError("FleetState needs numpy")
+        self.ids = []
+        self._rows = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._columns = dict((name, self._empty(dtype, capacity)) for name, dtype in self.COLUMNS)
+        self.update_many(devices)
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _empty(dtype, n):
+        return np.full(n, -1 if dtype.startswith("int") else np.nan, dtype=dtype)
+
+    def _grow(self):
+        capacity = 2 * len(self._columns["door"])
+        for name, dtype in self.COLUMNS:
+            column = self._empty(dtype, capacity)
+            column[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = column
+
+    def row(self, device):
+        """Return the row of device (a Device, or its id), or None."""
+        return self._rows.get(getattr(device, "id", device))
+
+    def update(self, device):
+        """Set the row of device from its current status, adding the row if need be.
+
+        Returns:
+            The row.
+        """
+        status = device.status
+        door, charger, light, fan = status.door, status.charger, status.light, status.fan
+        values = (
+            ("door", door and door.state),
+            ("position", door and door.position),
+            ("max_position", door and door.max_position),
+            ("op_mode", door and door.op_mode),
+            ("charge", charger and charger.level),
+            ("light", light and light.on),
+            ("fan", fan and fan.speed),
+        )
+        with self._lock:
+            row = self._rows.get(status.id)
+            if row is None:
+                if self._size == len(self._columns["door"]):
+                    self._grow()
+                row = self._rows[status.id] = self._size
+                self.ids.append(status.id)
+                self._size += 1
+            for name, value in values:
+                column = self._columns[name]
+                if value is None:
+                    value = -1 if column.dtype.kind == "i" else np.nan
+                column[row] = value
+        return row
+
+    def update_many(self, devices):
+        """Update the rows of devices."""
+        for device in devices:
+            if device.loaded:
+                self.update(device)
+
+    def listen(self, client):
+        """Keep the rows of client's devices current with pushed updates.
+
+        Returns:
+            A function that stops listening.
+        """
+        self.update_many(client.devices)
+        return client.subscribe(lambda update: self.update(update.device))
+
+    def select(self, mask):
+        """Return the ids of the rows where mask (a boolean array) is true."""
+        return [self.ids[i] for i in np.flatnonzero(mask)]
+
+    def groupby(self, column, key, aggregate=None):
+        """Aggregate a column per group of devices, e.g., average position per site.
+
+        Args:
+            column: The name of the column.
+            key: A function from a device id to its group.
+            aggregate: A function from an array of values to one value. By
+                default the mean, ignoring missing values.
+
+        Returns:
+            A dict from each group to its aggregate.
+        """
+        if aggregate is None:
+            aggregate = np.nanmean
+        values = getattr(self, column)
+        if values.dtype.kind == "i":
+            values = np.where(values < 0, np.nan, values)
+        labels = [key(id) for id in self.ids]
+        groups, inverse = np.unique(np.array(labels, dtype=object), return_inverse=True)
+        return dict((group, aggregate(values[inverse == i])) for i, group in enumerate(groups))
@@ -7,4 +7,5 @@ setup(
     license='Apache License 2.0',
     long_description='a client library for the RYOBI GDO (Garage Door Opener)',
     install_requires=['websocket-client',],
+    extras_require={'async': ['aiohttp',], 'fast': ['orjson',], 'numpy': ['numpy',], 'mqtt': ['paho-mqtt',],},
 )
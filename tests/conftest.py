@@ -0,0 +1,6 @@
+import sys
+
+# AsyncClient is Python 3 only.
+collect_ignore = []
+if sys.version_info[0] < 3:
+    collect_ignore.append("test_aio.py")
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from greendo.aio import AsyncClient
+from greendo.fake import FakeServer
+
+@pytest.fixture
+def server():
+    with FakeServer(devices=3) as s:
+        yield s
+
+def test_async_client(server):
+    async def run():
+        async with AsyncClient(server.username, server.password, **server.client_args()) as c:
+            device = c.devices[0]
+            resp = await c.send_command(device.cmd_light(True), timeout=5)
+            assert resp["result"]["topic"] == device.id
+            return [d.id for d in c.devices]
+
+    ids = asyncio.run(run())
+    assert ids == [meta["varName"] for meta, _ in server.devices]
+    assert server.counts["logout"] == 1
+
+def test_async_updates(server):
+    async def run():
+        async with AsyncClient(server.username, server.password, **server.client_args()) as c:
+            device = c.devices[2]
+            updates = await c.updates(timeout=5)
+            await c.send_command(device.cmd_light(True), timeout=5)
+            update = await updates.__anext__()
+            await updates.aclose()
+            return update.device is device, device.light.on()
+
+    assert asyncio.run(run()) == (True, True)
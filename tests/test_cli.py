@@ -0,0 +1,82 @@
+import os
+import runpy
+import socket
+import stat
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import greendo
+from greendo.fake import FakeServer
+
+if sys.version_info[0] > 2:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+# The command line tool, which the greendo package hides from imports.
+cli = runpy.run_path(os.path.join(os.path.dirname(__file__), "..", "greendo.py"), run_name="greendo_cli")
+
+@pytest.fixture
+def server():
+    with FakeServer(devices=2) as s:
+        yield s
+
+@pytest.fixture
+def daemon(server, tmpdir):
+    path = str(tmpdir.join("greendo.sock"))
+    client = greendo.Client(server.username, server.password, reconnect=greendo.Reconnect(),
+                            **server.client_args())
+    thread = threading.Thread(target=cli["serve"], args=(client, path))
+    thread.daemon = True
+    thread.start()
+    deadline = time.time() + 5
+    while not os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.01)
+    yield client, path
+    client.close()
+
+def test_forwarded_output_matches_direct(server, daemon):
+    client, path = daemon
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    for argv in (["status", "door"], ["--email", server.username, "--dev", "1", "status", "light"]):
+        args = cli["parser"]().parse_args(["--socket", path] + argv)
+        reply = cli["forward"](args)
+        out = StringIO()
+        cli["run"](args, client, out)
+        assert reply == {"output": out.getvalue(), "error": None}
+
+def test_forward_skips_daemon_of_other_account(daemon):
+    _, path = daemon
+    args = cli["parser"]().parse_args(["--socket", path, "--email", "other@example.com", "status", "door"])
+    assert cli["forward"](args) is None
+
+def test_forward_gives_up_on_stuck_daemon(tmpdir):
+    path = str(tmpdir.join("greendo.sock"))
+    # Accepts connections, but never answers them.
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    try:
+        args = cli["parser"]().parse_args(["--socket", path, "status", "door"])
+        started = time.time()
+        assert cli["forward"](args, timeout=0.2) is None
+        assert time.time() - started < 5
+    finally:
+        listener.close()
+
+def test_serve_keeps_what_it_does_not_own(server, daemon, tmpdir):
+    client, path = daemon
+    with pytest.raises(ValueError):
+        cli["serve"](client, path)
+    assert stat.S_ISSOCK(os.stat(path).st_mode)
+    other = str(tmpdir.join("notes"))
+    with open(other, "w") as f:
+        f.write("keep")
+    with pytest.raises(ValueError):
+        cli["serve"](client, other)
+    with open(other) as f:
+        assert f.read() == "keep"
@@ -0,0 +1,40 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import greendo
+from greendo.fake import FakeServer
+from greendo.fleet import FleetManager
+
+@pytest.fixture
+def server():
+    with FakeServer(devices=2) as s:
+        s.add_account("other@example.com", devices=3)
+        yield s
+
+@pytest.fixture
+def fleet(server):
+    accounts = [(server.username, server.password), ("other@example.com", "password"), ("bad@example.com", "nope")]
+    f = FleetManager(accounts, max_concurrency=4, **server.client_args())
+    yield f
+    f.close()
+
+def test_start_keeps_going_past_bad_accounts(fleet):
+    assert list(fleet.clients) == ["user@example.com", "other@example.com"]
+    assert isinstance(fleet.errors["bad@example.com"], greendo.ResponseError)
+    assert len(fleet.devices) == 5
+
+def test_commands_go_to_owning_account(server, fleet):
+    device = fleet.clients["other@example.com"].devices[2]
+    fleet.send_command(device.cmd_light(True), timeout=5)
+    assert fleet.client_for(device) is fleet.clients["other@example.com"]
+    assert server.counts["ws_auth"] == 1
+
+def test_broadcast(server, fleet):
+    replies = fleet.broadcast(lambda device: device.cmd_open(), timeout=5)
+    assert list(replies) == [d.id for d in fleet.devices]
+    assert all(r["result"]["topic"] == id for id, r in replies.items())
+    fleet.refresh()
+    assert set(s.door for s in fleet.status().values()) == set([greendo._Door.OPEN])
@@ -1,21 +1,360 @@
+import json
 import os
 import sys
+import threading
+import time
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import pytest
+
 import greendo
+from greendo.fake import FakeServer
+
+@pytest.fixture
+def server():
+    with FakeServer(devices=3) as s:
+        yield s
 
-USERNAME='TODO'
-PASSWORD='TODO'
-client = greendo.Client(USERNAME, PASSWORD)
-devices = client.devices[-1]
+@pytest.fixture
+def client(server):
+    c = greendo.Client(server.username, server.password, **server.client_args())
+    yield c
+    c.close()
 
-def test_door_status():
+def test_door_status(client):
+    devices = client.devices[-1]
     print(devices.door.door_status())
     assert devices.door.door_status() == greendo._Door.CLOSED
 
-def test_light_status():
+def test_light_status(client):
+    devices = client.devices[-1]
     print(devices.light.on())
     assert devices.light.on() == False
 
-def test_turn_light_on():
-    client.send_command(devices.cmd_light(False))
+def test_turn_light_on(client):
+    devices = client.devices[-1]
+    resp = client.send_command(devices.cmd_light(False), timeout=5)
+    assert resp["result"]["topic"] == devices.id
+
+def test_devices_keep_order(server, client):
+    assert [d.id for d in client.devices] == [meta["varName"] for meta, _ in server.devices]
+
+def test_device_error_names_device(server):
+    meta, _ = server.devices[1]
+    server.devices[1] = (meta, None)
+    with pytest.raises(greendo.ResponseError) as e:
+        greendo.Client(server.username, server.password, **server.client_args())
+    assert meta["varName"] in e.value.reason
+
+def test_status_does_not_open_socket(server, client):
+    client.devices[0].door.door_status()
+    assert server.counts["ws_connect"] == 0
+
+def test_session_store_skips_login(server, tmpdir):
+    store = greendo.SessionStore(str(tmpdir.join("session")))
+    greendo.Client(server.username, server.password, session_store=store, **server.client_args()).close()
+    greendo.Client(server.username, session_store=store, **server.client_args()).close()
+    assert server.counts["login"] == 1
+
+def test_session_store_logs_in_again_when_rejected(server, tmpdir):
+    store = greendo.SessionStore(str(tmpdir.join("session")))
+    greendo.Client(server.username, server.password, session_store=store, **server.client_args()).close()
+    server.expire_sessions()
+    c = greendo.Client(server.username, server.password, session_store=store, **server.client_args())
+    c.send_command(c.devices[0].cmd_light(True), timeout=5)
+    c.close()
+    assert server.counts["login"] == 2
+
+def test_session_store_concurrent_saves(tmpdir):
+    path = str(tmpdir.join("session"))
+    errors = []
+    def save(n):
+        # A store each, as separate processes would have.
+        try:
+            greendo.SessionStore(path).save("user{}".format(n), greendo.Session("key{}".format(n), None), [])
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=save, args=(n,)) for n in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    store = greendo.SessionStore(path)
+    assert all(store.has("user{}".format(n)) for n in range(16))
+    assert [name for name in os.listdir(str(tmpdir)) if name.endswith(".tmp")] == []
+
+def test_pipelined_commands(client):
+    device = client.devices[0]
+    futures = [client.submit_command(device.cmd_fan(speed)) for speed in range(20)]
+    replies = [f.result(5) for f in futures]
+    assert [r["id"] for r in replies] == [f.id for f in futures]
+
+def test_push_updates_device(server, client):
+    device = client.devices[1]
+    updates = client.updates(timeout=5)
+    server.push(device.id, {device.door.key + ".doorState": 1})
+    update = next(updates)
+    assert update.device is device
+    assert update.changes == [greendo.Change(device.door.key, "doorState", 0, 1)]
+    assert device.door.door_status() == greendo._Door.OPEN
+
+def test_wait_for_state(client):
+    device = client.devices[0]
+    client.send_command(device.cmd_open(), timeout=5)
+    assert client.wait_for_state(device, greendo._Door.OPEN, timeout=5)
+    assert device.door.door_pos() == device.door.door_max()
+
+def test_wait_for_position_follows_pushes(server, client):
+    device = client.devices[0]
+    unsubscribe = client.subscribe(lambda update: None)
+    client.send_command(device.cmd_open(), timeout=5)
+    assert client.wait_for_position(device, device.door.door_max(), timeout=5, poll_interval=60)
+    assert server.counts["device"] == 3
+    unsubscribe()
+
+def test_apply_update_changes_device(client):
+    device = client.devices[1]
+    changes = device.apply_update({device.door.key + ".doorState": {"value": 1}, "topic": "ignored"})
+    assert changes == [greendo.Change(device.door.key, "doorState", 0, 1)]
+    assert device.door.door_status() == greendo._Door.OPEN
+    assert device.apply_update({device.door.key + ".doorState": {"value": 1}}) == []
+
+def test_connection_pool_reuses_connections(server):
+    pool = greendo.ConnectionPool()
+    c = greendo.Client(server.username, server.password, max_workers=1, transport=pool, **server.client_args())
+    c.refresh(c.devices[0])
+    c.close()
+    # The login, device list, details, refresh and logout all went over one connection.
+    assert server.counts["connection"] == 1
+
+def test_connection_pool_limits_connections_per_host(server):
+    server.latency = 0.05
+    pool = greendo.ConnectionPool(max_per_host=2)
+    c = greendo.Client(server.username, server.password, max_workers=8, transport=pool, **server.client_args())
+    c.close()
+    assert server.counts["connection"] == 2
+
+def test_connection_pool_retries_stale_connection(server):
+    server.keep_alive = False
+    pool = greendo.ConnectionPool()
+    c = greendo.Client(server.username, server.password, max_workers=1, transport=pool, **server.client_args())
+    c.refresh(c.devices[0])
+    c.close()
+    # Each idle connection was found closed, and the request sent on a new one.
+    assert server.counts["connection"] == 7
+    assert server.counts["device"] == 4
+
+def test_connection_pool_resends_only_idempotent_requests(server):
+    pool = greendo.ConnectionPool()
+    jar = greendo.CookieJar()
+    pool.open(greendo.Request(server.api_url + "/devices"), jar)
+    # Each fails on the idle connection after the server has acted on it.
+    server.drop_replies = 1
+    assert pool.open(greendo.Request(server.api_url + "/devices"), jar).getcode() == 401
+    server.drop_replies = 1
+    login = greendo.Request(server.api_url + "/login", data=b'{}', headers={"Content-Type": "application/json"})
+    with pytest.raises((greendo.HTTPException, IOError)):
+        pool.open(login, jar)
+    assert server.counts["login"] == 1
+    assert server.counts["connection"] == 2
+
+def test_device_selector_fetches_one_device(server):
+    c = greendo.Client(server.username, server.password, device=1, **server.client_args())
+    assert server.counts["device"] == 1
+    assert [d.loaded for d in c.devices] == [False, True, False]
+    assert c.devices[2].door.door_status() == greendo._Door.CLOSED
+    assert server.counts["device"] == 2
+    c.close()
+
+def test_device_selector_past_the_end_picks_last(server):
+    c = greendo.Client(server.username, server.password, device=5, **server.client_args())
+    assert [d.loaded for d in c.devices] == [False, False, True]
+    c.close()
+
+def test_device_selector_by_name(server):
+    meta, _ = server.devices[2]
+    c = greendo.Client(server.username, server.password, device=meta["varName"], **server.client_args())
+    assert [d.loaded for d in c.devices] == [False, False, True]
+    c.load()
+    assert all(d.loaded for d in c.devices)
+    assert server.counts["device"] == 3
+    c.close()
+
+def test_reconnect_after_drop(server):
+    c = greendo.Client(server.username, server.password, reconnect=greendo.Reconnect(initial=0.2),
+                       **server.client_args())
+    device = c.devices[0]
+    c.send_command(device.cmd_light(True), timeout=5)
+    server.drop_sockets()
+    # Sent while the socket is down, so queued until it is back.
+    assert c.send_command(device.cmd_light(False), timeout=5)["result"]
+    assert server.counts["ws_auth"] == 2
+    assert server.counts["login"] == 1
+    c.close()
+
+def test_reconnect_logs_in_when_key_rejected(server):
+    c = greendo.Client(server.username, server.password, reconnect=greendo.Reconnect(initial=0.05),
+                       **server.client_args())
+    c.send_command(c.devices[0].cmd_light(True), timeout=5)
+    server.expire_sessions()
+    server.drop_sockets()
+    c.send_command(c.devices[0].cmd_light(False), timeout=5)
+    assert server.counts["login"] == 2
+    c.close()
+
+def test_commands_queue_while_reconnecting(server):
+    c = greendo.Client(server.username, server.password, reconnect=greendo.Reconnect(initial=0.05),
+                       **server.client_args())
+    device = c.devices[0]
+    c.send_command(device.cmd_light(True), timeout=5)
+    server.expire_sessions()
+    server.latency = 1.0
+    server.drop_sockets()
+    # Long enough for the reconnect to be logging in again.
+    time.sleep(0.3)
+    started = time.time()
+    future = c.submit_command(device.cmd_light(False))
+    assert time.time() - started < 0.5
+    assert future.result(5)["result"]
+    server.latency = 0.0
+    c.close()
+
+def test_coalesce_keeps_last_write_and_door_order(client):
+    device = client.devices[0]
+    batch = [device.cmd_fan(10), device.cmd_open(), device.cmd_fan(20), device.cmd_light(True),
+             device.cmd_preset_pos(5), device.cmd_close(), device.cmd_fan(30), device.cmd_light(False)]
+    sent, slots = greendo._coalesce(batch)
+    assert sent == [batch[1], batch[4], batch[5], batch[6], batch[7]]
+    assert slots == [3, 0, 3, 4, 1, 2, 3, 4]
+
+def test_send_commands(server, client):
+    device = client.devices[0]
+    replies = client.send_commands([device.cmd_fan(speed) for speed in range(5)] + [device.cmd_open()], timeout=5)
+    assert len(replies) == 6
+    assert replies[0] is replies[4]
+    assert server.counts["command"] == 2
+
+def test_command_queue(server, client):
+    device = client.devices[0]
+    queue = greendo.CommandQueue(client, window=0.05)
+    futures = [queue.submit(device.cmd_light(i % 2 == 0)) for i in range(5)]
+    assert all(f.result(5)["result"] for f in futures)
+    assert server.counts["command"] == 1
+
+@pytest.mark.parametrize("codec", ["json", "orjson"])
+def test_encoded_commands_round_trip(client, codec):
+    if codec == "orjson":
+        pytest.importorskip("orjson")
+    old = greendo.get_codec()
+    greendo.set_codec(codec)
+    try:
+        device = client.devices[0]
+        for cmd in [device.cmd_fan(40), device.cmd_light(True), device.cmd_light(False), {"method": "other"}]:
+            msg = dict(cmd, id=7)
+            assert json.loads(client._encode_command(msg)) == msg
+    finally:
+        greendo.set_codec(old)
+
+def test_encoded_commands_ignore_key_order(server, client):
+    old = greendo.get_codec()
+    greendo.set_codec("json")
+    try:
+        device = client.devices[0]
+        cmd = device.cmd_light(True)
+        params = cmd["params"]
+        # The same module, with its keys in another order.
+        reordered = {"params": dict((k, params[k]) for k in reversed(list(params))), "method": cmd["method"],
+                     "jsonrpc": cmd["jsonrpc"]}
+        assert client.send_command(reordered, timeout=5)["result"]
+        assert client.send_command(device.cmd_light(False), timeout=5)["result"]
+        msg = dict(cmd, id=7)
+        assert json.loads(client._encode_command(msg)) == msg
+    finally:
+        greendo.set_codec(old)
+
+def test_status_snapshot_follows_updates(client):
+    device = client.devices[0]
+    status = device.door.status
+    assert device.door.status is status
+    device.apply_update({device.door.key + ".doorState": {"value": 1}})
+    assert status.state == 0
+    assert device.door.status.state == 1
+    assert device.status.door is device.door.status
+
+def test_compact_device(server):
+    c = greendo.Client(server.username, server.password, keep_raw=False, **server.client_args())
+    device = c.devices[0]
+    assert device.door.key not in device.data["attributes"]
+    assert device.door.door_status() == greendo._Door.CLOSED
+    assert device.door.maybe("doorState", "value") == 0
+    updates = c.updates(timeout=5)
+    c.send_command(device.cmd_open(), timeout=5)
+    update = next(updates)
+    assert greendo.Change(device.door.key, "doorState", 0, 1) in update.changes
+    assert device.door.door_status() == greendo._Door.OPEN
+    c.close()
+
+def test_compact_device_lacks_raw_fields(server):
+    c = greendo.Client(server.username, server.password, keep_raw=False, **server.client_args())
+    device = c.devices[0]
+    assert device.door.maybe("doorState", "lastSet") is None
+    assert device.door.maybe("doorPosition") is None
+    assert device.door.maybe("doorState", "value") == 0
+    c.close()
+
+def test_response_cache(server, tmpdir):
+    path = str(tmpdir.join("cache"))
+    cache = greendo.ResponseCache(path=path)
+    store = greendo.SessionStore(str(tmpdir.join("session")))
+    greendo.Client(server.username, server.password, session_store=store, cache=cache,
+                   **server.client_args()).close()
+    assert cache.stats()["misses"] == 4
+
+    # A later run skips fetching the details, and refresh() revalidates. The
+    # device list is revalidated, to check that the session is still good.
+    cache = greendo.ResponseCache(path=path)
+    c = greendo.Client(server.username, session_store=store, cache=cache, **server.client_args())
+    assert server.counts["devices"] == 2 and server.counts["device"] == 3
+    assert cache.stats()["hits"] == 3 and cache.stats()["revalidated"] == 1
+    c.refresh(c.devices[0])
+    assert server.counts["not_modified"] == 2
+    c.close()
+
+def test_response_cache_does_not_vouch_for_session(server, tmpdir):
+    cache = greendo.ResponseCache()
+    store = greendo.SessionStore(str(tmpdir.join("session")))
+    greendo.Client(server.username, server.password, session_store=store, cache=cache,
+                   **server.client_args()).close()
+    server.expire_sessions()
+    c = greendo.Client(server.username, server.password, session_store=store, cache=cache,
+                       **server.client_args())
+    assert server.counts["login"] == 2
+    c.close()
+
+def test_response_cache_concurrent_saves(tmpdir):
+    cache = greendo.ResponseCache(path=str(tmpdir.join("cache")))
+    cache.fetch("u", "/devices", lambda headers: greendo._HTTPResponse(200, {}, b"[]"))
+    errors = []
+    def save():
+        try:
+            cache.save()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=save) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert greendo.ResponseCache(path=str(tmpdir.join("cache"))).stats()["entries"] == 1
+
+def test_response_cache_evicts_least_recently_used():
+    cache = greendo.ResponseCache(max_bytes=10)
+    send = lambda body: lambda headers: greendo._HTTPResponse(200, {}, body)
+    cache.fetch("u", "/devices/a", send(b"12345"))
+    cache.fetch("u", "/devices/b", send(b"12345"))
+    cache.fetch("u", "/devices/a", send(b"never"))
+    cache.fetch("u", "/devices/c", send(b"12345"))
+    assert cache.fetch("u", "/devices/a", send(b"never")).read() == b"12345"
+    assert cache.fetch("u", "/devices/b", send(b"again")).read() == b"again"
@@ -0,0 +1,74 @@
+import os
+import struct
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import greendo
+from greendo import history
+from greendo.fake import fake_device
+from greendo.history import History, Recorder
+
+def test_record_and_query(tmpdir, monkeypatch):
+    monkeypatch.setattr(history, "INDEX_EVERY", 16)
+    path = str(tmpdir.join("history.log"))
+    with Recorder(path) as recorder:
+        for i in range(100):
+            recorder.append("dev{}".format(i % 3), door=i % 2, position=i, charge=50, t=1000.0 + i)
+    # Reopening appends, and times never go backwards.
+    with Recorder(path) as recorder:
+        device = greendo.Device(*fake_device(0))
+        recorder.record(device, t=500.0)
+
+    with History(path) as h:
+        assert len(h) == 101
+        assert h.devices == ["dev0", "dev1", "dev2", device.id]
+        samples = list(h.samples(1010.0, 1013.0))
+        assert [s.position for s in samples] == [10, 11, 12]
+        assert samples[0] == history.Sample(1010.0, "dev1", 0, 10, 50, -1, -1)
+        last = list(h.samples(1099.0))
+        assert [s.device for s in last] == ["dev0", device.id]
+        assert last[1].time == 1099.0
+
+        np = pytest.importorskip("numpy")
+        columns = h.query(1020.0, 1050.0, device="dev2")
+        assert list(columns["position"]) == [i for i in range(20, 50) if i % 3 == 2]
+        assert np.all(columns["charge"] == 50)
+        assert len(h.query(2000.0)["time"]) == 0
+
+def test_torn_record(tmpdir):
+    path = str(tmpdir.join("history.log"))
+    with Recorder(path) as recorder:
+        recorder.append("dev", door=1, t=1.0)
+    with open(path, "ab") as f:
+        f.write(b"\0\0\0")
+    with Recorder(path) as recorder:
+        recorder.append("dev", door=0, t=2.0)
+    with History(path) as h:
+        assert [(s.time, s.door) for s in h.samples()] == [(1.0, 1), (2.0, 0)]
+
+def test_failed_append_leaves_no_index_entry(tmpdir):
+    path = str(tmpdir.join("history.log"))
+    with Recorder(path) as recorder:
+        with pytest.raises(struct.error):
+            recorder.append("dev", position=1 << 20, t=1.0)
+        recorder.append("dev", position=5, t=2.0)
+    assert os.path.getsize(path + ".idx") == history._INDEX.size
+    with History(path) as h:
+        assert [(s.time, s.position) for s in h.samples()] == [(2.0, 5)]
+
+def test_torn_index_entry(tmpdir, monkeypatch):
+    monkeypatch.setattr(history, "INDEX_EVERY", 2)
+    path = str(tmpdir.join("history.log"))
+    with Recorder(path) as recorder:
+        for i in range(3):
+            recorder.append("dev", position=i, t=float(i))
+    with open(path + ".idx", "ab") as f:
+        f.write(b"\0\0\0")
+    with Recorder(path) as recorder:
+        for i in range(3, 6):
+            recorder.append("dev", position=i, t=float(i))
+    assert os.path.getsize(path + ".idx") == 3 * history._INDEX.size
+    with History(path) as h:
+        assert [s.position for s in h.samples(3.0)] == [3, 4, 5]
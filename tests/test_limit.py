@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import greendo
+from greendo.fake import FakeServer
+from greendo.fleet import FleetManager
+from greendo.limit import RateLimited, RateLimiter
+from greendo.metrics import Metrics
+
+def test_paces_requests():
+    limiter = RateLimiter(rate=50, burst=0.1)
+    started = time.time()
+    for _ in range(15):
+        limiter.acquire()
+    # 5 tokens in the bucket, then one every 20ms.
+    assert time.time() - started >= 0.18
+    assert limiter.acquired == 15
+    with pytest.raises(RateLimited):
+        limiter.acquire(timeout=0)
+
+def test_aimd():
+    limiter = RateLimiter(rate=10, per_account=4, min_rate=1, max_rate=12, cooldown=60)
+    limiter.acquire("a")
+    limiter.report("a", 0.1, congested=True)
+    # A burst of failures only cuts the rates once per cooldown.
+    limiter.report("a", 0.1, congested=True)
+    assert (limiter.rate, limiter.account_rate("a")) == (5, 2)
+    for _ in range(20):
+        limiter.report("a", 0.1)
+    assert 8 < limiter.rate < 9
+    assert 6 < limiter.account_rate("a") < 7
+    # Too slow counts as congested; the global rate is still cooling down.
+    limiter.report("b", 60.0)
+    assert limiter.account_rate("b") == 2
+    assert 8 < limiter.rate < 9
+    stats = limiter.stats()
+    assert stats["queued"] == 0
+    assert sorted(stats["accounts"]) == ["a", "b"]
+
+def test_fleet_shares_limiter():
+    with FakeServer(devices=2) as server:
+        server.add_account("other@example.com", devices=2)
+        limiter = RateLimiter(rate=1000, per_account=100)
+        metrics = Metrics()
+        accounts = [(server.username, server.password), ("other@example.com", "password")]
+        with FleetManager(accounts, limiter=limiter, hooks=metrics, **server.client_args()) as fleet:
+            # A login, the device list and two details for each account.
+            assert limiter.acquired == 8
+            fleet.broadcast(lambda device: device.cmd_light(True), timeout=5)
+            assert limiter.acquired == 12
+        assert set(limiter.stats()["accounts"]) == set(dict(accounts))
+        assert metrics.snapshot()["ws"]["gdoModuleCommand:lightState"]["outcomes"] == {"ok": 4}
+
+def test_subscriptions_are_not_paced():
+    with FakeServer(devices=3) as server:
+        limiter = RateLimiter(rate=1000)
+        c = greendo.Client(server.username, server.password, limiter=limiter,
+                           reconnect=greendo.Reconnect(initial=0.05), **server.client_args())
+        acquired = limiter.acquired
+        # Sent with the client's lock held, so waiting for tokens would hold up replies.
+        c.subscribe(lambda update: None)
+        server.drop_sockets()
+        c.send_command(c.devices[0].cmd_light(True), timeout=5)
+        assert limiter.acquired == acquired + 1
+        c.close()
+
+def test_login_for_first_socket_is_not_paced(tmpdir):
+    with FakeServer() as server:
+        limiter = RateLimiter(rate=1000)
+        store = greendo.SessionStore(str(tmpdir.join("session")))
+        greendo.Client(server.username, server.password, session_store=store, **server.client_args()).close()
+        c = greendo.Client(server.username, server.password, session_store=store, limiter=limiter,
+                           **server.client_args())
+        server.expire_sessions()
+        acquired = limiter.acquired
+        # The socket connects with the client's lock held, and logs in again.
+        c.send_command(c.devices[0].cmd_light(True), timeout=5)
+        assert server.counts["login"] == 2
+        assert limiter.acquired == acquired + 1
+        c.close()
@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import greendo
+from greendo.fake import FakeServer
+from greendo.metrics import Metrics
+
+@pytest.fixture
+def server():
+    with FakeServer(devices=2) as s:
+        yield s
+
+def test_metrics_record_requests_and_commands(server):
+    metrics = Metrics()
+    client = greendo.Client(server.username, server.password, hooks=metrics, **server.client_args())
+    client.send_command(client.devices[0].cmd_light(True), timeout=5)
+    client.close()
+
+    snap = metrics.snapshot()
+    assert snap["http"]["/login"]["outcomes"] == {"ok": 1}
+    assert snap["http"]["/devices/{id}"]["latency"]["count"] == 2
+    assert snap["ws"]["srvWebSocketAuth"]["outcomes"] == {"ok": 1}
+    command = snap["ws"]["gdoModuleCommand:lightState"]
+    assert command["outcomes"] == {"ok": 1}
+    assert command["sent_bytes"] > 0 and command["received_bytes"] > 0
+
+def test_metrics_prometheus_text():
+    metrics = Metrics()
+    metrics.on_http("/login", 0.02, 10, 20, "ok")
+    metrics.on_http("/login", 2.0, 10, 0, "error")
+    text = metrics.prometheus()
+    assert 'greendo_http_request_duration_seconds_bucket{endpoint="/login",le="0.025"} 1' in text
+    assert 'greendo_http_request_duration_seconds_count{endpoint="/login"} 2' in text
+    assert 'greendo_http_requests_total{endpoint="/login",outcome="error"} 1' in text
+    assert 'greendo_http_request_sent_bytes_total{endpoint="/login"} 20' in text
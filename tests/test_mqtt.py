@@ -0,0 +1,106 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from collections import namedtuple
+
+import greendo
+from greendo.diff import DiffEngine, FieldChange
+from greendo.fake import FakeServer, fake_device
+from greendo.mqtt import MQTTBridge
+
+def test_diff_engine():
+    engine = DiffEngine()
+    device = greendo.Device(*fake_device(0))
+    first = engine.update(device)
+    assert [c.field for c in first] == ["door", "position", "light", "fan", "charge", "alarm", "motion"]
+    assert engine.update(device) == []
+    device.apply_update({
+        device.door.key + ".doorPosition": {"value": 10},
+        device.fan.key + ".speed": {"value": 50},
+        device.light.key + ".lightTimer": {"value": 5},  # Not a compared field.
+    })
+    assert engine.update(device) == [
+        FieldChange(device.id, "position", 0, 10),
+        FieldChange(device.id, "fan", 0, 50),
+    ]
+    engine.forget(device.id)
+    assert len(engine.update(device)) == 7
+
+Message = namedtuple("Message", "topic payload")
+
+class Broker(object):
+    """Stands in for a paho Client, keeping what is published."""
+
+    def __init__(self):
+        self.retained = {}
+        self.published = []
+        self.subscribed = []
+
+    def connect(self, host, port):
+        self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic, qos):
+        self.subscribed.append(topic)
+
+    def publish(self, topic, payload, qos, retain=False):
+        self.published.append(topic)
+        if retain:
+            self.retained[topic] = payload
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+def test_bridge():
+    with FakeServer(devices=2) as server:
+        client = greendo.Client(server.username, server.password, **server.client_args())
+        broker = Broker()
+        bridge = MQTTBridge(client, batch_interval=60, mqtt_client=broker)
+        bridge.start()
+        device = client.devices[1]
+        assert broker.subscribed == ["greendo/+/set/+"]
+        assert len(broker.retained) == 14
+        assert broker.retained["greendo/{}/light".format(device.id)] == "false"
+        assert bridge.batches == 1
+
+        broker.on_message(broker, None, Message("greendo/{}/set/light".format(device.id), b"on"))
+        broker.on_message(broker, None, Message("greendo/{}/set/door".format(device.id), b"open"))
+        broker.on_message(broker, None, Message("greendo/{}/set/fan".format(device.id), b"fast"))
+        broker.on_message(broker, None, Message("greendo/nope/set/light", b"on"))
+        assert (bridge.commands, bridge.errors) == (2, 2)
+        assert client.wait_for_state(device, greendo._Door.OPEN, timeout=5)
+
+        published = len(broker.published)
+        bridge.stop()
+        # Only what changed, and each field once per batch however often it changed.
+        topics = broker.published[published:]
+        assert "greendo/{}/light".format(device.id) in topics
+        assert "greendo/{}/fan".format(device.id) not in topics
+        assert len(topics) == len(set(topics))
+        assert broker.retained["greendo/{}/light".format(device.id)] == "true"
+        assert bridge.batches == 2
+        client.close()
+
+def test_bridge_multi_level_prefix():
+    with FakeServer() as server:
+        client = greendo.Client(server.username, server.password, **server.client_args())
+        broker = Broker()
+        bridge = MQTTBridge(client, prefix="home/garage", batch_interval=60, mqtt_client=broker)
+        bridge.start()
+        device = client.devices[0]
+        assert broker.subscribed == ["home/garage/+/set/+"]
+        assert broker.retained["home/garage/{}/light".format(device.id)] == "false"
+
+        broker.on_message(broker, None, Message("home/garage/{}/set/door".format(device.id), b"open"))
+        broker.on_message(broker, None, Message("home/{}/set/door".format(device.id), b"open"))
+        broker.on_message(broker, None, Message("home/garage/x/{}/set/door".format(device.id), b"open"))
+        assert (bridge.commands, bridge.errors) == (1, 2)
+        assert client.wait_for_state(device, greendo._Door.OPEN, timeout=5)
+        bridge.stop()
+        client.close()
@@ -0,0 +1,49 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import greendo
+from greendo.fake import FakeServer
+from greendo.replay import ReplayServer, TrafficRecorder, read_capture
+
+def capture(tmpdir):
+    path = str(tmpdir.join("capture.jsonl"))
+    with FakeServer(devices=2) as server, TrafficRecorder(path) as recorder:
+        client = greendo.Client(server.username, server.password, record=recorder, **server.client_args())
+        device = client.devices[0]
+        client.send_command(device.cmd_light(True), timeout=5)
+        client.subscribe(lambda update: None)
+        server.push(device.id, {device.door.key + ".doorPosition": 100})
+        server.push(device.id, {device.door.key + ".doorPosition": 200})
+        assert client.wait_for_position(device, 200, timeout=5)
+        client.close()
+    return path
+
+def test_record(tmpdir):
+    path = capture(tmpdir)
+    events = read_capture(path)
+    kinds = [e["type"] for e in events]
+    assert kinds[:4] == ["http"] * 4
+    assert "send" in kinds and "recv" in kinds
+    login = events[0]
+    assert login["path"] == "/api/login"
+    assert "password" not in login["body"].replace('"password": "<redacted>"', "")
+    assert '"apiKey": "<redacted>"' in login["response"]
+    assert all("Set-Cookie" not in e.get("headers", {}) for e in events)
+
+def test_replay(tmpdir):
+    path = capture(tmpdir)
+    with ReplayServer(path, speed=None, copies=3) as server:
+        assert len(server.devices) == 6
+        assert server.updates()[0][2] == {"garageDoor_7.doorPosition": 100}
+        client = greendo.Client(server.username, server.password, **server.client_args())
+        assert [d.id for d in client.devices][:3] == ["{:032x}".format(1) + s for s in ("", "-1", "-2")]
+        copy = client.devices[1]
+        assert copy.door.key == "garageDoor_7"
+        client.subscribe(lambda update: None)
+        server.play()
+        assert server.wait(5)
+        assert server.played == 6
+        assert client.wait_for_position(copy, 200, timeout=5)
+        client.send_command(copy.cmd_fan(50), timeout=5)
+        client.close()
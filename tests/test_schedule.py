@@ -0,0 +1,85 @@
+import datetime
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import greendo
+from greendo.fake import FakeServer
+from greendo.schedule import MISSED_ALL, MISSED_ONCE, MISSED_SKIP, Cron, Scheduler
+
+def local(*args):
+    return time.mktime(datetime.datetime(*args).timetuple())
+
+def test_cron_next():
+    assert Cron("30 22 * * *").next(local(2024, 3, 1, 12, 0)) == local(2024, 3, 1, 22, 30)
+    assert Cron("30 22 * * *").next(local(2024, 3, 1, 22, 30)) == local(2024, 3, 2, 22, 30)
+    assert Cron("*/15 9-17 * * 1-5").next(local(2024, 3, 1, 17, 50)) == local(2024, 3, 4, 9, 0)  # Fri -> Mon
+    assert Cron("@monthly").next(local(2024, 12, 31, 23, 59)) == local(2025, 1, 1, 0, 0)
+    # Both day fields restricted: either matches.
+    assert Cron("0 0 13 * 5").next(local(2024, 9, 1, 0, 0)) == local(2024, 9, 6, 0, 0)
+    assert Cron("0 0 29 2 *").next(local(2025, 1, 1)) == local(2028, 2, 29)
+    for bad in ("* * *", "60 * * * *", "* * * * 8", "*/0 * * * *", "0 0 31 2 *"):
+        with pytest.raises(ValueError):
+            Cron(bad).next(local(2024, 1, 1))
+
+class Clock(object):
+    def __init__(self):
+        self.now = local(2024, 3, 1, 12, 0)
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def client():
+    with FakeServer(devices=2) as server:
+        c = greendo.Client(server.username, server.password, **server.client_args())
+        yield server, c
+        c.close()
+
+def test_runs_jobs_per_device(client):
+    server, c = client
+    clock = Clock()
+    scheduler = Scheduler(c, workers=2, grace=600, clock=clock)
+    close = scheduler.add(60, c.devices[0], greendo.Device.cmd_close, name="close")
+    light = scheduler.add("*/5 * * * *", c.devices[1].id, lambda d: d.cmd_light_timer(10), name="light")
+    with scheduler:
+        assert scheduler.run_pending() == 0
+        clock.now += 60
+        assert scheduler.run_pending() == 1
+        clock.now += 240
+        assert scheduler.run_pending() == 5
+        assert scheduler.drain(5)
+    assert (close.runs, light.runs) == (5, 1)
+    assert server.counts["command"] == 6
+    stats = scheduler.stats()
+    assert stats["close"]["failures"] == 0
+    assert stats["close"]["duration"]["count"] == 5
+    assert stats["light"]["next_run"] == local(2024, 3, 1, 12, 10)
+
+@pytest.mark.parametrize("missed, runs, skipped", [(MISSED_SKIP, 0, 10), (MISSED_ONCE, 1, 9), (MISSED_ALL, 10, 0)])
+def test_missed_runs(client, missed, runs, skipped):
+    _, c = client
+    clock = Clock()
+    scheduler = Scheduler(c, grace=30, clock=clock)
+    job = scheduler.add(60, c.devices[0], lambda d: d.cmd_fan(50), missed=missed)
+    with scheduler:
+        clock.now += 630
+        scheduler.run_pending()
+        assert scheduler.drain(5)
+    assert (job.runs, job.skipped) == (runs, skipped)
+    assert job.next_run == clock.now + 30
+
+def test_failures_are_recorded(client):
+    _, c = client
+    clock = Clock()
+    scheduler = Scheduler(c, clock=clock)
+    job = scheduler.add(60, "no-such-device", greendo.Device.cmd_open)
+    with scheduler:
+        clock.now += 60
+        scheduler.run_pending()
+        assert scheduler.drain(5)
+    assert (job.runs, job.failures) == (1, 1)
+    assert isinstance(job.last_error, KeyError)
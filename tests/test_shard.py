@@ -0,0 +1,24 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import greendo
+from greendo.fake import FakeServer
+from greendo.shard import ShardedPoller
+
+def test_poller_reports_every_device():
+    with FakeServer(devices=2) as server:
+        server.add_account("other@example.com", devices=3)
+        server.add_account("third@example.com", devices=1)
+        accounts = [(username, password) for username, (password, _) in server.accounts.items()]
+        expected = set(meta["varName"] for _, (_, devices) in server.accounts.items() for meta, _ in devices)
+        with ShardedPoller(accounts, processes=2, interval=0.1, **server.client_args()) as poller:
+            seen = set()
+            for status in poller.updates(timeout=10):
+                seen.add(status.device)
+                if seen == expected:
+                    break
+        assert seen == expected
+        assert poller.status[status.device].door == greendo._Door.CLOSED
+        assert not poller.errors
+        assert server.counts["login"] == 3
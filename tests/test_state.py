@@ -0,0 +1,37 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import greendo
+from greendo.fake import fake_device
+from greendo.state import DOOR_OPEN, FleetState
+
+def devices(n):
+    return [greendo.Device(*fake_device(i)) for i in range(n)]
+
+def test_filter_and_group():
+    fleet = devices(100)
+    for i, device in enumerate(fleet):
+        device.apply_update({
+            device.door.key + ".doorState": {"value": i % 2},
+            device.charger.key + ".chargeLevel": {"value": i},
+        })
+    state = FleetState(fleet, capacity=8)
+    assert len(state) == 100
+    low = state.select((state.door == DOOR_OPEN) & (state.charge < 20))
+    assert low == [d.id for d in fleet[1:20:2]]
+    means = state.groupby("charge", lambda id: state.row(id) % 2)
+    assert means == {0: 49.0, 1: 50.0}
+
+def test_update_row():
+    fleet = devices(3)
+    state = FleetState(fleet)
+    device = fleet[1]
+    device.apply_update({device.door.key + ".doorPosition": {"value": 42}})
+    assert state.update(device) == 1
+    assert len(state) == 3
+    assert state.position[1] == 42